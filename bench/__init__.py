@@ -0,0 +1,549 @@
+"""
+Synthetic Campbell TOA5 data, and a benchmark harness for the buoy pipeline.
+
+The files in `buoys/data` only span about a year of hourly samples, which
+hides anything that scales badly. The generator writes realistic logger
+files at any duration, interval, and station count:
+
+- the same environment line and three header rows as the loggers,
+- `"NAN"` tokens for missing values,
+- recoveries that overlap the previous one by a few days,
+- firmware changes that add and remove columns, and restart `RECORD`.
+
+Column names, units, and typical values come from the most recent real
+file for each table, so QARTOD configurations apply unchanged.
+
+The harness times the hot stages at multiples of the current volume, and
+with more stations sharing the data directory, and appends the results to
+a JSON lines file, so runs can be compared across commits and machines:
+
+```bash
+penbay bench run --scale 1 --scale 10 --scale 100
+penbay bench run --scale 1 --stations 2 --stations 24 --stations 48
+penbay bench compare
+```
+
+Commands only accept the real stations, so those are the ones timed. The
+extra stations are files that every directory scan and file cache has to
+get past, like a deployment of dozens of buoys.
+"""
+
+import csv
+import json
+import platform
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Optional
+import click
+from numpy import nan, pi, sin
+from numpy.random import default_rng
+from pandas import (
+    DataFrame,
+    __version__ as pandas_version,
+    concat,
+    date_range,
+    read_json,
+    to_numeric,
+)
+import buoys
+from buoys import (
+    StationName,
+    TableName,
+    buoys_file_export,
+    buoys_plot_tail,
+    format_column_standard_name,
+    load_and_subset_multifile_table,
+    parsed_files,
+    read_campbell_logger_files,
+)
+from buoys.qartod import load_and_merge_qa_configs, run_qartod_tests
+
+BENCH_DIR = Path(__file__).parent
+DATA_DIR = BENCH_DIR / "data"
+RESULTS_PATH = BENCH_DIR / "results.jsonl"
+# About the span of the recoveries in buoys/data, which is 1x the current volume
+BASE_DAYS = 450
+# Generated data ends at the most recent real recovery
+END = datetime(2026, 8, 16, 8)
+# Columns that only exist in one of two alternating firmware versions
+FIRMWARE_COLUMNS = {
+    TableName.DIAGNOSTIC: ["SensorHoldPowerOn"],
+    TableName.SONDE: ["NitraLED"],
+}
+# Prefix of extra station names, which can't contain a real station name,
+# because files are matched to stations by substring
+SYNTHETIC_STATION = "Synthetic"
+STAGES = [
+    "read_campbell_logger_files",
+    "load_and_subset_multifile_table",
+    "run_qartod_tests",
+    "export",
+    "plot_tail",
+]
+
+
+class Template:
+    """
+    Header rows from the most recent real file of a table that has every
+    firmware column, and robust statistics of each column across all
+    real files. Columns that never had data are always `NAN`.
+    """
+
+    def __init__(self, table: TableName):
+        files = sorted(
+            buoys.DATA_DIR.glob(f"*_{table.value}_*.dat"),
+            key=lambda path: path.stem.split("_")[2],
+        )
+        for path in reversed(files):
+            with open(path, "r", encoding="utf-8", newline="") as fid:
+                reader = csv.reader(fid)
+                self.environment = next(reader)
+                self.headers = [next(reader) for _ in range(3)]
+            if set(FIRMWARE_COLUMNS[table]) <= set(self.headers[0]):
+                break
+        df = read_campbell_logger_files(files)
+        numeric = df.apply(to_numeric, errors="coerce")
+        self.columns = self.headers[0][2:]
+        # Units of some columns changed between firmware versions
+        center = numeric.median().groupby(level=0).mean()
+        self.center = center.reindex(self.columns).to_numpy()
+        # Spread of the central 80%, scaled to match a normal standard deviation
+        spread = (
+            ((numeric.quantile(0.9) - numeric.quantile(0.1)) / 2.56)
+            .groupby(level=0)
+            .mean()
+        )
+        self.spread = spread.reindex(self.columns).to_numpy()
+
+
+def generate_station_table(
+    directory: Path,
+    station: str,
+    table: TableName,
+    start: datetime,
+    end: datetime,
+    interval: timedelta = timedelta(hours=1),
+    recovery: timedelta = timedelta(days=30),
+    overlap: timedelta = timedelta(days=2),
+    firmware_every: int = 3,
+    nan_fraction: float = 0.02,
+    seed: int = 0,
+) -> list[Path]:
+    """
+    Write synthetic logger files for one station table, one per recovery.
+    Values follow an annual cycle with noise around typical values. Each
+    recovery repeats the last days of the previous one, with identical
+    values, as the logger does when its memory isn't cleared. Firmware
+    versions alternate every few recoveries.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    template = Template(table)
+    directory.mkdir(parents=True, exist_ok=True)
+    phases = default_rng(seed).uniform(0, 2 * pi, len(template.columns))
+    dropped = [template.columns.index(each) for each in FIRMWARE_COLUMNS[table]]
+
+    def block(index: int) -> DataFrame:
+        """
+        Values between two recoveries, generated the same way every time.
+        """
+        times = date_range(
+            start + index * recovery,
+            min(start + (index + 1) * recovery, end),
+            freq=interval,
+            inclusive="left",
+        )
+        rng = default_rng((seed, index))
+        days = (times - datetime(2000, 1, 1)).total_seconds().to_numpy()[
+            :, None
+        ] / 86400
+        values = (
+            template.center
+            + 0.8 * template.spread * sin(2 * pi * days / 365.25 + phases)
+            + 0.2
+            * template.spread
+            * rng.standard_normal((len(times), len(template.columns)))
+        )
+        values[rng.random(values.shape) < nan_fraction] = nan
+        return DataFrame(values, index=times, columns=template.columns)
+
+    paths = []
+    previous: Optional[DataFrame] = None
+    index = 0
+    while start + index * recovery < end:
+        current = block(index)
+        if previous is not None:
+            df = concat(
+                [previous[previous.index >= current.index[0] - overlap], current]
+            )
+        else:
+            df = current
+        previous = current
+        firmware = index // firmware_every
+        firmware_start = start + firmware * firmware_every * recovery
+        columns = [
+            position
+            for position in range(len(template.columns))
+            if firmware % 2 == 0 or position not in dropped
+        ]
+        environment = list(template.environment)
+        environment[1] = station
+        environment[5] = f"CPU:{station.lower()}.{firmware_start:%y%m%d}.dld"
+        environment[6] = str(10000 + 7919 * firmware % 55000)
+        recovered = current.index[-1] + timedelta(minutes=17 + index % 40)
+        path = directory / f"{station}_{table.value}_{recovered:%Y-%m-%dT%H-%M}.dat"
+        write_toa5(
+            path,
+            environment,
+            template.headers,
+            df.iloc[:, columns],
+            firmware_start,
+            interval,
+        )
+        paths.append(path)
+        index += 1
+    return paths
+
+
+def write_toa5(
+    path: Path,
+    environment: list[str],
+    headers: list[list[str]],
+    df: DataFrame,
+    firmware_start: datetime,
+    interval: timedelta,
+) -> None:
+    """
+    Write a TOA5 file with quoted headers and timestamps, unquoted numbers,
+    and quoted `NAN` tokens. Record numbers count from the firmware install.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    keep = ["TIMESTAMP", "RECORD", *df.columns]
+    positions = [headers[0].index(each) for each in keep]
+    with open(path, "w", encoding="utf-8", newline="") as fid:
+        for row in [environment] + [
+            [header[i] for i in positions] for header in headers
+        ]:
+            fid.write(",".join(f'"{each}"' for each in row) + "\r\n")
+    out = df.copy()
+    out.insert(0, "RECORD", ((df.index - firmware_start) // interval).astype(int))
+    out.insert(0, "TIMESTAMP", df.index.strftime('"%Y-%m-%d %H:%M:%S"'))
+    out.to_csv(
+        path,
+        mode="a",
+        header=False,
+        index=False,
+        na_rep='"NAN"',
+        float_format="%.7g",
+        quoting=csv.QUOTE_NONE,
+        quotechar="\x00",
+        lineterminator="\r\n",
+    )
+
+
+def generate_dataset(
+    directory: Path,
+    stations: list[str],
+    days: float,
+    interval: timedelta = timedelta(hours=1),
+    seed: int = 0,
+) -> None:
+    """
+    Write every table for several stations, ending at the most recent
+    real recovery. Each station gets its own random values.
+    """
+    start = END - timedelta(days=days)
+    for offset, station in enumerate(stations):
+        for table in TableName:
+            generate_station_table(
+                directory,
+                station,
+                table,
+                start,
+                END,
+                interval=interval,
+                seed=seed + offset,
+            )
+
+
+def station_names(count: int) -> list[str]:
+    """
+    Names of the real stations, followed by synthetic ones up to `count`.
+    """
+    names = [each.value.title() for each in StationName]
+    return names + [
+        f"{SYNTHETIC_STATION}{index:02d}" for index in range(count - len(names))
+    ]
+
+
+@contextmanager
+def buoy_data(directory: Path) -> Iterator[None]:
+    """
+    Point the buoy commands at another data directory, and keep their
+    exports and figures out of the repository. The parsed file cache is
+    cleared on the way in and out, so that timings start cold.
+    """
+    saved = (buoys.DATA_DIR, buoys.EXPORT_DIR, buoys.FIGURES_DIR)
+    buoys.DATA_DIR = directory
+    buoys.EXPORT_DIR = directory / "export"
+    buoys.FIGURES_DIR = directory / "figures"
+    parsed_files.clear()
+    try:
+        yield
+    finally:
+        buoys.DATA_DIR, buoys.EXPORT_DIR, buoys.FIGURES_DIR = saved
+        parsed_files.clear()
+
+
+def time_stage(stage: str, name: StationName, days: float) -> int:
+    """
+    Run one stage from cold, and return the number of sonde rows involved.
+    """
+    qartod = ["qartod.yaml", f"{name.value}.yaml"]
+    if stage == "read_campbell_logger_files":
+        files = list(buoys.filter_buoy_flat_files(name, TableName.SONDE))
+        return len(read_campbell_logger_files(files))
+    sonde, _ = load_and_subset_multifile_table(name, TableName.SONDE, None, None)
+    if stage == "load_and_subset_multifile_table":
+        return len(sonde)
+    if stage == "run_qartod_tests":
+        diagnostic, _ = load_and_subset_multifile_table(
+            name, TableName.DIAGNOSTIC, None, None
+        )
+        df = sonde.drop(columns=["RECORD"]).join(diagnostic, how="left")
+        df.columns = list(map(format_column_standard_name, df.columns))
+        config = load_and_merge_qa_configs(tuple(qartod))
+        streams = [each for each in config["streams"] if each in df.columns]
+        config["streams"] = {each: config["streams"][each] for each in streams}
+        run_qartod_tests(df[["Latitude", "Longitude", *streams]], config)
+        return len(df)
+    options = [arg for each in qartod for arg in ("-q", each)]
+    if stage == "export":
+        buoys_file_export.main([name.name.lower(), *options], standalone_mode=False)
+    elif stage == "plot_tail":
+        buoys_plot_tail.main(
+            [
+                name.name.lower(),
+                "sonde",
+                "sea_water_temperature",
+                *options,
+                "--days",
+                str(int(days) + 1),
+                "--end",
+                f"{END:%Y-%m-%d}",
+            ],
+            standalone_mode=False,
+        )
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return len(sonde)
+
+
+def benchmark(
+    directory: Path,
+    scale: float,
+    stages: list[str],
+    repeat: int,
+    stations: int = len(StationName),
+) -> list[dict]:
+    """
+    Time each stage for each real station, keeping every repeat. The data
+    directory, with `stations` in all, is read again for every repeat, so
+    parsing is included.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=BENCH_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    records = []
+    for name in StationName:
+        for stage in stages:
+            seconds = []
+            for _ in range(repeat):
+                with buoy_data(directory):
+                    started = perf_counter()
+                    rows = time_stage(stage, name, BASE_DAYS * scale)
+                    seconds.append(perf_counter() - started)
+            records.append(
+                {
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "commit": commit,
+                    "python": platform.python_version(),
+                    "pandas": pandas_version,
+                    "scale": scale,
+                    "stations": stations,
+                    "station": name.value,
+                    "stage": stage,
+                    "rows": rows,
+                    "seconds": seconds,
+                }
+            )
+    return records
+
+
+@click.group(name="bench")
+def bench():
+    """
+    Generate synthetic buoy data and benchmark the processing pipeline.
+    """
+
+
+@bench.command(name="generate")
+@click.argument("directory", type=click.Path(file_okay=False, path_type=Path))
+@click.option(
+    "--station",
+    "stations",
+    multiple=True,
+    default=[each.value.title() for each in StationName],
+    help="Station name, repeat for more stations. Defaults to the real stations.",
+)
+@click.option(
+    "--days",
+    default=BASE_DAYS,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Duration of data, ending at the most recent real recovery.",
+)
+@click.option(
+    "--interval",
+    default=60,
+    type=click.IntRange(min=1),
+    help="Minutes between samples. Loggers record hourly.",
+)
+@click.option("--seed", default=0, type=int, help="Random seed, for repeatable data.")
+def bench_generate(
+    directory: Path, stations: tuple[str], days: float, interval: int, seed: int
+):
+    """
+    Write synthetic Campbell TOA5 files for one or more stations.
+    """
+    generate_dataset(directory, list(stations), days, timedelta(minutes=interval), seed)
+    click.echo(f"Saved {len(list(directory.glob('*.dat')))} files to {directory}")
+
+
+@bench.command(name="run")
+@click.option(
+    "--scale",
+    "scales",
+    multiple=True,
+    default=[1.0, 10.0, 100.0],
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Multiple of the current data volume, by duration. Repeat for several. "
+        "Defaults to 1, 10, and 100."
+    ),
+)
+@click.option(
+    "--stations",
+    "station_counts",
+    multiple=True,
+    default=[len(StationName)],
+    type=click.IntRange(min=len(StationName)),
+    help=(
+        "Number of stations in the data directory, counting the real ones. "
+        "Repeat for several. Defaults to the real stations."
+    ),
+)
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    default=STAGES,
+    type=click.Choice(STAGES),
+    help="Stage to time. Defaults to all of them.",
+)
+@click.option(
+    "--repeat",
+    default=3,
+    type=click.IntRange(min=1),
+    help="Number of times to run each stage.",
+)
+@click.option(
+    "--data",
+    "data_dir",
+    default=DATA_DIR,
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Where to keep generated data between runs.",
+)
+@click.option(
+    "--output",
+    default=RESULTS_PATH,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="JSON lines file to append results to.",
+)
+def bench_run(
+    scales: tuple[float],
+    station_counts: tuple[int],
+    stages: tuple[str],
+    repeat: int,
+    data_dir: Path,
+    output: Path,
+):
+    """
+    Time the hot stages of the buoy pipeline on synthetic data.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    for scale in scales:
+        for count in station_counts:
+            directory = data_dir / f"scale-{scale:g}"
+            if count > len(StationName):
+                directory = data_dir / f"scale-{scale:g}-stations-{count}"
+            if not (directory / "complete").exists():
+                click.echo(
+                    f"Generating {scale:g}x data for {count} stations in {directory}"
+                )
+                generate_dataset(directory, station_names(count), BASE_DAYS * scale)
+                (directory / "complete").touch()
+            records = benchmark(directory, scale, list(stages), repeat, count)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(output, "a", encoding="utf-8") as fid:
+                for record in records:
+                    fid.write(json.dumps(record) + "\n")
+                    click.echo(
+                        f"{scale:g}x {count} stations, {record['station']} {record['stage']}: "
+                        f"{min(record['seconds']):.3f} s for {record['rows']} rows"
+                    )
+
+
+@bench.command(name="compare")
+@click.option(
+    "--results",
+    default=RESULTS_PATH,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="JSON lines file of results.",
+)
+@click.option(
+    "--last",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Number of most recent commits to compare.",
+)
+def bench_compare(results: Path, last: int):
+    """
+    Compare the best times of each stage between recent commits.
+    """
+    df = read_json(results, lines=True)
+    df["best"] = df["seconds"].map(min)
+    df["commit"] = df["commit"].fillna("unknown")
+    # Results from before the station axis are of the real stations only
+    df["stations"] = df.get("stations", len(StationName))
+    df["stations"] = df["stations"].fillna(len(StationName)).astype(int)
+    commits = list(dict.fromkeys(df.sort_values("time")["commit"]))[-last:]
+    table = (
+        df[df["commit"].isin(commits)]
+        .groupby(["scale", "stations", "stage", "commit"])["best"]
+        .min()
+        .unstack("commit")
+        .reindex(columns=commits)
+    )
+    if len(commits) > 1:
+        table["ratio"] = table[commits[-1]] / table[commits[0]]
+    print(table.round(3))
@@ -0,0 +1,61 @@
+"""
+Test synthetic data generation and the benchmark harness.
+"""
+from datetime import timedelta
+import json
+from click.testing import CliRunner
+from buoys import TableName, read_campbell_logger_files
+from . import END, bench_compare, bench_run, generate_station_table
+
+runner = CliRunner()
+
+
+def test_generate_station_table(tmp_path):
+    """
+    Expect files that parse like the real ones, with overlapping
+    recoveries, missing values, and firmware column changes
+    """
+    files = generate_station_table(
+        tmp_path, "Wynken", TableName.DIAGNOSTIC, END - timedelta(days=20), END,
+        recovery=timedelta(days=4), firmware_every=2,
+    )
+    assert len(files) == 5
+    df = read_campbell_logger_files(files)
+    assert df.index.duplicated().sum() == 4 * 48
+    assert df[("Latitude", "Decimal Degrees (N=+,S=-)", "Smp")].isna().any()
+    firmware = df[("SensorHoldPowerOn", "True = Keep Sensor On", "Smp")]
+    assert firmware.isna().any() and firmware.notna().any()
+
+
+def test_cli_bench_run_and_compare(tmp_path):
+    """
+    Expect results to be appended for each station and stage, and compared
+    """
+    output = tmp_path / "results.jsonl"
+    args = ["--scale", "0.02", "--repeat", "1", "--data", str(tmp_path), "--output", str(output)]
+    result = runner.invoke(bench_run, [*args, "--stage", "read_campbell_logger_files"])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert {each["station"] for each in records} == {"wynken", "blynken"}
+    assert all(each["rows"] > 0 for each in records)
+    result = runner.invoke(bench_compare, ["--results", str(output)])
+    assert result.exit_code == 0
+    assert "read_campbell_logger_files" in result.output
+
+
+def test_cli_bench_run_stations(tmp_path):
+    """
+    Expect extra synthetic stations to share the data directory, without
+    changing the rows of the real stations that are timed
+    """
+    output = tmp_path / "results.jsonl"
+    args = ["--scale", "0.02", "--repeat", "1", "--data", str(tmp_path), "--output", str(output)]
+    args += ["--stage", "read_campbell_logger_files", "--stations", "2", "--stations", "4"]
+    result = runner.invoke(bench_run, args)
+    assert result.exit_code == 0, result.output
+    assert len(list((tmp_path / "scale-0.02-stations-4").glob("Synthetic01_*.dat"))) > 0
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    rows = {(each["stations"], each["station"]): each["rows"] for each in records}
+    assert rows[(2, "wynken")] == rows[(4, "wynken")] and rows[(2, "blynken")] == rows[(4, "blynken")]
+    result = runner.invoke(bench_compare, ["--results", str(output)])
+    assert result.exit_code == 0
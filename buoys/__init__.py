@@ -11,7 +11,9 @@ Features:
 """
 
 import re
-from typing import cast, Optional
+import csv
+from functools import cache
+from typing import cast, Optional, TYPE_CHECKING
 from warnings import simplefilter
 from pathlib import Path
 from enum import Enum
@@ -20,21 +22,21 @@ from math import radians, cos, sin, sqrt, atan2
 from numpy import concatenate, array, argsort
 from pandas import read_csv, DataFrame, concat
 from pandas.errors import PerformanceWarning
-from matplotlib import pyplot as plt, dates as mdates
-from matplotlib.patches import Circle
-from matplotlib.markers import MarkerStyle
-from scipy.io import loadmat
-from pyproj import Transformer
-import gpxpy
-import gpxpy.gpx
 import click
-from scipy.stats import median_abs_deviation
+from lazy import LazyGroup
 from lib import (
     Source,
     plot_options,
     boxplot,
     Frequency,
-    ImageFormat
+    ImageFormat,
+    AggregatePyramid,
+    serve_url_option,
+    forward_to_server,
+    frame_from_payload,
+    timing_span,
+    metrics,
+    LruCache,
 )
 from buoys.qartod import (
     run_qartod_tests,
@@ -45,11 +47,31 @@ from buoys.qartod import (
     qartod_test_option
 )
 
+if TYPE_CHECKING:
+    from matplotlib.patches import Circle
+    from pyproj import Transformer
+
 DATA_DIR = Path(__file__).parent / "data"
 FIGURES_DIR = Path(__file__).parent / "figures"
 EXPORT_DIR = Path(__file__).parent / "export"
 CABLE_DIR = Path(__file__).parent / "cable"
-transformer = Transformer.from_crs("EPSG:4326", "EPSG:32619", always_xy=True)
+PYRAMID_DIR = DATA_DIR / "pyramid"
+
+
+# Plotting, geodesy, and file format dependencies are imported inside the
+# commands that use them, so that listing and help stay fast.
+# pylint: disable=import-outside-toplevel
+
+
+@cache
+def utm_transformer() -> "Transformer":
+    """
+    Project WGS84 longitude and latitude to UTM zone 19N. Built on
+    first use, because constructing a transformer loads the PROJ database.
+    """
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", "EPSG:32619", always_xy=True)
 
 
 class ClickOptions(Enum):
@@ -61,6 +83,7 @@ class ClickOptions(Enum):
     LIST = "list"
     DESCRIBE = "describe"
     EXPORT = "export"
+    PYRAMID = "pyramid"
     # groups
     FILE = "file"
     BUOYS = "buoys"
@@ -142,7 +165,20 @@ class ObservedProperty:
         self.campbell_scientific = campbell_scientific
 
 
-@click.group(name=ClickOptions.BUOYS.value)
+@click.group(
+    name=ClickOptions.BUOYS.value,
+    cls=LazyGroup,
+    lazy_subcommands={
+        "db": (
+            "buoys.database:database",
+            "Commands that interact with the buoy database.",
+        ),
+        "firmware": (
+            "buoys.firmware:firmware",
+            "Command line interface for working with buoy data and firmware.",
+        ),
+    },
+)
 def buoys():
     """
     Command line interface for working with buoy data and firmware.
@@ -216,15 +252,43 @@ def buoys_file_list():
         print(each)
 
 
+# Parsed files, checked against modification time and size before reuse. A
+# single command reads each file once, but the `serve` daemon reads tables on
+# every request and should only pay for parsing files that changed. Bounded,
+# because recoveries add files for as long as the daemon runs, but by more
+# than the files of a station table, so that one request doesn't evict the
+# files it reads.
+PARSED_FILES_LIMIT = 128
+parsed_files: LruCache = LruCache(PARSED_FILES_LIMIT)
+
+
 def read_single_campbell_logger_file(file: Path) -> DataFrame:
     """
-    Read a single Campbell logger file and return a DataFrame.
+    Read a single Campbell logger file and return a DataFrame. The fields
+    of the environment line, with the station name, logger serial number,
+    and program, are kept in `df.attrs["environment"]`.
     """
-    df = read_csv(file, header=[1, 2, 3], na_values=["NAN"], parse_dates=[0])
-    ts_col = df.columns[0]
-    return df.set_index(ts_col)
+    stat = file.stat()
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    cached = parsed_files.get(file)
+    if cached is None or cached[0] != fingerprint:
+        with open(file, "r", encoding="utf-8", newline="") as fid:
+            environment = next(csv.reader(fid))
+            df = read_csv(fid, header=[0, 1, 2], na_values=["NAN"], parse_dates=[0])
+        ts_col = df.columns[0]
+        df = df.set_index(ts_col)
+        df.attrs["environment"] = environment
+        cached = (fingerprint, df)
+        parsed_files[file] = cached
+        metrics.inc("penbay_rows_parsed_total", len(df), source="campbell")
+        metrics.inc("penbay_bytes_read_total", stat.st_size, source="campbell")
+    else:
+        metrics.inc("penbay_cache_hits_total", cache="campbell_files")
+    # Shallow copy, so that adding columns doesn't modify the cached frame
+    return cached[1].copy(deep=False)
 
 
+@timing_span("read_campbell_logger_files")
 def read_campbell_logger_files(files: list[Path]) -> DataFrame:
     """
     Read multiple Campbell logger files and return a single DataFrame.
@@ -253,13 +317,13 @@ def filter_buoy_flat_files(name: StationName, table: TableName):
     return filter(filter_prefix, DATA_DIR.glob("*.dat"))
 
 
-@file_group.command(name=ClickOptions.DESCRIBE.value)
-@station_name
-@data_table
-def buoys_file_describe(name: StationName, table: TableName):
+def summarize_station_table(name: StationName, table: TableName) -> DataFrame:
     """
-    Summarize available data for a station.
+    Summary statistics, including Median Absolute Deviation,
+    for all files of a station table.
     """
+    from scipy.stats import median_abs_deviation
+
     files = filter_buoy_flat_files(name, table)
     df = read_campbell_logger_files(list(files))
     summary = df.describe().T.drop(columns=["25%", "75%", "std"])
@@ -268,6 +332,24 @@ def buoys_file_describe(name: StationName, table: TableName):
          lambda x: median_abs_deviation(x, nan_policy="omit")
     )
     summary["MAD"] = mad
+    return summary
+
+
+@file_group.command(name=ClickOptions.DESCRIBE.value)
+@station_name
+@data_table
+@serve_url_option
+def buoys_file_describe(name: StationName, table: TableName, serve_url: Optional[str]):
+    """
+    Summarize available data for a station.
+    """
+    forwarded = forward_to_server(
+        serve_url, f"/buoys/{name.value}/{table.value}/describe"
+    )
+    if forwarded is not None:
+        summary = frame_from_payload(forwarded)
+    else:
+        summary = summarize_station_table(name, table)
     print("\nSamples:\n")
     print(summary)
 
@@ -418,6 +500,8 @@ def buoys_plot_tail(
     """
     Plot the most recent data from a buoy for a single data stream.
     """
+    from matplotlib import pyplot as plt, dates as mdates
+
     simplefilter(action="ignore", category=PerformanceWarning)
     if len(qartod) == 0:
         raise click.ClickException(
@@ -549,9 +633,11 @@ def buoys_plot_tail(
         )
     ).with_suffix(f".{image_format.value}")
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    fig.savefig(filepath, dpi=300, bbox_inches="tight")
+    with timing_span("savefig"):
+        fig.savefig(filepath, dpi=300, bbox_inches="tight")
     click.echo(f"Saved plot to {filepath}")
     plt.close(fig)  # clean up when testing to avoid memory issues with pytest and matplotlib
+    return filepath
 
 
 @plot.command(name="cable")
@@ -560,6 +646,9 @@ def buoys_plot_cable(name: StationName):
     """
     Plot the mooring tension diagram from the WHOI cable simulation.
     """
+    from matplotlib import pyplot as plt
+    from scipy.io import loadmat
+
     low = CABLE_DIR / f"{name.value}-low.mat"
     high = CABLE_DIR / f"{name.value}-high.mat"
     if not low.exists() or not high.exists():
@@ -613,7 +702,8 @@ def buoys_plot_cable(name: StationName):
     filename = FIGURES_DIR / "cable" / name.value / "mooring-tension.png"
     Path(filename).parent.mkdir(parents=True, exist_ok=True)
     fig.tight_layout()
-    fig.savefig(filename, bbox_inches="tight", dpi=300)
+    with timing_span("savefig"):
+        fig.savefig(filename, bbox_inches="tight", dpi=300)
 
 
 def predicted_watch_circle(
@@ -622,10 +712,13 @@ def predicted_watch_circle(
     color: str,
     scale: float = 1.0,
     label: str | None = None,
-) -> list[Circle]:
+) -> list["Circle"]:
     """
     Generate a predicted watch circle based on the planned deployment location.
     """
+    from matplotlib.patches import Circle
+    from scipy.io import loadmat
+
     predicted: list[Circle] = []
     for each, circle_label, ls in [("low", label, "solid"), ("high", None, "dashed")]:
         mat_path = CABLE_DIR / f"{station.value}-{each}.mat"
@@ -696,6 +789,10 @@ def buoys_plot_locations(
     deployment location of the anchor and the watch circle predicted by WHOI Cable
     simulations.
     """
+    from matplotlib import pyplot as plt
+    from matplotlib.markers import MarkerStyle
+
+    transformer = utm_transformer()
     table = TableName.DIAGNOSTIC
     lat_name = "Latitude"
     lon_name = "Longitude"
@@ -768,7 +865,8 @@ def buoys_plot_locations(
     ax.ticklabel_format(axis="both", style="plain")
     ax.legend(loc="best")
     fig.tight_layout()
-    fig.savefig(filename, dpi=300, bbox_inches="tight")
+    with timing_span("savefig"):
+        fig.savefig(filename, dpi=300, bbox_inches="tight")
 
 
 @plot.command(name=ClickOptions.DATASTREAM.value)
@@ -846,6 +944,8 @@ def buoys_file_gpx(name: StationName):
     """
     Export buoy data to a different format.
     """
+    import gpxpy.gpx
+
     table = TableName.DIAGNOSTIC
     files = filter_buoy_flat_files(name, table)
     df = read_campbell_logger_files(list(files))
@@ -921,3 +1021,58 @@ def buoys_file_first_and_second_derivative(
         index=ds.index
     ).describe(percentiles=sorted(percentile)).map('{:.8f}'.format)
     click.echo(summary)
+
+
+@file_group.command(name=ClickOptions.PYRAMID.value)
+@station_name
+@data_table
+@click.option(
+    "--resample",
+    default="1D",
+    help="Resampling frequency to summarize (e.g., 6h, 1D, W, ME). Defaults to 1D.",
+)
+@click.option(
+    "--start",
+    default=None,
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Start date for the summary.",
+)
+@click.option(
+    "--end",
+    default=None,
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="End date for the summary.",
+)
+@click.option(
+    "--series",
+    default=None,
+    multiple=True,
+    type=click.Choice(StandardNames, case_sensitive=False),
+    help="Limit the summary to these series. Accepts multiple values.",
+)
+def buoys_file_pyramid(
+    name: StationName,
+    table: TableName,
+    resample: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    series: tuple[StandardNames, ...],
+):
+    """
+    Update the hourly, daily, and monthly aggregates for a station table
+    with any data newer than the last update, then summarize a time window
+    from the coarsest level that can answer the resampling frequency.
+    """
+    pyramid = AggregatePyramid(PYRAMID_DIR / name.value / table.value)
+    df, _ = load_and_subset_multifile_table(name, table, None, None)
+    df = df.drop(columns=["RECORD"], errors="ignore")
+    df.columns = list(map(format_column_standard_name, df.columns))
+    added = pyramid.update(df)
+    click.echo(f"Aggregated {added} new samples into {pyramid.directory}")
+    try:
+        summary = pyramid.query(
+            resample, start, end, streams=[each.value for each in series] or None
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+    click.echo(summary)
@@ -2,18 +2,26 @@
 Command line interface for working with buoy database.
 """
 
+from datetime import datetime, timedelta
 from pathlib import Path
 from enum import Enum
-from pandas import DataFrame
+from typing import Optional
+import click
+from pandas import DataFrame, concat
 from influxdb_client_3 import InfluxDBClient3
 from click import group
 from lib import (
     influx_options,
     influx_host,
     influx_api_token,
+    bulk_write,
+    bulk_write_options,
+    influx_max_time,
+    sync_options,
+    Watermarks,
+    write_line_protocol,
 )
 from buoys import (
-    buoys,
     station_name,
     data_table,
     filter_buoy_flat_files,
@@ -25,6 +33,8 @@ from buoys import (
 )
 
 DATA_DIR = Path(__file__).parent.parent / "data"
+DEAD_LETTER_DIR = Path(__file__).parent.parent / "dead-letter"
+DATABASE = "buoy-test-3"
 
 
 class DatabaseCommands(Enum):
@@ -40,7 +50,49 @@ def database():
     """
 
 
-buoys.add_command(database)
+def read_upload_frame(
+    name: StationName, table: TableName, after: Optional[datetime] = None
+) -> DataFrame:
+    """
+    Standardized columns from every file of a station table, with tags
+    from the environment line of each file. Recoveries overlap, so only
+    the first copy of each timestamp is kept, and otherwise the same
+    sample would be written again as a different firmware series.
+
+    Only rows after `after` are returned, and files recovered before
+    then aren't parsed.
+    """
+    files = sorted(
+        filter_buoy_flat_files(name, table), key=lambda path: path.stem.split("_")[2]
+    )
+    if after is not None:
+        files = [
+            each for each in files
+            if datetime.strptime(each.stem.split("_")[2], "%Y-%m-%dT%H-%M") > after
+        ]
+    if not files:
+        return DataFrame()
+    frames = []
+    for each in files:
+        df = read_single_campbell_logger_file(each)
+        environment = df.attrs["environment"]
+        df = df.droplevel([1, 2], axis=1)
+        columns = {
+            vendored.value: StandardNames[vendored.name].value
+            for vendored in VendoredNames
+            if vendored.value in df.columns
+        }
+        subset = df[list(columns)].rename(columns=columns)
+        subset.insert(column="location", value=environment[1].lower(), loc=0)
+        subset.insert(column="thing", value=environment[3], loc=1)
+        subset.insert(column="firmware", value=environment[5].removeprefix("CPU:"), loc=2)
+        frames.append(subset)
+    df = concat(frames)
+    df = df[~df.index.duplicated(keep="first")].sort_index()
+    if after is not None:
+        df = df[df.index > after]
+    df.index.name = "time"
+    return df.dropna(how="all", subset=df.columns[3:])
 
 
 @database.command(name="upload")
@@ -48,30 +100,60 @@ buoys.add_command(database)
 @data_table
 @influx_host
 @influx_api_token
-def buoys_db_upload(name: StationName, table: TableName, host: str, token: str):
+@bulk_write_options
+@sync_options
+def buoys_db_upload(
+    name: StationName,
+    table: TableName,
+    host: str,
+    token: str,
+    batch_size: int,
+    concurrency: int,
+    retries: int,
+    gzip: bool,
+    dead_letter: Optional[Path],
+    line_protocol: Optional[Path],
+    overlap: float,
+    full: bool,
+):
     """
-    Upload buoy data to the database.
+    Upload all standardized columns of buoy data to the database. Only rows
+    newer than the last upload are sent, unless the database is behind.
     """
-    files = list(filter_buoy_flat_files(name, table))
-    client = InfluxDBClient3(host=host, database="buoy-test-3", token=token)
-    # columns = [VendoredNames.SEA_WATER_TEMPERATURE, VendoredNames.SEA_WATER_SALINITY]
-    columns = [VendoredNames.SEA_WATER_TEMPERATURE]
-    rename = [StandardNames[key.name].value for key in columns]
-    for each in files:
-        df = read_single_campbell_logger_file(each)
-        subset = df[[key.value for key in columns]]
-        subset.columns = rename
-        subset.index.name = "time"
-        with open(each, "r", encoding="utf-8") as fid:
-            metadata = fid.readline().split(",")
-        subset.insert(column="location", value=metadata[1].lower(), loc=0)
-        subset.insert(column="thing", value=metadata[3], loc=1)
-        subset.insert(column="firmware", value=metadata[5][5:-1], loc=2)
-        client.write(
-            subset,
-            data_frame_measurement_name=table.value,
-            data_frame_tag_columns=["location", "thing", "firmware"],
-        )
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    dead_letter = dead_letter or DEAD_LETTER_DIR / f"{name.value}-{table.value}.lp"
+    client = InfluxDBClient3(
+        host=host, database=DATABASE, token=token, enable_gzip=gzip
+    )
+    watermarks = Watermarks()
+    key = Watermarks.key(DATABASE, table.value, location=name.value)
+    since = None
+    if not full:
+        since = watermarks.verify(key, influx_max_time(client, table.value, location=name.value))
+    after = since - timedelta(hours=overlap) if since is not None else None
+    df = read_upload_frame(name, table, after)
+    if df.empty:
+        click.echo(f"No new rows from {name.value} {table.value} since {since}")
+        return
+    tags = ["location", "thing", "firmware"]
+    if line_protocol is not None:
+        count = write_line_protocol(line_protocol, df, table.value, tags, chunk_size=batch_size)
+        click.echo(f"Wrote {count} lines from {name.value} {table.value} to {line_protocol}")
+        return
+    written, failed = bulk_write(
+        client,
+        df,
+        table.value,
+        tags,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        retries=retries,
+        dead_letter=dead_letter,
+    )
+    click.echo(f"Uploaded {written} of {len(df)} rows from {name.value} {table.value}")
+    if failed:
+        raise click.ClickException(f"{failed} rows could not be uploaded, see {dead_letter}")
+    watermarks.set(key, max(df.index.max(), since) if since is not None else df.index.max())
 
 
 @database.command(DatabaseCommands.DESCRIBE.value)
@@ -6,7 +6,7 @@ from enum import Enum
 from pathlib import Path
 from hashlib import md5
 from click import group, option, echo
-from buoys import buoys, station_name, StationName
+from buoys import station_name, StationName
 
 FIRMWARE_DIR = Path(__file__).parent / "programs"
 TEMPLATE_DIR = Path(__file__).parent / "templates"
@@ -29,9 +29,6 @@ def firmware():
     """
 
 
-buoys.add_command(firmware)
-
-
 def checksum(contents: str) -> str:
     """
     Generate a checksum for a file based on its contents.
@@ -2,7 +2,9 @@
 Quality assurance and quality control (QA/QC) for buoy data using QARTOD tests.
 """
 
+from copy import deepcopy
 from datetime import datetime
+from time import perf_counter
 from typing import cast
 from enum import Enum
 from pathlib import Path
@@ -11,9 +13,7 @@ from yaml import safe_load
 from numpy import where
 from pandas import concat, DataFrame
 from pandas.core.groupby import DataFrameGroupBy
-from ioos_qc.config import Config
-from ioos_qc.streams import PandasStream
-from ioos_qc.stores import PandasStore
+from lib import metrics, timing_span
 
 
 class TestTypes(Enum):
@@ -66,6 +66,28 @@ def deep_merge_inplace(base: dict, update: dict) -> None:
             base[key] = value
 
 
+# Parsed configuration files, checked against modification time before reuse
+parsed_configs: dict[Path, tuple[int, dict]] = {}
+
+
+def load_qa_config(qa_path: Path) -> dict:
+    """
+    Parse a single QARTOD configuration file. The result is a copy,
+    because merging modifies nested dictionaries in place.
+    """
+    if not qa_path.exists():
+        raise FileNotFoundError(f"QARTOD configuration file not found: {qa_path}")
+    modified = qa_path.stat().st_mtime_ns
+    cached = parsed_configs.get(qa_path)
+    if cached is None or cached[0] != modified:
+        with open(qa_path, "r", encoding="utf-8") as fid:
+            cached = (modified, safe_load(fid))
+        parsed_configs[qa_path] = cached
+    else:
+        metrics.inc("penbay_cache_hits_total", cache="qartod_configs")
+    return deepcopy(cached[1])
+
+
 def load_and_merge_qa_configs(qartod: tuple[str]) -> dict:
     """
     Load the default QARTOD configuration and merge it with any user-provided
@@ -73,11 +95,7 @@ def load_and_merge_qa_configs(qartod: tuple[str]) -> dict:
     """
     accumulate = {}
     for file in qartod:
-        qa_path = Path(__file__).parent / file
-        if not qa_path.exists():
-            raise FileNotFoundError(f"QARTOD configuration file not found: {qa_path}")
-        with open(qa_path, "r", encoding="utf-8") as fid:
-            deep_merge_inplace(accumulate, safe_load(fid))
+        deep_merge_inplace(accumulate, load_qa_config(Path(__file__).parent / file))
     return accumulate
 
 
@@ -130,6 +148,7 @@ def tests_per_observed_property(result: DataFrame) -> dict[str, list[str]]:
     return frames
 
 
+@timing_span("run_qartod_tests")
 def run_qartod_tests(
     df,
     config: dict,
@@ -142,6 +161,13 @@ def run_qartod_tests(
     expects latitude and longitude columns to be present in the DataFrame for
     location-based tests.
     """
+    # ioos_qc is slow to import, and only needed when tests actually run
+    # pylint: disable=import-outside-toplevel
+    from ioos_qc.config import Config
+    from ioos_qc.streams import PandasStream
+    from ioos_qc.stores import PandasStore
+
+    started = perf_counter()
     flags = PandasStream(
         df=df.reset_index(names=time_col),
         time=time_col,
@@ -159,4 +185,10 @@ def run_qartod_tests(
         flags[TestTypes.GAP.value] = where(df[key].isna(), 3, 1)
         by_observed_property.append(flags)
     result = cast(DataFrame, concat(by_observed_property, axis=0))
+    elapsed = perf_counter() - started
+    samples = len(df) * len(frames)
+    metrics.inc("penbay_qc_samples_total", samples)
+    metrics.inc("penbay_qc_seconds_total", elapsed)
+    if elapsed > 0:
+        metrics.set("penbay_qc_samples_per_second", samples / elapsed)
     return result.groupby(group_by_key)
@@ -6,7 +6,7 @@ tests will fail due to a system exit event.
 """
 import pytest
 from click.testing import CliRunner
-from buoys import buoys_file_gpx, buoys_file_list, buoys_file_describe, buoys_file_export, buoys_plot_tail,TestTypes
+from buoys import buoys_file_gpx, buoys_file_list, buoys_file_describe, buoys_file_export, buoys_file_pyramid, buoys_plot_tail,TestTypes
 from buoys.firmware import buoys_firmware_template, buoys_firmware_library
 
 by_station = pytest.mark.parametrize("name", ["wynken", "blynken"])
@@ -40,6 +40,15 @@ def test_cli_buoys_file_export(name, table):
     result = runner.invoke(buoys_file_export, [name, table])
     assert result.exit_code == 0
 
+@by_station
+@pytest.mark.parametrize("resample", ["6h", "1D", "W", "ME"])
+def test_cli_buoys_file_pyramid(name, resample):
+    """
+    Expect aggregates to be written to disk and summarized
+    """
+    result = runner.invoke(buoys_file_pyramid, [name, "sonde", "--resample", resample])
+    assert result.exit_code == 0
+
 @by_station
 def test_cli_buoys_file_gpx(name):
     """
@@ -1,29 +1,122 @@
 """
 Entry point for Command Line Interface (CLI)
+
+Platform command groups are imported on demand, so that `--help`
+and trivial commands don't pay for loading every dependency.
 """
-from pandas import set_option
-from click import group
-from weather import weather
-from buoys import buoys
-from profiles import profiles
-from lorawan import lorawan
-from island import island
+from pathlib import Path
+from typing import Optional
+from click import Path as PathType, group, option, pass_context, Context
+from lazy import LazyGroup
 
 
-@group(name="cli")
-def cli():
+@group(
+    name="cli",
+    cls=LazyGroup,
+    lazy_subcommands={
+        "weather": ("weather:weather", "Weather station commands."),
+        "buoys": (
+            "buoys:buoys",
+            "Command line interface for working with buoy data and firmware.",
+        ),
+        "profiles": ("profiles:profiles", "Profile CLI commands."),
+        "lorawan": ("lorawan:lorawan", "LoRaWAN CLI commands."),
+        "island": ("island:island", "Island CLI group."),
+        "run": (
+            "pipeline:run",
+            "Run the stale stages of a declarative pipeline file.",
+        ),
+        "serve": (
+            "serve:serve",
+            "Run a resident daemon that keeps parsed data in memory.",
+        ),
+        "bench": (
+            "bench:bench",
+            "Generate synthetic buoy data and benchmark the processing pipeline.",
+        ),
+    },
+)
+@option(
+    "--profile",
+    is_flag=True,
+    help="Profile the command with cProfile, and print the slowest calls to stderr.",
+)
+@option(
+    "--profile-output",
+    type=PathType(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also save cProfile statistics to this file, e.g. for snakeviz.",
+)
+@option(
+    "--spans",
+    type=PathType(dir_okay=False, path_type=Path),
+    default=None,
+    help=(
+        "Record named timing spans around hot stages, and write them to this file. "
+        "Files ending in .json get a list of spans, and others get folded stacks "
+        "for flamegraph.pl or speedscope."
+    ),
+)
+@option(
+    "--metrics",
+    type=PathType(dir_okay=False, path_type=Path),
+    default=None,
+    envvar="PENBAY_METRICS_TEXTFILE",
+    help=(
+        "Merge performance metrics into this Prometheus textfile when the command "
+        "finishes, for the node exporter textfile collector."
+    ),
+)
+@pass_context
+def cli(
+    ctx: Context,
+    profile: bool,
+    profile_output: Optional[Path],
+    spans: Optional[Path],
+    metrics: Optional[Path],
+):
     """
     Command Line Interface for weather and buoy data.
     """
-
-cli.add_command(weather)
-cli.add_command(buoys)
-cli.add_command(profiles)
-cli.add_command(lorawan)
-cli.add_command(island)
-
-if __name__ == "__main__":
     # Show all data instead of substituting "..."
+    # pylint: disable=import-outside-toplevel
+    from pandas import set_option
+
     set_option("display.max_columns", None)
     set_option("display.max_rows", None)
+
+    if spans is not None:
+        from lib import spans as recorder
+
+        def write_spans():
+            recorder.enabled = False
+            recorder.dump(spans)
+
+        recorder.enable()
+        ctx.call_on_close(write_spans)
+
+    if metrics is not None:
+        from lib import metrics as registry
+
+        ctx.call_on_close(lambda: registry.write_textfile(metrics))
+
+    if profile or profile_output is not None:
+        import sys
+        from cProfile import Profile
+        from pstats import Stats
+
+        profiler = Profile()
+
+        def report():
+            profiler.disable()
+            if profile_output is not None:
+                profiler.dump_stats(profile_output)
+            if profile:
+                Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+
+        ctx.call_on_close(report)
+        profiler.enable()
+
+
+if __name__ == "__main__":
     cli()
@@ -6,12 +6,17 @@ from os import listdir, path
 from datetime import datetime
 from pathlib import Path
 from sys import argv
+from typing import TYPE_CHECKING
 from pandas import DataFrame, read_csv, to_datetime, concat
-from matplotlib.pyplot import subplots, title
-from matplotlib.dates import DateFormatter, DayLocator
-from matplotlib.axes import Axes
 import click
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
+# Matplotlib is imported by the functions that plot, so that loading
+# the command group stays fast.
+# pylint: disable=import-outside-toplevel
+
 FIGURES = Path(__file__).parent / "figures"
 DATA = Path(__file__).parent / "data"
 
@@ -26,6 +31,9 @@ def plot() -> None:
 @plot.command("grid")
 def island_plot_grid() -> None:
     """Plot grid data from Sol Ark devices."""
+    from matplotlib.pyplot import subplots
+    from matplotlib.dates import DateFormatter, DayLocator
+
     click.echo("Plotting grid data from solar devices...")
     interval = "72h"
     df = read_csv(
@@ -103,7 +111,7 @@ class TimeSeries:
     def plot_resampled_range(
         self,
         # Matplotlib axis context
-        axis: Axes,
+        axis: "Axes",
     ) -> None:
         """
         Resample and plot time series data as high/low envelope. Limits
@@ -183,6 +191,8 @@ def plot_on_two_y_axes(
     """
     Plot temperature and humidity data from DataFrame on two y-axes.
     """
+    from matplotlib.pyplot import subplots, title
+
     figure, axis = subplots(figsize=figure_size)
     left, right = series
     axis.set_xlabel(time_label)
@@ -246,7 +256,7 @@ def plot_sol_ark_power(
     column: str,
     rename: str,
     color: str,
-    axis: Axes
+    axis: "Axes"
 ) -> None:
     """
     Plot a single series.
@@ -265,6 +275,8 @@ def plot_sol_ark_power(
 
 def plot_sol_ark_data(df: DataFrame, out_dir: str = "figures") -> None:
     """Plot Sol Ark data from DataFrame."""
+    from matplotlib.pyplot import subplots, title
+
     fig, ax = subplots(figsize=(10, 3))
     plot_sol_ark_power(df, "LoadTotalPower(W)/178", "load (W)", "red", ax)
     ax2 = ax.twinx()
@@ -0,0 +1,68 @@
+"""
+Deferred loading of Click command groups. Importing a platform module pulls
+in Pandas, Matplotlib, and other heavy dependencies, so groups are only
+imported when a command inside them actually runs. This keeps `--help` and
+trivial commands fast when called from cron or shell loops.
+
+Nothing here should import more than Click, or the benefit is lost.
+"""
+
+from importlib import import_module
+from typing import Optional
+from click import Command, Context, Group, HelpFormatter
+
+
+class LazyGroup(Group):
+    """
+    A Click group whose subcommands are given as import paths, and only
+    imported when resolved. Each lazy subcommand also declares a short help
+    string, so that listing commands does not require importing them.
+    """
+
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Optional[dict[str, tuple[str, str]]] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        # Command name -> ("package.module:attribute", "short help")
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: Context) -> list[str]:
+        return sorted({*super().list_commands(ctx), *self.lazy_subcommands})
+
+    def get_command(self, ctx: Context, cmd_name: str) -> Optional[Command]:
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            self.add_command(self.load(cmd_name), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def load(self, cmd_name: str) -> Command:
+        """
+        Import the module for a lazy subcommand and return the command.
+        """
+        path, _ = self.lazy_subcommands[cmd_name]
+        module_name, attribute = path.split(":")
+        command = getattr(import_module(module_name), attribute)
+        if not isinstance(command, Command):
+            raise TypeError(f"Lazy subcommand {path} is not a Click command")
+        return command
+
+    def format_commands(self, ctx: Context, formatter: HelpFormatter) -> None:
+        """
+        Same layout as `Group.format_commands`, but lazy subcommands that have
+        not been imported use their declared help instead of being loaded.
+        """
+        limit = formatter.width - 6 - max(map(len, self.list_commands(ctx)), default=0)
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                if command.hidden:
+                    continue
+                rows.append((name, command.get_short_help_str(limit)))
+            else:
+                rows.append((name, self.lazy_subcommands[name][1]))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
@@ -1,325 +0,0 @@
-"""
-Shared across sensing platforms and systems. Mostly related
-to processing Pandas DataFrames and plotting with Matplotlib.
-"""
-
-from datetime import datetime, timedelta
-from enum import Enum
-from pathlib import Path
-from typing import Optional, Callable
-from matplotlib import pyplot as plt, dates as mdates
-from matplotlib.axes import Axes
-from click import Choice, option
-from pandas import DataFrame, Grouper, Series, concat
-from numpy import array, float32, diff
-from numpy.typing import NDArray
-from ioos_qc.config import Config
-from ioos_qc.streams import PandasStream
-from ioos_qc.stores import PandasStore
-
-class ImageFormat(Enum):
-    """
-    Valid image file formats for writing figures.
-    Add values if there is a need, but Portable
-    Network Graphics is often a good choice for
-    web because of its lossless compression and
-    wide support across browsers.
-    """
-
-    PNG = "png"
-    PDF = "pdf"
-
-
-class StandardUnits(Enum):
-    """
-    CF Metadata Standard Units. These are all of the Davis Vantage Pro2
-    observed properties that have Climate and Forecast (CF) metadata standard
-    units.
-    """
-
-    TEMPERATURE = "$ °K $"
-    PRESSURE = "$ Pa $"
-    SPEED = "$ m / s $"
-    DIRECTION = "degrees"
-    ENERGY = "$ W / m^2 $"
-    FLUX = "$ kg / m^2 / s $"
-    AMOUNT = "$ kg / m^2 $"
-
-
-# pylint: disable=too-few-public-methods
-class Source:
-    """
-    Abstraction for converting from a data source
-    to standard format.
-    """
-
-    name: str
-    transform: Callable
-
-    def __init__(self, name: str, transform: Callable):
-        self.name = name
-        self.transform = transform
-
-influx_api_token = option(
-    "--token",
-    envvar="INFLUX_API_TOKEN",
-    help="The InfluxDB API token. Defaults to environment variable INFLUX_API_TOKEN",
-)
-
-influx_host = option(
-    "--host",
-    envvar="INFLUX_SERVER_URL",
-    help="The InfluxDB server URL. Defaults to environment variable INFLUX_SERVER_URL",
-)
-
-def influx_options(function):
-    """
-    Attach common options to source commands. When used as
-    a decorator, the arguments and options will be supplied
-    to the wrapped function in reverse order.
-    """
-    function = influx_api_token(function)
-    function = option(
-        "--measurement",
-        default="observations",
-        envvar="INFLUXDB_MEASUREMENT",
-        help="The InfluxDB measurement (table) name.",
-    )(function)
-    function = influx_host(function)
-    return function
-
-
-def plot_options(function):
-    """
-    Attach common options to plotting commands.
-    """
-    function = option(
-        "--image-format",
-        type=Choice(ImageFormat, case_sensitive=False),
-        default=ImageFormat.PNG,
-        help="The output format.",
-    )(function)
-    return function
-
-
-def fahrenheit_to_kelvin(fahrenheit: float) -> float:
-    """
-    Convert Fahrenheit to Kelvin.
-    """
-    return (fahrenheit - 32) * 5 / 9 + 273.15
-
-
-def test_observed_property(
-    result: DataFrame,
-    observed_property: str,
-    tests: list[str]
-) -> DataFrame:
-    """
-    Get quality assurance flags for observed property.
-    """
-    columns = {
-        f"{observed_property}_qartod_{test}": test.replace("_test", "")
-        for test in tests
-    }
-    df = result[columns.keys()].rename(columns=columns).replace(9, -1)  # replace missing values with -1
-    # Can't do max, because missing location values will trigger flag=9,
-    # which is not what we want in rollup.
-    df["rollup"] = df.max(axis=1).astype("object")
-    for col in df.columns:
-        df[col] = df[col].astype("object")
-    df["observed_property"] = observed_property
-    return df.replace(-1, 9)  # replace missing values back to 9
-
-
-def cardinal_direction_to_degrees(series: Series) -> Series:
-    """
-    Convert cardinal directions to degrees.
-    """
-    wind = {
-        "N": 0,
-        "NNE": 22.5,
-        "NE": 45,
-        "ENE": 67.5,
-        "E": 90,
-        "ESE": 112.5,
-        "SE": 135,
-        "SSE": 157.5,
-        "S": 180,
-        "SSW": 202.5,
-        "SW": 225,
-        "WSW": 247.5,
-        "W": 270,
-        "WNW": 292.5,
-        "NW": 315,
-        "NNW": 337.5,
-    }
-    return series.map(wind)
-
-
-def plot_single_series(
-    series: Series, ax: Axes, resample: Optional[str], label: str, **kwargs
-):
-    """
-    Plot a single resampled time series. Key word arguments are
-    passed to the matplotlib Axes.plot() method.
-    """
-    observed_property = str(series.name)
-    observed_property = observed_property.replace("_", " ").title()
-    if resample:
-        resampled = series.resample(resample)
-        series_to_plot = resampled.mean()
-        plot_label = f"{label} {resample} mean"
-    else:
-        series_to_plot = series
-        plot_label = label
-
-    ax.plot(series_to_plot.index, series_to_plot, label=plot_label, **kwargs)
-
-
-def plot_tail(
-    local: Series,
-    remote: Optional[Series],
-    thing: str,
-    observed_property: str,
-    prefix: str,
-    units: Optional[str] = None,
-    image_format: ImageFormat = ImageFormat.PNG,
-    days: int = 30,
-    resample: str = "1h",
-    figsize: tuple[int, int] = (7, 3),
-    time_column: str = "time",
-):
-    """
-    Plot the tail of a time series which has some values
-    stored locally in a file, and some from a database.
-    The local and remote data may overlap, but the local
-    is assumed to cover an earlier time interval than
-    the remote.
-    """
-    end: datetime = datetime.now()
-    start: datetime = end - timedelta(days=days)
-    fig, ax = plt.subplots(figsize=figsize)
-    local_tail = local.loc[local.index > start]
-    plot_single_series(local_tail, ax, resample, label="local", color="grey")
-
-    if remote is not None:
-        tail = remote.loc[remote.index > start]
-        plot_single_series(
-            tail,
-            ax,
-            resample,
-            label="remote",
-            color="black",
-            linestyle=":",
-        )
-    df = local_tail.rename_axis(time_column).reset_index()
-    display_name = observed_property.replace("_", " ").title()
-    if start.year == end.year:
-        year_range = f"{start.year}"
-    else:
-        year_range = f"{start.year}-{end.year}"
-    plt.title(f"{thing} {display_name} {year_range}".title())
-    ax.set_xlabel("Date")
-    ax.xaxis.set_tick_params(rotation=45)
-    ax.set_xlim(start, end)
-    ax.set_ylim(None, None)
-    ax.xaxis.set_major_locator(mdates.DayLocator(interval=(days // 8) + 2))
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))  # Customize format
-    if units is not None:
-        ax.set_ylabel(f"{units}")
-    fig.legend(loc="outside upper right")
-    fig.tight_layout()
-    filename = f"{prefix}/{thing}/{observed_property}.{image_format.value}"
-    Path(filename).parent.mkdir(parents=True, exist_ok=True)
-    fig.savefig(filename)
-
-
-def group_observations_by_time(
-    df: DataFrame, freq: str = "D"
-) -> tuple[list[DataFrame], NDArray[float32], str]:
-    """
-    Group observations by a specified frequency. Used in creating
-    box plots of time series data that aggregate by day, week, month, etc.
-
-    The positions are always calculated in timedelta days, used to slice
-    the DataFrame into segments for plotting. Bins will always been equally
-    spaced when there is data, but may have gaps when there are missing values.
-    """
-    grouper = Grouper(freq=freq)
-    gb = df.groupby(grouper, sort=True)
-    groups: list[datetime] = list(gb.groups.keys())
-    epoch = datetime(1970, 1, 1)
-    positions = array([(group - epoch).days for group in groups], dtype=float32)
-    bins = []
-    previous = 0
-    for each in gb.groups.values():
-        bins.append(df[previous:each])
-        previous = each
-    years = f"{groups[0].year}"
-    if groups[0].year != groups[-1].year:
-        years += f"-{groups[-1].year}"
-    return bins, positions, years
-
-
-class Frequency(Enum):
-    """
-    Supported aggregation frequencies for plotting.
-    """
-
-    DAILY = "D"
-    WEEKLY = "W"
-    MONTHLY = "ME"
-
-def boxplot(
-    df: DataFrame,
-    thing: str,
-    observed_property: str,
-    prefix: Path,
-    units: str,
-    image_format: ImageFormat,
-    freq: Frequency,
-    figsize: tuple[float, float] = (12, 6),
-    rotation: float = 45,
-    color: str = "black"
-):
-    """
-    Create a box plot of a single series grouped
-    by time window.
-    """
-    fig, ax = plt.subplots(figsize=figsize)
-    bins, positions, years = group_observations_by_time(df, freq=freq.value)
-    # hack for buoys...
-    if isinstance(bins[0], DataFrame):
-        col = bins[0].columns[0]
-        bins = [b[col].values for b in bins]
-    # end hack for buoys...
-
-    # Calculate spacing between bins
-    spacing = diff(positions).min()
-    pad = 0.5 * spacing
-    x_range = positions[-1] - positions[0] + 2 * pad
-    slots = x_range / spacing
-    widths = (x_range - slots * spacing * 0.2) / (slots - 1)
-    ax.boxplot(
-        bins, # type: ignore
-        notch=False,
-        widths=widths,
-        positions=positions,
-        medianprops={"color": color},
-    )
-    display_name = observed_property.replace("_", " ").title()
-    title = f"{thing} {freq.name.lower()} {display_name} {years}".title()
-    ax.set_title(title)
-    ax.set_xlabel("Date")
-    ax.set_xlim(positions[0] - pad, positions[-1] + pad)
-    ax.set_ylim(None, None)
-    ax.xaxis.set_major_locator(mdates.DayLocator(bymonthday=[1]))
-    ax.xaxis.set_tick_params(rotation=rotation)
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))  # e.g. Dec 10
-    if units is not None:
-        display_name += f" ({units})"  # note: overloading display_name
-    ax.set_ylabel(display_name)
-    fig.tight_layout()
-    filepath = prefix / thing / f"{observed_property}_{freq.name.lower()}.{image_format.value}"
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    fig.savefig(filepath)
@@ -0,0 +1,634 @@
+"""
+Shared across sensing platforms and systems: units and conversions of
+observed properties, common command line options, and plotting with
+Matplotlib.
+
+Pipeline infrastructure is in modules of its own, and the names that
+commands use are imported here, so that they can import from `lib`:
+
+- `lib.metrics`, timing spans and Prometheus metrics
+- `lib.protocol`, line protocol and bulk writes to InfluxDB
+- `lib.caches`, parsed files in memory and query results on disk
+- `lib.watermarks`, progress of routine syncs
+- `lib.exports`, CSV, Parquet, and NetCDF files
+- `lib.forwarding`, the HTTP API of the `serve` daemon
+- `lib.resampling`, station clocks, time bins, and resampling
+- `lib.pyramid`, aggregate pyramids
+"""
+
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+from click import Choice, FloatRange, option
+from pandas import DataFrame, DatetimeIndex, Grouper, Index, Series, factorize
+from numpy import append, array, asarray, float32, diff, empty
+from numpy.typing import NDArray
+# Imported for commands, as well as used here
+# pylint: disable=unused-import
+from lib.metrics import (
+    METRIC_TYPES,
+    Metrics,
+    TimingSpans,
+    escape_label,
+    metrics,
+    spans,
+    timing_span,
+)
+from lib.protocol import (
+    MAX_BACKOFF,
+    PRECISION_DIVISORS,
+    bulk_write,
+    bulk_write_options,
+    encode_fields,
+    encode_labels,
+    escape_line_protocol,
+    influx_write,
+    influx_write_errors,
+    is_retryable,
+    line_protocol,
+    retry_delay,
+    write_dead_letter,
+    write_line_protocol,
+)
+from lib.caches import LruCache, QueryCache
+from lib.watermarks import WATERMARKS_PATH, Watermarks, influx_max_time
+from lib.exports import (
+    ExportFormat,
+    export_frames,
+    time_periods,
+    write_csv,
+    write_netcdf,
+    write_parquet,
+)
+from lib.forwarding import (
+    ResponseHandler,
+    forward_to_server,
+    frame_from_payload,
+    frame_to_payload,
+    serve_url_option,
+)
+from lib.resampling import (
+    RESAMPLE_AGGREGATORS,
+    VECTOR_WEIGHTS,
+    Aggregator,
+    bin_codes,
+    is_fixed_frequency,
+    local_to_utc,
+    resample_frame,
+    utc_now,
+)
+from lib.pyramid import (
+    AGGREGATE_REDUCTIONS,
+    AggregateLevel,
+    AggregatePyramid,
+    aggregate_samples,
+    combine_aggregates,
+    floor_to_level,
+    summarize_aggregates,
+)
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from pyarrow import Table
+
+
+def frame_from_arrow(table: "Table", time: str, conversions: "UnitConversions") -> DataFrame:
+    """
+    Build a time indexed DataFrame of standard names from an Arrow table.
+    Numeric columns become float NumPy arrays, without copies when they
+    have no missing values, and are converted together by `conversions`.
+    Source columns that aren't in the table are skipped.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pyarrow import float64, types
+    from pyarrow.compute import cast, fill_null
+
+    columns = {}
+    for source in conversions.sources:
+        if source not in table.column_names:
+            continue
+        column = table[source]
+        if types.is_integer(column.type) or types.is_floating(column.type):
+            column = cast(column, float64())
+            if column.null_count:
+                column = fill_null(column, float("nan"))
+            columns[source] = column.to_numpy()
+        else:
+            columns[source] = column.to_pandas()
+    return conversions.apply(columns, DatetimeIndex(table[time].to_numpy(), name=time))
+
+
+def sync_options(function):
+    """
+    Attach options for incremental syncs. Like `influx_options`,
+    they are supplied in reverse order.
+    """
+    function = option(
+        "--full",
+        is_flag=True,
+        help="Send every row, ignoring watermarks and what is already in the database.",
+    )(function)
+    function = option(
+        "--overlap",
+        default=24.0,
+        type=FloatRange(min=0),
+        help="Hours before the watermark to send again, for late or corrected rows.",
+    )(function)
+    return function
+
+
+class ImageFormat(Enum):
+    """
+    Valid image file formats for writing figures.
+    Add values if there is a need, but Portable
+    Network Graphics is often a good choice for
+    web because of its lossless compression and
+    wide support across browsers.
+    """
+
+    PNG = "png"
+    PDF = "pdf"
+
+
+class StandardUnits(Enum):
+    """
+    CF Metadata Standard Units. These are all of the Davis Vantage Pro2
+    observed properties that have Climate and Forecast (CF) metadata standard
+    units.
+    """
+
+    TEMPERATURE = "$ °K $"
+    PRESSURE = "$ Pa $"
+    SPEED = "$ m / s $"
+    DIRECTION = "degrees"
+    ENERGY = "$ W / m^2 $"
+    FLUX = "$ kg / m^2 / s $"
+    AMOUNT = "$ kg / m^2 $"
+
+
+# Canonical CF units of each standard unit, for file metadata
+# instead of plot labels
+CF_UNITS = {
+    StandardUnits.TEMPERATURE: "K",
+    StandardUnits.PRESSURE: "Pa",
+    StandardUnits.SPEED: "m s-1",
+    StandardUnits.DIRECTION: "degree",
+    StandardUnits.ENERGY: "W m-2",
+    StandardUnits.FLUX: "kg m-2 s-1",
+    StandardUnits.AMOUNT: "kg m-2",
+}
+
+
+# Degrees clockwise from north, of the 16 point compass directions
+CARDINAL_DEGREES = {
+    "N": 0.0,
+    "NNE": 22.5,
+    "NE": 45.0,
+    "ENE": 67.5,
+    "E": 90.0,
+    "ESE": 112.5,
+    "SE": 135.0,
+    "SSE": 157.5,
+    "S": 180.0,
+    "SSW": 202.5,
+    "SW": 225.0,
+    "WSW": 247.5,
+    "W": 270.0,
+    "WNW": 292.5,
+    "NW": 315.0,
+    "NNW": 337.5,
+}
+
+
+# Fahrenheit to Kelvin, as an affine scale and offset
+FAHRENHEIT_SCALE = 5 / 9
+
+
+FAHRENHEIT_OFFSET = 273.15 - 32 * 5 / 9
+
+
+# pylint: disable=too-few-public-methods
+class Source:
+    """
+    Abstraction for converting from a data source
+    to standard format.
+
+    Conversions are data rather than functions, so that many columns can be
+    converted at once by `UnitConversions`. Numbers are converted with
+    `value * scale + offset`. With a `lookup`, labels like cardinal
+    directions are converted to numbers first, and numbers pass through.
+    """
+
+    name: str
+    scale: float
+    offset: float
+    lookup: Optional[dict[str, float]]
+
+    def __init__(
+        self,
+        name: str,
+        scale: float = 1.0,
+        offset: float = 0.0,
+        lookup: Optional[dict[str, float]] = None,
+    ):
+        self.name = name
+        self.scale = scale
+        self.offset = offset
+        self.lookup = lookup
+
+
+class UnitConversions:
+    """
+    Conversions from source columns to standard names, compiled into arrays
+    of scales and offsets. Source columns are gathered into one float block,
+    and converted in a single pass, instead of one temporary per column.
+    """
+
+    def __init__(self, sources: dict[str, tuple[str, Source]]):
+        self.sources = sources
+        self.scale = array([source.scale for _, source in sources.values()])
+        self.offset = array([source.offset for _, source in sources.values()])
+        self.lookups = {
+            column: (Index(list(source.lookup)), array([*source.lookup.values(), float("nan")]))
+            for column, (_, source) in sources.items()
+            if source.lookup is not None
+        }
+
+    def decode(self, column: str, values) -> NDArray:
+        """
+        Numbers for the labels of a lookup column. Labels are factorized
+        into categorical codes, so each distinct label is looked up once,
+        and each row is a single array index. Missing and unknown labels
+        are NaN, because the code -1 picks the last entry.
+        """
+        labels, numbers = self.lookups[column]
+        codes, uniques = factorize(asarray(values, dtype=object))
+        return append(numbers[labels.get_indexer(uniques)], float("nan"))[codes]
+
+    def apply(self, columns: dict, index: Index) -> DataFrame:
+        """
+        Convert the source columns that are present in `columns`, a mapping
+        of names to arrays or Series, into a frame of standard names.
+        """
+        present = [position for position, column in enumerate(self.sources) if column in columns]
+        names = list(self.sources)
+        block = empty((len(index), len(present)), order="F")
+        for target, position in enumerate(present):
+            values = columns[names[position]]
+            kind = getattr(values, "dtype", None)
+            if names[position] in self.lookups and (kind is None or kind.kind not in "iufb"):
+                block[:, target] = self.decode(names[position], values)
+            else:
+                block[:, target] = asarray(values, dtype=float)
+        block *= self.scale[present]
+        block += self.offset[present]
+        standard = [self.sources[names[position]][0] for position in present]
+        return DataFrame(block, index=index, columns=standard, copy=False)
+
+
+influx_api_token = option(
+    "--token",
+    envvar="INFLUX_API_TOKEN",
+    help="The InfluxDB API token. Defaults to environment variable INFLUX_API_TOKEN",
+)
+
+
+influx_host = option(
+    "--host",
+    envvar="INFLUX_SERVER_URL",
+    help="The InfluxDB server URL. Defaults to environment variable INFLUX_SERVER_URL",
+)
+
+
+def influx_options(function):
+    """
+    Attach common options to source commands. When used as
+    a decorator, the arguments and options will be supplied
+    to the wrapped function in reverse order.
+    """
+    function = influx_api_token(function)
+    function = option(
+        "--measurement",
+        default="observations",
+        envvar="INFLUXDB_MEASUREMENT",
+        help="The InfluxDB measurement (table) name.",
+    )(function)
+    function = influx_host(function)
+    return function
+
+
+def plot_options(function):
+    """
+    Attach common options to plotting commands.
+    """
+    function = option(
+        "--image-format",
+        type=Choice(ImageFormat, case_sensitive=False),
+        default=ImageFormat.PNG,
+        help="The output format.",
+    )(function)
+    return function
+
+
+def fahrenheit_to_kelvin(fahrenheit: float) -> float:
+    """
+    Convert Fahrenheit to Kelvin.
+    """
+    return fahrenheit * FAHRENHEIT_SCALE + FAHRENHEIT_OFFSET
+
+
+def test_observed_property(
+    result: DataFrame,
+    observed_property: str,
+    tests: list[str]
+) -> DataFrame:
+    """
+    Get quality assurance flags for observed property.
+    """
+    columns = {
+        f"{observed_property}_qartod_{test}": test.replace("_test", "")
+        for test in tests
+    }
+    df = result[columns.keys()].rename(columns=columns).replace(9, -1)  # replace missing values with -1
+    # Can't do max, because missing location values will trigger flag=9,
+    # which is not what we want in rollup.
+    df["rollup"] = df.max(axis=1).astype("object")
+    for col in df.columns:
+        df[col] = df[col].astype("object")
+    df["observed_property"] = observed_property
+    return df.replace(-1, 9)  # replace missing values back to 9
+
+
+def cardinal_direction_to_degrees(series: Series) -> Series:
+    """
+    Convert cardinal directions to degrees.
+    """
+    return Series(series).map(CARDINAL_DEGREES)
+
+
+def plot_single_series(
+    series: Series,
+    ax: "Axes",
+    resample: Optional[str],
+    label: str,
+    weights: Optional[Series] = None,
+    **kwargs,
+):
+    """
+    Plot a single resampled time series. Key word arguments are
+    passed to the matplotlib Axes.plot() method. Series are resampled
+    with the aggregator for their standard name, and directions can
+    be weighted by a speed series aligned by position. Empty bins are
+    kept, so that gaps in the data are not drawn over.
+    """
+    observed_property = str(series.name)
+    observed_property = observed_property.replace("_", " ").title()
+    if resample:
+        name = str(series.name)
+        frame = series.to_frame(name)
+        if weights is not None and name in VECTOR_WEIGHTS:
+            frame[VECTOR_WEIGHTS[name]] = weights.to_numpy()
+        resampled = resample_frame(frame, resample)[name]
+        series_to_plot = resampled.asfreq(resample) if len(resampled) else resampled
+        aggregator = RESAMPLE_AGGREGATORS.get(name, Aggregator.MEAN)
+        plot_label = f"{label} {resample} {aggregator.value}"
+    else:
+        series_to_plot = series
+        plot_label = label
+
+    ax.plot(series_to_plot.index, series_to_plot, label=plot_label, **kwargs)
+
+
+# QARTOD flags that are overlaid on plots, with their labels and colors
+QARTOD_OVERLAY = {3: ("suspect", "orange"), 4: ("fail", "red")}
+
+
+def plot_flags(series: Series, flags: Series, ax: "Axes", label: str):
+    """
+    Mark suspect and failed values of a series with their QARTOD flags,
+    which are aligned with it by position.
+    """
+    for flag, (name, color) in QARTOD_OVERLAY.items():
+        mask = flags.to_numpy() == flag
+        if mask.any():
+            ax.scatter(
+                series.index[mask],
+                series.to_numpy()[mask],
+                label=f"{label} {name}",
+                color=color,
+                marker="x",
+                s=12,
+                zorder=3,
+            )
+
+
+def plot_tail(
+    local: Series,
+    remote: Optional[Series],
+    thing: str,
+    observed_property: str,
+    prefix: str,
+    units: Optional[str] = None,
+    image_format: ImageFormat = ImageFormat.PNG,
+    days: int = 30,
+    resample: str = "1h",
+    figsize: tuple[int, int] = (7, 3),
+    time_column: str = "time",
+    flags: Optional[Series] = None,
+    remote_flags: Optional[Series] = None,
+    weights: Optional[Series] = None,
+    remote_weights: Optional[Series] = None,
+):
+    """
+    Plot the tail of a time series which has some values
+    stored locally in a file, and some from a database.
+    The local and remote data may overlap, but the local
+    is assumed to cover an earlier time interval than
+    the remote. Both are in naive UTC, like the window that
+    ends now. QARTOD rollup flags of either are overlaid
+    on the values they flag, before any resampling. Directions
+    are resampled as vector means, weighted by speeds if given.
+    """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib import pyplot as plt, dates as mdates
+
+    end: datetime = utc_now()
+    start: datetime = end - timedelta(days=days)
+    fig, ax = plt.subplots(figsize=figsize)
+    local_tail = local.loc[local.index > start]
+    plot_single_series(
+        local_tail,
+        ax,
+        resample,
+        label="local",
+        weights=weights.loc[weights.index > start] if weights is not None else None,
+        color="grey",
+    )
+    if flags is not None:
+        plot_flags(local_tail, flags.loc[flags.index > start], ax, label="local")
+
+    if remote is not None:
+        tail = remote.loc[remote.index > start]
+        plot_single_series(
+            tail,
+            ax,
+            resample,
+            label="remote",
+            weights=remote_weights.loc[remote_weights.index > start] if remote_weights is not None else None,
+            color="black",
+            linestyle=":",
+        )
+        if remote_flags is not None:
+            plot_flags(tail, remote_flags.loc[remote_flags.index > start], ax, label="remote")
+    df = local_tail.rename_axis(time_column).reset_index()
+    display_name = observed_property.replace("_", " ").title()
+    if start.year == end.year:
+        year_range = f"{start.year}"
+    else:
+        year_range = f"{start.year}-{end.year}"
+    plt.title(f"{thing} {display_name} {year_range}".title())
+    ax.set_xlabel("Date")
+    ax.xaxis.set_tick_params(rotation=45)
+    ax.set_xlim(start, end)
+    ax.set_ylim(None, None)
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=(days // 8) + 2))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))  # Customize format
+    if units is not None:
+        ax.set_ylabel(f"{units}")
+    fig.legend(loc="outside upper right")
+    fig.tight_layout()
+    filename = f"{prefix}/{thing}/{observed_property}.{image_format.value}"
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with timing_span("savefig"):
+        fig.savefig(filename)
+
+
+def plot_stations(
+    df: DataFrame,
+    observed_property: str,
+    prefix: str,
+    units: Optional[str] = None,
+    image_format: ImageFormat = ImageFormat.PNG,
+    figsize: tuple[int, int] = (7, 3),
+):
+    """
+    Plot one series of many stations, which are the columns of a frame
+    that is already aligned on a common time grid, so that all stations
+    are drawn from one index.
+    """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib import pyplot as plt, dates as mdates
+
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.plot(df.index, df.to_numpy(), label=[str(each) for each in df.columns], linewidth=1)
+    display_name = observed_property.replace("_", " ").title()
+    plt.title(f"{display_name} by station")
+    ax.set_xlabel("Date")
+    ax.xaxis.set_tick_params(rotation=45)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))
+    if units is not None:
+        ax.set_ylabel(f"{units}")
+    fig.legend(loc="outside upper right")
+    fig.tight_layout()
+    filename = f"{prefix}/{observed_property}.{image_format.value}"
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with timing_span("savefig"):
+        fig.savefig(filename)
+    plt.close(fig)
+
+
+def group_observations_by_time(
+    df: DataFrame, freq: str = "D"
+) -> tuple[list[DataFrame], NDArray[float32], str]:
+    """
+    Group observations by a specified frequency. Used in creating
+    box plots of time series data that aggregate by day, week, month, etc.
+
+    The positions are always calculated in timedelta days, used to slice
+    the DataFrame into segments for plotting. Bins will always been equally
+    spaced when there is data, but may have gaps when there are missing values.
+    """
+    grouper = Grouper(freq=freq)
+    gb = df.groupby(grouper, sort=True)
+    groups: list[datetime] = list(gb.groups.keys())
+    epoch = datetime(1970, 1, 1)
+    positions = array([(group - epoch).days for group in groups], dtype=float32)
+    bins = []
+    previous = 0
+    for each in gb.groups.values():
+        bins.append(df[previous:each])
+        previous = each
+    years = f"{groups[0].year}"
+    if groups[0].year != groups[-1].year:
+        years += f"-{groups[-1].year}"
+    return bins, positions, years
+
+
+class Frequency(Enum):
+    """
+    Supported aggregation frequencies for plotting.
+    """
+
+    DAILY = "D"
+    WEEKLY = "W"
+    MONTHLY = "ME"
+
+
+def boxplot(
+    df: DataFrame,
+    thing: str,
+    observed_property: str,
+    prefix: Path,
+    units: str,
+    image_format: ImageFormat,
+    freq: Frequency,
+    figsize: tuple[float, float] = (12, 6),
+    rotation: float = 45,
+    color: str = "black"
+):
+    """
+    Create a box plot of a single series grouped
+    by time window.
+    """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib import pyplot as plt, dates as mdates
+
+    fig, ax = plt.subplots(figsize=figsize)
+    bins, positions, years = group_observations_by_time(df, freq=freq.value)
+    # hack for buoys...
+    if isinstance(bins[0], DataFrame):
+        col = bins[0].columns[0]
+        bins = [b[col].values for b in bins]
+    # end hack for buoys...
+
+    # Calculate spacing between bins
+    spacing = diff(positions).min()
+    pad = 0.5 * spacing
+    x_range = positions[-1] - positions[0] + 2 * pad
+    slots = x_range / spacing
+    widths = (x_range - slots * spacing * 0.2) / (slots - 1)
+    ax.boxplot(
+        bins, # type: ignore
+        notch=False,
+        widths=widths,
+        positions=positions,
+        medianprops={"color": color},
+    )
+    display_name = observed_property.replace("_", " ").title()
+    title = f"{thing} {freq.name.lower()} {display_name} {years}".title()
+    ax.set_title(title)
+    ax.set_xlabel("Date")
+    ax.set_xlim(positions[0] - pad, positions[-1] + pad)
+    ax.set_ylim(None, None)
+    ax.xaxis.set_major_locator(mdates.DayLocator(bymonthday=[1]))
+    ax.xaxis.set_tick_params(rotation=rotation)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%b %d"))  # e.g. Dec 10
+    if units is not None:
+        display_name += f" ({units})"  # note: overloading display_name
+    ax.set_ylabel(display_name)
+    fig.tight_layout()
+    filepath = prefix / thing / f"{observed_property}_{freq.name.lower()}.{image_format.value}"
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with timing_span("savefig"):
+        fig.savefig(filepath)
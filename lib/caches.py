@@ -0,0 +1,96 @@
+"""
+Caches that outlive a single read. `LruCache` bounds the parsed files that
+a long running daemon keeps in memory, and `QueryCache` keeps the results
+of database queries on disk, so that only new rows are fetched.
+"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Callable, TYPE_CHECKING
+from pandas import Timedelta, Timestamp
+from lib.metrics import metrics
+
+if TYPE_CHECKING:
+    from pyarrow import Table
+
+
+class LruCache(OrderedDict):
+    """
+    A dict of at most `maxsize` entries, that drops the least recently
+    used one when it is full, so that in-memory caches of parsed files
+    don't grow with every file a long running daemon reads. Entries are
+    used by `get` and by setting them, under a lock, because the `serve`
+    daemon handles requests in threads.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+
+class QueryCache:
+    """
+    Results of a query kept on disk in Parquet, keyed by where they came
+    from. A refresh only fetches rows newer than the last cached one, less
+    an overlap for records that arrive late. This keeps repeated commands
+    fast, and saves the query quota of hosted databases.
+
+    Results stay Arrow tables, as returned by the InfluxDB client, so
+    nothing is converted to pandas until columns are selected.
+    """
+
+    def __init__(self, directory: Path, *key: str):
+        digest = sha256("\0".join(key).encode("utf-8")).hexdigest()[:16]
+        self.path = directory / f"{digest}.parquet"
+
+    def refresh(
+        self,
+        fetch: Callable[[Optional[Timestamp]], "Table"],
+        time: str,
+        overlap: Timedelta = Timedelta(0),
+    ) -> "Table":
+        """
+        Fetch rows newer than the cached ones, by calling `fetch` with the
+        latest cached time less `overlap`, or None if nothing is cached yet.
+        Cached rows after that time are replaced by the fetched ones, so
+        that records written late, like after an outage, are picked up
+        without duplicating the others. Saved before returning everything.
+        """
+        # pylint: disable=import-outside-toplevel
+        from pyarrow import concat_tables, scalar
+        from pyarrow.compute import less_equal, max as column_max, sum as column_sum
+        from pyarrow.parquet import read_table, write_table
+
+        cached = read_table(self.path) if self.path.exists() else None
+        if cached is None or cached.num_rows == 0:
+            table = fetch(None)
+        else:
+            metrics.inc("penbay_cache_hits_total", cache="influx_query")
+            after = Timestamp(column_max(cached[time]).as_py()) - overlap
+            new = fetch(after)
+            kept = less_equal(cached[time], scalar(after.to_pydatetime()).cast(cached.schema.field(time).type))
+            if new.num_rows == 0 and column_sum(kept).as_py() == cached.num_rows:
+                return cached
+            table = concat_tables([cached.filter(kept), new], promote_options="permissive")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        write_table(table, temporary)
+        temporary.replace(self.path)
+        return table
@@ -0,0 +1,206 @@
+"""
+Export of normalized time series to CSV, Parquet, and NetCDF, a period
+of rows at a time, so that long records are written without holding
+them in memory.
+"""
+
+from enum import Enum
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from pandas import DataFrame, DatetimeIndex, concat
+from numpy import float64, diff, flatnonzero, full, nan
+from lib.resampling import local_to_utc
+
+
+class ExportFormat(Enum):
+    """
+    File formats for exporting normalized time series. Parquet and
+    NetCDF are typed and columnar, and carry CF metadata.
+    """
+
+    CSV = "csv"
+    PARQUET = "parquet"
+    NETCDF = "nc"
+
+
+def time_periods(chunks: Iterable[DataFrame], every: str = "M") -> Iterator[DataFrame]:
+    """
+    Regroup time ordered chunks of a frame into one frame per calendar
+    period, like "M" for months, so that at most one period and one chunk
+    are in memory. Rows that go back in time start a new group.
+    """
+    pending: list[DataFrame] = []
+    current = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        periods = DatetimeIndex(chunk.index).to_period(every).asi8
+        edges = [0, *(flatnonzero(diff(periods) != 0) + 1), len(chunk)]
+        for start, end in zip(edges[:-1], edges[1:]):
+            if pending and periods[start] != current:
+                yield concat(pending)
+                pending = []
+            current = periods[start]
+            pending.append(chunk.iloc[start:end])
+    if pending:
+        yield concat(pending)
+
+
+def write_parquet(
+    path: Path, frames: Iterable[DataFrame], attributes: dict[str, dict[str, str]], metadata: dict[str, str]
+) -> int:
+    """
+    Write frames to a Parquet file, one row group for each, with the
+    attributes of each column as field metadata and `metadata` for the
+    file. Columns are those of the first frame.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pyarrow import Table, schema as arrow_schema
+    from pyarrow.parquet import ParquetWriter
+
+    writer = None
+    rows = 0
+    temporary = path.with_suffix(".tmp")
+    try:
+        for df in frames:
+            if writer is None:
+                columns = list(df.columns)
+                first = Table.from_pandas(df, preserve_index=True).schema
+                schema = arrow_schema(
+                    [
+                        field.with_metadata(attributes[field.name]) if field.name in attributes else field
+                        for field in first
+                    ],
+                    metadata={
+                        **(first.metadata or {}),
+                        **{key: str(value) for key, value in metadata.items() if value is not None},
+                    },
+                )
+                writer = ParquetWriter(temporary, schema, compression="zstd")
+            table = Table.from_pandas(df.reindex(columns=columns), preserve_index=True, schema=schema)
+            writer.write_table(table, row_group_size=max(len(table), 1))
+            rows += len(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        temporary.replace(path)
+    return rows
+
+
+def write_netcdf(
+    path: Path,
+    frames: Iterable[DataFrame],
+    attributes: dict[str, dict[str, str]],
+    metadata: dict[str, str],
+    chunk_size: int = 4096,
+    time_zone: Optional[str] = None,
+) -> int:
+    """
+    Write frames to a CF NetCDF4 file, appending each along an unlimited
+    time dimension. Variables are chunked in time and compressed, and
+    missing values use the fill value. Columns are those of the first
+    frame, and `latitude` and `longitude` in `metadata` become scalar
+    coordinate variables.
+
+    Times are written in UTC. Naive times in another `time_zone`, like
+    those of a station's local clock, are converted with `local_to_utc`.
+    """
+    # pylint: disable=import-outside-toplevel,too-many-arguments,too-many-positional-arguments
+    # Uses h5py, which is already a dependency of ioos_qc
+    from h5netcdf.legacyapi import Dataset
+
+    rows = 0
+    temporary = path.with_suffix(".tmp")
+    with Dataset(temporary, "w", format="NETCDF4") as dataset:
+        coordinates = {key: metadata[key] for key in ("latitude", "longitude") if metadata.get(key) is not None}
+        dataset.attrs.update({
+            "Conventions": "CF-1.8",
+            "featureType": "timeSeries",
+            **{
+                key: str(value)
+                for key, value in metadata.items()
+                if key not in ("latitude", "longitude") and value is not None
+            },
+        })
+        dataset.createDimension("time", None)
+        time = dataset.createVariable("time", "f8", ("time",), zlib=True, chunksizes=(chunk_size,))
+        time.attrs.update({
+            "standard_name": "time",
+            "units": "seconds since 1970-01-01 00:00:00 UTC",
+            "calendar": "standard",
+            "axis": "T",
+        })
+        for key, value in coordinates.items():
+            variable = dataset.createVariable(key, "f8")
+            variable.attrs.update({"standard_name": key, "units": f"degrees_{'north' if key == 'latitude' else 'east'}"})
+            variable[...] = float(value)
+        variables = {}
+        for df in frames:
+            if not variables:
+                for name in df.columns:
+                    variable = dataset.createVariable(
+                        name,
+                        "f8",
+                        ("time",),
+                        zlib=True,
+                        complevel=4,
+                        shuffle=True,
+                        chunksizes=(chunk_size,),
+                        fill_value=nan,
+                    )
+                    variable.attrs.update(attributes.get(name, {}))
+                    if coordinates:
+                        variable.coordinates = " ".join(["time", *coordinates])
+                    variables[name] = variable
+            start, stop = rows, rows + len(df)
+            index = DatetimeIndex(df.index)
+            if time_zone is not None:
+                index = local_to_utc(index, time_zone)
+            time[start:stop] = index.as_unit("ns").asi8 / 1e9
+            for name, variable in variables.items():
+                values = df[name].to_numpy(float64) if name in df.columns else full(len(df), nan)
+                variable[start:stop] = values
+            rows = stop
+    temporary.replace(path)
+    return rows
+
+
+def write_csv(path: Path, frames: Iterable[DataFrame]) -> int:
+    """
+    Write frames to a CSV file, with the header of the first.
+    """
+    rows = 0
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "w", encoding="utf-8", newline="") as fid:
+        for df in frames:
+            df.to_csv(fid, header=rows == 0)
+            rows += len(df)
+    temporary.replace(path)
+    return rows
+
+
+def export_frames(
+    path: Path,
+    chunks: Iterable[DataFrame],
+    file_format: ExportFormat,
+    attributes: Optional[dict[str, dict[str, str]]] = None,
+    metadata: Optional[dict[str, str]] = None,
+    every: str = "M",
+    time_zone: Optional[str] = None,
+) -> int:
+    """
+    Stream time ordered chunks of a normalized frame to a file, grouped
+    into calendar periods, which are Parquet row groups and NetCDF writes.
+    Files are written next to the destination, and replace it when they
+    are complete. Returns the number of rows. NetCDF times are converted
+    to UTC from naive times in `time_zone`, if given.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    frames = time_periods(chunks, every)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if file_format == ExportFormat.PARQUET:
+        return write_parquet(path, frames, attributes or {}, metadata or {})
+    if file_format == ExportFormat.NETCDF:
+        return write_netcdf(path, frames, attributes or {}, metadata or {}, time_zone=time_zone)
+    return write_csv(path, frames)
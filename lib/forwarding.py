@@ -0,0 +1,91 @@
+"""
+The HTTP API of the `penbay serve` daemon, from both sides. Commands
+forward queries to it when it is running, and frames are sent as JSON in
+the split format. The request handler is shared with `weather monitor`.
+"""
+
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from typing import Optional
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from click import echo, option
+from pandas import DataFrame, Index, MultiIndex
+
+
+serve_url_option = option(
+    "--serve-url",
+    envvar="PENBAY_SERVE_URL",
+    default=None,
+    help=(
+        "Forward to a running `penbay serve` daemon at this URL, falling back "
+        "to local processing if it is unreachable. Defaults to environment "
+        "variable PENBAY_SERVE_URL"
+    ),
+)
+
+
+def forward_to_server(
+    url: Optional[str], path: str, timeout: float = 60.0, **params
+) -> Optional[dict]:
+    """
+    Send a query to the `penbay serve` daemon and return the decoded JSON
+    response, or None if no daemon is configured or it can't answer. Commands
+    then do the work themselves, so forwarding is never required.
+    """
+    if url is None:
+        return None
+    query = urlencode({k: v for k, v in params.items() if v is not None}, doseq=True)
+    try:
+        with urlopen(f"{url.rstrip('/')}{path}?{query}", timeout=timeout) as response:
+            return json.load(response)
+    except (URLError, TimeoutError, ConnectionError):
+        return None
+
+
+class ResponseHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the `penbay serve` and `weather monitor` daemons,
+    which send complete responses and log requests to stderr.
+    """
+
+    def respond(self, status: HTTPStatus, body: str, content_type: str):
+        """
+        Send a complete response.
+        """
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        echo(f"{self.address_string()} {format % args}", err=True)
+
+
+def frame_to_payload(df: DataFrame) -> dict:
+    """
+    Convert a DataFrame to JSON-compatible split format. Tuple labels,
+    like the three header rows of Campbell files, become lists.
+    """
+    return json.loads(df.to_json(orient="split", date_format="iso", double_precision=15))
+
+
+def frame_from_payload(payload: dict) -> DataFrame:
+    """
+    Inverse of `frame_to_payload`, restoring tuple labels as a MultiIndex.
+    """
+
+    def labels(values: list) -> Index:
+        if values and isinstance(values[0], list):
+            return MultiIndex.from_tuples([tuple(each) for each in values])
+        return Index(values)
+
+    return DataFrame(
+        payload["data"],
+        index=labels(payload["index"]),
+        columns=labels(payload["columns"]),
+    )
@@ -0,0 +1,220 @@
+"""
+Performance instrumentation of the pipeline. Timing spans attribute the
+wall-clock time of a command to its hot stages, and Prometheus metrics
+count rows, bytes, cache hits, and writes, for `penbay --metrics`, the
+`serve` daemon, and the weather monitor.
+"""
+
+import re
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Iterator
+
+
+class TimingSpans:
+    """
+    Named, nested wall-clock timings of the hot stages of a command, for
+    attributing performance regressions. Recording is off unless enabled,
+    so that instrumented code pays almost nothing by default.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stack: list[str] = []
+        self.records: list[dict] = []
+
+    def enable(self):
+        """
+        Start recording, discarding anything recorded before.
+        """
+        self.enabled = True
+        self.stack = []
+        self.records = []
+
+    def folded(self) -> list[str]:
+        """
+        Self time of each stack of spans in microseconds, in the folded
+        format read by flamegraph.pl and speedscope.
+        """
+        totals: dict[str, float] = {}
+        for record in self.records:
+            totals[record["stack"]] = totals.get(record["stack"], 0.0) + record["duration"]
+            parent = record["stack"].rpartition(";")[0]
+            if parent:
+                totals[parent] = totals.get(parent, 0.0) - record["duration"]
+        return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in totals.items()]
+
+    def dump(self, path: Path):
+        """
+        Write spans as JSON if the file has a `.json` suffix,
+        and as folded stacks otherwise.
+        """
+        with open(path, "w", encoding="utf-8") as fid:
+            if path.suffix == ".json":
+                json.dump(self.records, fid, indent=2)
+            else:
+                fid.write("\n".join(self.folded()) + "\n")
+
+
+spans = TimingSpans()
+
+
+@contextmanager
+def timing_span(name: str) -> Iterator[None]:
+    """
+    Record the duration of a block, or of every call when used
+    as a function decorator.
+    """
+    if not spans.enabled:
+        yield
+        return
+    spans.stack.append(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        spans.records.append(
+            {
+                "name": name,
+                "stack": ";".join(spans.stack),
+                "start": start,
+                "duration": perf_counter() - start,
+            }
+        )
+        spans.stack.pop()
+
+
+# Metric name -> (Prometheus type, help). Summaries are exposed
+# as a pair of `_sum` and `_count` series.
+METRIC_TYPES = {
+    "penbay_rows_parsed_total": ("counter", "Rows parsed from local data files."),
+    "penbay_bytes_read_total": ("counter", "Bytes of local data files parsed."),
+    "penbay_cache_hits_total": ("counter", "Files that were not parsed again, because a cached copy was current."),
+    "penbay_qc_samples_total": ("counter", "Samples checked by QARTOD tests."),
+    "penbay_qc_seconds_total": ("counter", "Time spent running QARTOD tests."),
+    "penbay_qc_samples_per_second": ("gauge", "QARTOD throughput of the most recent run."),
+    "penbay_influx_write_seconds": ("summary", "Latency of InfluxDB write requests."),
+    "penbay_influx_write_rows": ("summary", "Rows per InfluxDB write request."),
+    "penbay_influx_write_failures_total": ("counter", "InfluxDB write requests that failed."),
+    "penbay_influx_query_seconds": ("summary", "Latency of InfluxDB queries."),
+    "penbay_influx_query_rows": ("summary", "Rows returned per InfluxDB query."),
+    "penbay_weather_ingest_latency_seconds": ("gauge", "Time since the newest archive record of a weather station."),
+    "penbay_weather_variable_age_seconds": ("gauge", "Time since the newest value of a weather station variable."),
+    "penbay_weather_gaps": ("gauge", "Gaps in the recent archive records of a weather station variable."),
+    "penbay_weather_missing_records": ("gauge", "Archive intervals missing from the gaps of a weather station variable."),
+}
+
+
+def escape_label(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format, which only
+    allows backslashes, double quotes, and line feeds escaped.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Pipeline performance metrics in Prometheus exposition format, to be
+    scraped by Grafana Alloy from a textfile or the `penbay serve` endpoint.
+    Values are kept per series, a metric name with its labels. Updates come
+    from the worker threads of `bulk_write` and the server, so they hold a lock.
+    """
+
+    def __init__(self):
+        self.values: dict[str, float] = {}
+        self.names: dict[str, str] = {}
+        self.lock = Lock()
+
+    def series(self, name: str, labels: dict[str, str], suffix: str = "") -> str:
+        """
+        Exposition name of a series, and remember which metric it belongs to.
+        Label values are escaped as the text format requires. Call with the
+        lock held.
+        """
+        text = ",".join(f'{key}="{escape_label(value)}"' for key, value in sorted(labels.items()))
+        series = f"{name}{suffix}{{{text}}}" if text else f"{name}{suffix}"
+        self.names[series] = name
+        return series
+
+    def inc(self, name: str, value: float = 1.0, **labels: str):
+        """
+        Add to a counter.
+        """
+        with self.lock:
+            series = self.series(name, labels)
+            self.values[series] = self.values.get(series, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        """
+        Set a gauge.
+        """
+        with self.lock:
+            self.values[self.series(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        """
+        Add an observation to a summary.
+        """
+        with self.lock:
+            for suffix, amount in (("_sum", value), ("_count", 1.0)):
+                series = self.series(name, labels, suffix)
+                self.values[series] = self.values.get(series, 0.0) + amount
+
+    def exposition(self) -> str:
+        """
+        All series grouped by metric, with help and type comments. Values
+        are written in full, because timestamps and large counters lose
+        digits in the shortest format.
+        """
+        with self.lock:
+            values = dict(self.values)
+            names = dict(self.names)
+        lines = []
+        for name, (kind, description) in METRIC_TYPES.items():
+            series = sorted(key for key, value in names.items() if value == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{each} {float(values[each])!r}" for each in series)
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path):
+        """
+        Merge into a textfile for the node exporter textfile collector. Every
+        command is a new process, so counters and summaries are added to the
+        values already in the file to keep them monotonic, and gauges are
+        replaced. The file is replaced atomically, so a scrape never sees
+        a partial write.
+        """
+        merged = Metrics()
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as fid:
+                for line in fid:
+                    if line.startswith("#") or not line.strip():
+                        continue
+                    series, value = line.rsplit(" ", 1)
+                    merged.values[series] = float(value)
+                    merged.names[series] = re.sub(r"(_sum|_count)?(\{.*)?$", "", series)
+        with self.lock:
+            values = dict(self.values)
+            names = dict(self.names)
+        for series, value in values.items():
+            name = names[series]
+            if METRIC_TYPES[name][0] == "gauge":
+                merged.values[series] = value
+            else:
+                merged.values[series] = merged.values.get(series, 0.0) + value
+            merged.names[series] = name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        with open(temporary, "w", encoding="utf-8") as fid:
+            fid.write(merged.exposition())
+        temporary.replace(path)
+
+
+metrics = Metrics()
@@ -0,0 +1,307 @@
+"""
+Writes to InfluxDB as line protocol. Frames are encoded with vectorized
+string operations, and sent in bounded batches from a pool of threads,
+with retries and backoff for transient failures, and a dead letter file
+for batches that still fail.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Iterator, Optional
+from click import IntRange, Path as PathType, option
+from pandas import DataFrame, DatetimeIndex, Series, factorize
+from numpy import array, full, isfinite, where
+from numpy.typing import NDArray
+from lib.metrics import metrics
+
+
+# Longest wait between write attempts, in seconds
+MAX_BACKOFF = 60.0
+
+
+def influx_write_errors() -> tuple[type[Exception], ...]:
+    """
+    Exceptions that mean a write request failed, rather than a bug in the
+    caller. The client doesn't wrap connection errors from urllib3.
+    """
+    # pylint: disable=import-outside-toplevel
+    from influxdb_client_3 import InfluxDBError
+    from urllib3.exceptions import HTTPError
+
+    return (InfluxDBError, HTTPError, OSError)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed write may succeed if sent again. Malformed or
+    unauthorized batches are rejected with client errors, and will be
+    rejected again. Throttling, timeouts, server errors, and dropped
+    connections are usually transient on cellular links.
+    """
+    status = getattr(error, "status", None)
+    if status is None:
+        return not hasattr(error, "response") or error.response is None
+    return status == 0 or status in (408, 429) or status >= 500
+
+
+def retry_delay(error: Exception, attempt: int, backoff: float) -> float:
+    """
+    Exponential backoff with jitter, unless the server asked for a delay.
+    """
+    try:
+        return float(getattr(error, "retry_after", None) or "")
+    except ValueError:
+        return min(backoff * 2**attempt, MAX_BACKOFF) * uniform(0.5, 1.0)
+
+
+# Integer timestamp divisors from nanoseconds, by write precision
+PRECISION_DIVISORS = {"ns": 1, "us": 1_000, "ms": 1_000_000, "s": 1_000_000_000}
+
+
+def escape_line_protocol(value: str, characters: str) -> str:
+    """
+    Backslash escape special characters in one element of line protocol.
+    Give backslashes first, so that they aren't escaped twice.
+    """
+    for character in characters:
+        value = value.replace(character, "\\" + character)
+    return value
+
+
+def encode_labels(column: Series, characters: str, quote: str = "") -> NDArray:
+    """
+    Escape string values once for each distinct value instead of for each
+    row, since tags and string fields repeat a lot. Missing values become
+    empty strings.
+    """
+    codes, uniques = factorize(column)
+    labels = [quote + escape_line_protocol(str(each), characters) + quote for each in uniques]
+    return array([*labels, ""], dtype=object)[codes]
+
+
+def encode_fields(df: DataFrame, columns: list[str]) -> NDArray:
+    """
+    Encode field columns as comma separated `key=value` pairs, skipping
+    missing and non-finite values in each row, like the buoy worker drops
+    "NAN". Floats use their shortest round trip form, integers get an `i`
+    suffix, and everything else is a quoted string.
+    """
+    encoded = full(len(df), "", dtype=object)
+    for name in columns:
+        column = df[name]
+        prefix = "," + escape_line_protocol(str(name), ", =") + "="
+        if column.dtype.kind == "b":
+            valid = column.notna().to_numpy()
+            values = where(column.to_numpy(dtype=bool, na_value=False), "true", "false").astype(object)
+        elif column.dtype.kind in "iu":
+            valid = column.notna().to_numpy()
+            values = array([f"{each}i" for each in column.to_numpy().tolist()], dtype=object)
+        elif column.dtype.kind == "f":
+            numbers = column.to_numpy()
+            valid = isfinite(numbers)
+            values = array(list(map(repr, numbers.tolist())), dtype=object)
+        else:
+            valid = column.notna().to_numpy()
+            values = encode_labels(column, '\\"', quote='"')
+        encoded = encoded + where(valid, prefix + values, "")
+    return array([each[1:] for each in encoded.tolist()], dtype=object)
+
+
+def line_protocol(
+    df: DataFrame,
+    measurement: str,
+    tags: tuple[str, ...] | list[str] = (),
+    precision: str = "ns",
+    chunk_size: int = 5000,
+) -> Iterator[tuple[int, str]]:
+    """
+    Encode a time indexed DataFrame as InfluxDB line protocol, a whole
+    column at a time, in chunks of at most `chunk_size` rows so that
+    memory stays bounded. Yields the number of lines and their text.
+    Columns named in `tags` become tags, and the rest fields. Rows without
+    any field values are skipped, because every line needs a field.
+    """
+    divisor = PRECISION_DIVISORS[precision]
+    prefix = escape_line_protocol(measurement, ", ")
+    tag_keys = sorted(tags)
+    fields = [name for name in df.columns if name not in tag_keys]
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size]
+        index = DatetimeIndex(chunk.index).as_unit("ns")
+        timestamps = array(list(map(str, (index.asi8 // divisor).tolist())), dtype=object)
+        encoded = full(len(chunk), prefix, dtype=object)
+        for name in tag_keys:
+            values = encode_labels(chunk[name], ", =")
+            key = "," + escape_line_protocol(name, ", =") + "="
+            encoded = encoded + where(values != "", key + values, "")
+        values = encode_fields(chunk, fields)
+        lines = (encoded + " " + values + " " + timestamps)[values != ""]
+        if len(lines):
+            yield len(lines), "\n".join(lines.tolist())
+
+
+def write_line_protocol(
+    path: Path,
+    df: DataFrame,
+    measurement: str,
+    tags: tuple[str, ...] | list[str] = (),
+    precision: str = "ns",
+    chunk_size: int = 5000,
+) -> int:
+    """
+    Write a DataFrame to a line protocol file for offline import with
+    `influx write`, one chunk at a time. Returns the number of lines.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    total = 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fid:
+        for count, text in line_protocol(df, measurement, tags, precision, chunk_size):
+            fid.write(text + "\n")
+            total += count
+    return total
+
+
+def influx_write(
+    client, records: str, rows: int, retries: int = 0, backoff: float = 1.0, precision: str = "ns"
+) -> None:
+    """
+    Write line protocol with an InfluxDB client, and record the latency,
+    size, and failures of each request. Transient failures are retried up
+    to `retries` times.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    attempt = 0
+    while True:
+        started = perf_counter()
+        try:
+            client.write(record=records, write_precision=precision)
+        except influx_write_errors() as error:
+            metrics.inc("penbay_influx_write_failures_total")
+            if attempt >= retries or not is_retryable(error):
+                raise
+            sleep(retry_delay(error, attempt, backoff))
+            attempt += 1
+            continue
+        finally:
+            metrics.observe("penbay_influx_write_seconds", perf_counter() - started)
+        metrics.observe("penbay_influx_write_rows", rows)
+        return
+
+
+def write_dead_letter(path: Path, records: str, error: Exception) -> None:
+    """
+    Append a batch of line protocol that could not be written to a file,
+    after a comment with the reason, so it can be inspected and replayed
+    with `influx write`.
+    """
+    reason = " ".join(str(error).split())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fid:
+        fid.write(f"# {datetime.now():%Y-%m-%dT%H:%M:%S} {reason}\n")
+        fid.write(records + "\n")
+
+
+def bulk_write(
+    client,
+    df: DataFrame,
+    measurement: str,
+    tags: tuple[str, ...] | list[str] = (),
+    batch_size: int = 5000,
+    concurrency: int = 4,
+    retries: int = 5,
+    backoff: float = 1.0,
+    dead_letter: Optional[Path] = None,
+    precision: str = "ns",
+) -> tuple[int, int]:
+    """
+    Write a DataFrame as line protocol in batches of at most `batch_size`
+    rows, with several requests in flight. Batches are encoded as they are
+    sent, so only a few are held in memory at once. A batch that is
+    rejected, or still fails after all retries, doesn't stop the others.
+    It is appended to the dead-letter file if there is one. Returns the
+    number of rows written and failed.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    lock = Lock()
+
+    def send(rows: int, records: str) -> tuple[int, bool]:
+        try:
+            influx_write(client, records, rows, retries=retries, backoff=backoff, precision=precision)
+        except influx_write_errors() as error:
+            if dead_letter is not None:
+                with lock:
+                    write_dead_letter(dead_letter, records, error)
+            return rows, False
+        return rows, True
+
+    written = failed = 0
+    pending: set[Future] = set()
+
+    def collect(futures: set[Future]) -> None:
+        nonlocal written, failed
+        for future in futures:
+            rows, ok = future.result()
+            if ok:
+                written += rows
+            else:
+                failed += rows
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for rows, records in line_protocol(df, measurement, tags, precision, batch_size):
+            if len(pending) >= 2 * concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(send, rows, records))
+        collect(pending)
+    return written, failed
+
+
+def bulk_write_options(function):
+    """
+    Attach options for batched, concurrent, retried uploads. Like
+    `influx_options`, they are supplied in reverse order.
+    """
+    function = option(
+        "--line-protocol",
+        type=PathType(dir_okay=False, path_type=Path),
+        default=None,
+        help=(
+            "Write line protocol to this file for offline import with `influx write`, "
+            "instead of uploading."
+        ),
+    )(function)
+    function = option(
+        "--dead-letter",
+        type=PathType(dir_okay=False, path_type=Path),
+        default=None,
+        help="Append batches that could not be written to this line protocol file.",
+    )(function)
+    function = option(
+        "--gzip/--no-gzip",
+        default=True,
+        help="Compress requests. Defaults to compressing.",
+    )(function)
+    function = option(
+        "--retries",
+        default=5,
+        type=IntRange(min=0),
+        help="Retries for each batch after transient failures, with exponential backoff.",
+    )(function)
+    function = option(
+        "--concurrency",
+        default=4,
+        type=IntRange(min=1),
+        help="Number of batches to send at once.",
+    )(function)
+    function = option(
+        "--batch-size",
+        default=5000,
+        type=IntRange(min=1),
+        help="Maximum number of rows in each request.",
+    )(function)
+    return function
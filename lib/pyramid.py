@@ -0,0 +1,222 @@
+"""
+Aggregate pyramids: partial aggregates of samples at fixed resolutions,
+kept on disk and updated incrementally, so that summaries of any window
+are read from the coarsest adequate level instead of raw samples.
+"""
+
+import json
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+from pandas import DataFrame, DatetimeIndex, Timedelta, Timestamp, concat, read_parquet
+from pandas.tseries.frequencies import to_offset
+from numpy import ones
+
+
+class AggregateLevel(Enum):
+    """
+    Resolutions stored in an `AggregatePyramid`, from finest to
+    coarsest. Each level is derived from the one before it, so
+    only the finest level ever touches raw samples.
+    """
+
+    HOURLY = "h"
+    DAILY = "D"
+    MONTHLY = "MS"
+
+
+# How partial aggregates combine when merging bins, or rolling
+# a finer level up into a coarser one.
+AGGREGATE_REDUCTIONS = {
+    "count": "sum",
+    "sum": "sum",
+    "sumsq": "sum",
+    "min": "min",
+    "max": "max",
+    "first": "first",
+    "last": "last",
+}
+
+
+def floor_to_level(index: DatetimeIndex, level: AggregateLevel) -> DatetimeIndex:
+    """
+    Assign timestamps to the left edge of their bin at a pyramid level.
+    Months are not a fixed width, so they go through periods instead
+    of `floor`.
+    """
+    if level is AggregateLevel.MONTHLY:
+        return index.to_period("M").to_timestamp()
+    return index.floor(level.value)
+
+
+def aggregate_samples(df: DataFrame, level: AggregateLevel) -> DataFrame:
+    """
+    Reduce raw samples in a wide, time-indexed frame to partial aggregates
+    at the finest pyramid level. The output is long format, indexed by
+    stream name and bin start, so that streams with different coverage
+    do not create empty rows for each other.
+    """
+    long = df.rename_axis(None).melt(
+        ignore_index=False, var_name="stream", value_name="value"
+    ).dropna(subset=["value"])
+    long["value"] = long["value"].astype(float)
+    long["sumsq"] = long["value"] * long["value"]
+    long["time"] = floor_to_level(DatetimeIndex(long.index), level)
+    grouped = long.sort_index(kind="stable").groupby(["stream", "time"], sort=True)
+    result = grouped["value"].agg(["count", "sum", "min", "max", "first", "last"])
+    result["sumsq"] = grouped["sumsq"].sum()
+    return result[list(AGGREGATE_REDUCTIONS.keys())]
+
+
+def combine_aggregates(df: DataFrame, level: Optional[AggregateLevel] = None) -> DataFrame:
+    """
+    Merge partial aggregates that share a stream and bin. When a level is
+    given, bins are first re-assigned to that coarser level, which is how
+    the pyramid is rolled up. Input must be sorted by time within each
+    stream for `first` and `last` to be correct.
+    """
+    streams = df.index.get_level_values("stream")
+    times = df.index.get_level_values("time")
+    if level is not None:
+        times = floor_to_level(DatetimeIndex(times), level)
+    return df.groupby([streams, times.rename("time")], sort=True).agg(AGGREGATE_REDUCTIONS)
+
+
+def summarize_aggregates(df: DataFrame) -> DataFrame:
+    """
+    Convert partial aggregates into the statistics that plots and reports
+    actually use. Sample standard deviation is recovered from the sum of
+    squares, to match `Resampler.std()`.
+    """
+    mean = df["sum"] / df["count"]
+    variance = ((df["sumsq"] - df["count"] * mean * mean) / (df["count"] - 1)).clip(lower=0)
+    return DataFrame(
+        {
+            "count": df["count"].astype(int),
+            "mean": mean,
+            "std": variance ** 0.5,
+            "min": df["min"],
+            "max": df["max"],
+            "first": df["first"],
+            "last": df["last"],
+        }
+    )
+
+
+class AggregatePyramid:
+    """
+    Precomputed count, sum, sum of squares, min, max, and first/last values
+    for every stream of a station table, stored at hourly, daily, and monthly
+    resolution as Parquet files in a single directory.
+
+    Updates are incremental. Only samples newer than the stored watermark are
+    aggregated, and only bins touched by those samples are rewritten at each
+    coarser level. Queries read the coarsest level that can exactly answer
+    the requested resampling frequency.
+    """
+
+    watermark_file = "watermark.json"
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.levels: dict[AggregateLevel, DataFrame] = {}
+        self.watermark: Optional[Timestamp] = None
+        watermark = directory / self.watermark_file
+        if watermark.exists():
+            with open(watermark, "r", encoding="utf-8") as fid:
+                self.watermark = Timestamp(json.load(fid)["watermark"])
+        for level in AggregateLevel:
+            path = self.path(level)
+            if path.exists():
+                self.levels[level] = read_parquet(path)
+
+    def path(self, level: AggregateLevel) -> Path:
+        """
+        Location of a single level on disk.
+        """
+        return self.directory / f"{level.name.lower()}.parquet"
+
+    def update(self, df: DataFrame) -> int:
+        """
+        Add raw samples from a wide, time-indexed frame. Returns the number
+        of new timestamps that were aggregated.
+        """
+        if self.watermark is not None:
+            df = df.loc[df.index > self.watermark]
+        df = df.select_dtypes(include="number").sort_index()
+        if df.empty:
+            return 0
+        finest = list(AggregateLevel)[0]
+        delta = aggregate_samples(df, finest)
+        for level in AggregateLevel:
+            # New samples are all later than the watermark, so existing bins
+            # come first when merging and `first`/`last` stay ordered.
+            changes = delta if level is finest else combine_aggregates(delta, level)
+            existing = self.levels.get(level)
+            if existing is not None:
+                touched = existing.index.isin(changes.index)
+                changes = combine_aggregates(concat([existing.loc[touched], changes]))
+                changes = concat([existing.loc[~touched], changes]).sort_index()
+            self.levels[level] = changes
+        self.watermark = df.index.max()
+        self.save()
+        return len(df)
+
+    def save(self):
+        """
+        Write all levels and the watermark to disk.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for level, df in self.levels.items():
+            df.to_parquet(self.path(level))
+        with open(self.directory / self.watermark_file, "w", encoding="utf-8") as fid:
+            json.dump({"watermark": self.watermark.isoformat()}, fid)
+
+    def adequate_level(self, freq: str) -> AggregateLevel:
+        """
+        Choose the coarsest stored level whose bins nest exactly inside
+        bins of the requested frequency.
+        """
+        offset = to_offset(freq)
+        if offset.name.startswith(("M", "Q", "Y")):
+            return AggregateLevel.MONTHLY
+        if offset.name.startswith("W"):
+            return AggregateLevel.DAILY
+        width = Timedelta(offset.nanos)
+        for level in (AggregateLevel.DAILY, AggregateLevel.HOURLY):
+            if width % Timedelta(1, unit=level.value) == Timedelta(0):
+                return level
+        raise ValueError(f"Frequency {freq} is finer than the finest pyramid level")
+
+    def query(
+        self,
+        freq: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        streams: Optional[list[str]] = None,
+    ) -> DataFrame:
+        """
+        Summary statistics for each stream at the requested frequency
+        within a time window, without touching raw samples.
+        """
+        level = self.adequate_level(freq)
+        if level not in self.levels:
+            raise ValueError(f"No {level.name.lower()} aggregates in {self.directory}")
+        df = self.levels[level]
+        times = df.index.get_level_values("time")
+        mask = ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        if streams is not None:
+            mask &= df.index.get_level_values("stream").isin(streams)
+        df = df.loc[mask]
+        resampled = (
+            df.reset_index("stream")
+            .groupby("stream")
+            .resample(freq)
+            .agg(AGGREGATE_REDUCTIONS)
+        )
+        return summarize_aggregates(resampled.loc[resampled["count"] > 0])
@@ -0,0 +1,178 @@
+"""
+Clocks and time bins. Station clocks are converted to naive UTC, and
+frames are resampled to calendar or fixed bins, with directions averaged
+as vectors, gusts kept as maxima, and rainfall summed.
+"""
+
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Optional, Callable
+from pandas import DataFrame, DatetimeIndex, Grouper, Series, Timedelta
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
+from numpy import (
+    add,
+    append,
+    arctan2,
+    argsort,
+    copyto,
+    cos,
+    deg2rad,
+    float64,
+    diff,
+    empty,
+    flatnonzero,
+    fmax,
+    int64,
+    isnan,
+    multiply,
+    nan,
+    rad2deg,
+    sin,
+    where,
+)
+from numpy.typing import NDArray
+
+
+def utc_now() -> datetime:
+    """
+    The current time as a naive UTC datetime, like the times of database
+    records, whatever the time zone of the machine.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def local_to_utc(index: DatetimeIndex, time_zone: str) -> DatetimeIndex:
+    """
+    Convert naive times on a local clock, like those of a WeatherLink
+    export, to naive UTC. Times that repeat when clocks fall back are
+    daylight time the first time they appear, and times that are skipped
+    when clocks spring forward are moved forward.
+    """
+    index = DatetimeIndex(index)
+    daylight = ~index.duplicated(keep="first")
+    aware = index.tz_localize(time_zone, ambiguous=daylight, nonexistent="shift_forward")
+    return aware.tz_convert("UTC").tz_localize(None)
+
+
+class Aggregator(Enum):
+    """
+    Reductions of the samples in a time bin.
+    """
+
+    MEAN = "mean"
+    SUM = "sum"
+    MAX = "max"
+    VECTOR_MEAN = "vector mean"
+
+
+# CF standard names that are not aggregated with the mean. Directions are
+# angles, so they are averaged as vectors weighted by their speeds.
+RESAMPLE_AGGREGATORS = {
+    "wind_from_direction": Aggregator.VECTOR_MEAN,
+    "wind_gust_from_direction": Aggregator.VECTOR_MEAN,
+    "wind_speed_of_gust": Aggregator.MAX,
+    "rainfall_amount": Aggregator.SUM,
+}
+
+
+VECTOR_WEIGHTS = {
+    "wind_from_direction": "wind_speed",
+    "wind_gust_from_direction": "wind_speed_of_gust",
+}
+
+
+def is_fixed_frequency(every: str) -> bool:
+    """
+    Whether a pandas frequency has a fixed width, like "1h", so that bins
+    can be computed from timestamps alone, or by a database. Calendar
+    frequencies, like "W" or "ME", have bins of varying width.
+    """
+    return isinstance(to_offset(every), Tick)
+
+
+def bin_codes(index: DatetimeIndex, every: str) -> tuple[NDArray, Callable[[NDArray], DatetimeIndex]]:
+    """
+    Integer code of the time bin of each timestamp, and a function that
+    labels codes like `resample` does. Fixed width bins are
+    counted from the epoch, like `DatetimeIndex.floor`, in the time unit
+    of the index to avoid a conversion. Calendar frequencies are grouped
+    like `resample`, with the labels it uses.
+    """
+    index = DatetimeIndex(index)
+    if not is_fixed_frequency(every):
+        # Resampling groups numbers rows in time order, whatever their order
+        order = argsort(index.asi8, kind="stable")
+        groups = Series(0, index=index[order]).groupby(Grouper(freq=every))
+        labels = DatetimeIndex(groups.size().index, name=index.name)
+        codes = empty(len(index), dtype=int64)
+        codes[order] = groups.ngroup().to_numpy()
+        return codes, lambda codes: labels[codes]
+    width = to_offset(every).nanos // Timedelta(1, unit=index.unit).value
+    return index.asi8 // width, lambda codes: DatetimeIndex(
+        (codes * width).astype(f"datetime64[{index.unit}]"), name=index.name
+    )
+
+
+def resample_frame(
+    df: DataFrame,
+    every: str,
+    aggregators: Optional[dict[str, Aggregator]] = None,
+) -> DataFrame:
+    """
+    Aggregate every series in a frame into time bins, with the reduction
+    that suits each one, from `RESAMPLE_AGGREGATORS` unless given. Only
+    bins with samples are returned, and missing values are skipped.
+
+    Samples are grouped by sorting integer bin codes once, if they are
+    not already in order. Sums, counts, and the components of direction
+    vectors are stacked into one block, and reduced for all series with a
+    single `reduceat`. Vector means are weighted by the speed in
+    `VECTOR_WEIGHTS` if the frame has it, and are missing where the mean
+    vector has no length, like when it is calm.
+    """
+    aggregators = aggregators if aggregators is not None else RESAMPLE_AGGREGATORS
+    index = DatetimeIndex(df.index)
+    codes, label = bin_codes(index, every)
+    # Series are rows, so that each reduction runs over contiguous memory
+    values = df.to_numpy(float64).T
+    if len(codes) and (diff(codes) < 0).any():
+        order = argsort(codes, kind="stable")
+        codes, values = codes[order], values[:, order]
+    starts = flatnonzero(append(True, diff(codes) != 0)) if len(codes) else codes
+    edges = label(codes[starts])
+    columns = list(df.columns)
+    kinds = [aggregators.get(each, Aggregator.MEAN) for each in columns]
+    vectors = [index for index, kind in enumerate(kinds) if kind is Aggregator.VECTOR_MEAN]
+    count, pairs = len(columns), len(vectors)
+    missing = isnan(values)
+    block = empty((2 * count + 2 * pairs, len(codes)))
+    sums, counts = block[:count], block[count : 2 * count]
+    east, north = block[2 * count : 2 * count + pairs], block[2 * count + pairs :]
+    copyto(sums, values)
+    copyto(sums, 0.0, where=missing)
+    copyto(counts, ~missing)
+    for position, index in enumerate(vectors):
+        weight = VECTOR_WEIGHTS.get(columns[index])
+        weights = values[columns.index(weight)] if weight in df.columns else 1.0
+        weights = where(missing[index] | isnan(weights), 0.0, weights)
+        angles = deg2rad(sums[index])
+        multiply(sin(angles), weights, out=east[position])
+        multiply(cos(angles), weights, out=north[position])
+    if len(codes):
+        block = add.reduceat(block, starts, axis=1)
+        sums, counts = block[:count], block[count : 2 * count]
+        east, north = block[2 * count : 2 * count + pairs], block[2 * count + pairs :]
+    result = where(counts > 0, sums / where(counts > 0, counts, 1), nan)
+    for index, kind in enumerate(kinds):
+        if kind is Aggregator.SUM:
+            result[index] = where(counts[index] > 0, sums[index], nan)
+    maxima = [index for index, kind in enumerate(kinds) if kind is Aggregator.MAX]
+    if maxima and len(codes):
+        result[maxima] = fmax.reduceat(values[maxima], starts, axis=1)
+    if vectors:
+        # Tiny negative angles round up to 360 after taking the modulus
+        direction = rad2deg(arctan2(east, north)) % 360
+        direction[direction >= 360] = 0.0
+        result[vectors] = where((east != 0) | (north != 0), direction, nan)
+    return DataFrame(result.T, index=edges, columns=df.columns)
@@ -0,0 +1,87 @@
+"""
+Progress of routine syncs, kept between runs, so that each one only sends
+rows that are newer than the last. Watermarks are checked against the
+destination database before they are trusted.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+from pandas import Timestamp
+
+
+WATERMARKS_PATH = Path(__file__).parent.parent / "watermarks.json"
+
+
+class Watermarks:
+    """
+    Time of the newest row synced to each destination, kept between runs
+    so that a routine sync only sends new rows. A destination is a
+    database, measurement, and tag values. Watermarks are checked against
+    the database before use, because it may have been wiped or lost
+    writes since the last run.
+    """
+
+    def __init__(self, path: Path = WATERMARKS_PATH):
+        self.path = path
+        self.values: dict[str, str] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as fid:
+                self.values = json.load(fid)
+
+    @staticmethod
+    def key(database: str, measurement: str, **tags: str) -> str:
+        """
+        Identify a destination, independent of the order of tags.
+        """
+        return "/".join([database, measurement, *(f"{k}={v}" for k, v in sorted(tags.items()))])
+
+    def verify(self, key: str, remote: Optional[Timestamp]) -> Optional[Timestamp]:
+        """
+        Time after which rows still need to be sent. This is the stored
+        watermark, unless the database is empty or behind it, in which case
+        the database wins. Without a stored watermark, rows newer than the
+        database are sent.
+        """
+        stored = self.values.get(key)
+        if remote is None:
+            return None
+        if stored is None:
+            return remote
+        return min(Timestamp(stored), remote)
+
+    def set(self, key: str, value: Timestamp):
+        """
+        Advance a watermark, and save all of them.
+        """
+        self.values[key] = value.isoformat()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with open(temporary, "w", encoding="utf-8") as fid:
+            json.dump(self.values, fid, indent=2, sort_keys=True)
+        temporary.replace(self.path)
+
+
+def influx_max_time(client, measurement: str, **tags: str) -> Optional[Timestamp]:
+    """
+    Time of the newest row in a measurement with the given tag values, or
+    None if there are no rows or the measurement doesn't exist yet. This
+    only reads one value, instead of the whole measurement.
+    """
+    # pylint: disable=import-outside-toplevel
+    from influxdb_client_3 import InfluxDB3ClientQueryError
+
+    where = " AND ".join(f"{key} = '{value}'" for key, value in tags.items())
+    query = f'SELECT MAX(time) AS latest FROM "{measurement}"'
+    if where:
+        query += f" WHERE {where}"
+    try:
+        df = client.query(query, mode="pandas")
+    except InfluxDB3ClientQueryError as error:
+        if "not found" in str(error).lower():
+            return None
+        raise
+    if df.empty or df["latest"].isna().all():
+        return None
+    latest = Timestamp(df["latest"].iloc[0])
+    return latest.tz_localize(None) if latest.tzinfo is not None else latest
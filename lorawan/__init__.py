@@ -2,6 +2,7 @@
 LoRaWAN CLI commands.
 """
 from enum import Enum
+from functools import cache
 from os import getenv
 from pathlib import Path
 from uuid import uuid4
@@ -9,9 +10,7 @@ from typing import Optional
 from random import uniform, randint
 from datetime import datetime, timedelta, timezone
 import json
-import requests
 import click
-from pyproj import Transformer
 from pandas import json_normalize, to_datetime
 
 
@@ -29,14 +28,25 @@ class LoraWANCommand(Enum):
     SECRET = "secret"
     SIGNAL = "signal"
 
-# Create a transformer from WGS84 3D Ellipsoidal to WGS84 + EGM96 Sea Level Altitude
-# EPSG:4979 is Latitude/Longitude/Ellipsoidal height (3D)
-# EPSG:5773 is EGM96 orthometric height (altitude above sea level)
-transformer = Transformer.from_crs(
-    "EPSG:4979", 
-    "EPSG:4326+5773", 
-    always_xy=True
-)
+# HTTP and geodesy dependencies are imported where they are used, so that
+# loading the command group stays fast.
+# pylint: disable=import-outside-toplevel
+
+
+@cache
+def altitude_transformer():
+    """
+    Create a transformer from WGS84 3D Ellipsoidal to WGS84 + EGM96 Sea Level Altitude
+    on first use. EPSG:4979 is Latitude/Longitude/Ellipsoidal height (3D), and
+    EPSG:5773 is EGM96 orthometric height (altitude above sea level)
+    """
+    from pyproj import Transformer
+
+    return Transformer.from_crs(
+        "EPSG:4979",
+        "EPSG:4326+5773",
+        always_xy=True
+    )
 
 FIGURES_DIR = Path(__file__).parent / "figures"
 WORKER_URL = "https://ttn-to-influx.hurricane-island.workers.dev/"
@@ -65,7 +75,7 @@ def describe():
 
 def to_altitude(lat, lon, ellipsoidal_height):
     """Convert ellipsoidal height to altitude above sea level."""
-    lon, lat, altitude = transformer.transform(lon, lat, ellipsoidal_height)
+    lon, lat, altitude = altitude_transformer().transform(lon, lat, ellipsoidal_height)
     return altitude
 
 def parse_uplink_message(message: dict) -> dict:
@@ -102,6 +112,7 @@ def fetch_uplink_messages(
     """
     Fetch uplink messages from TTN API.
     """
+    import requests
     
     api_key = getenv("TTN_API_KEY")
     headers = {
@@ -202,6 +213,8 @@ def lorawan_db_mock(device_id: str, secret: Optional[str]):
     Send a test message to the Cloudflare Worker that writes to InfluxDB.
     This is useful for testing the integration without sending real data from a device.
     """
+    import requests
+
     click.echo("Sending test message to Cloudflare Worker...")
     message = create_mock_message(device_id)
     headers = {
@@ -229,6 +242,8 @@ def lorawan_db_sync(application_id: str, device_id: str):
     This is useful for backfilling data that may have been missed by the webhook.
     Unless values/keys have changed, this should be idempotent and safe to run multiple times.
     """
+    import requests
+
     data = fetch_uplink_messages(application_id, device_id)
     click.echo(f"Syncing {len(data)} (all) uplink messages from TTN to InfluxDB.")
     headers = {
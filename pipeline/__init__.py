@@ -0,0 +1,227 @@
+"""
+Declarative pipeline runner over existing CLI commands.
+
+A pipeline file lists stages, each of which runs a `penbay` command and
+declares the files it reads and writes, and which stages it needs:
+
+```yaml
+stages:
+  wynken-pyramid:
+    command: buoys file pyramid wynken sonde
+    inputs: [buoys/data/*ynken_SondeValues_*.dat]
+    outputs: [buoys/data/pyramid/wynken/SondeValues/*.parquet]
+  wynken-export:
+    command: buoys file export wynken -q qartod.yaml -q wynken.yaml
+    inputs: [buoys/data/*ynken_*.dat, buoys/qartod/*.yaml]
+    outputs: [buoys/export/wynken/*.csv]
+    needs: [wynken-pyramid]
+```
+
+Paths are glob patterns relative to the pipeline file. A stage is keyed by
+a hash of its command, the contents of its inputs, and the contents of the
+outputs of the stages it needs. It only runs if that key changed since its
+last successful run, or its outputs are missing. Stages whose needs are met
+run in parallel worker processes, which also keep parsed data files in
+memory between the stages they run.
+
+Keys are stored next to the pipeline file, in `<name>.state.json`.
+"""
+
+import json
+import shlex
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+import click
+from yaml import safe_load
+
+
+class Stage:
+    """
+    A single command in a pipeline, with the files it depends on and produces.
+    """
+
+    name: str
+    command: list[str]
+    inputs: list[str]
+    outputs: list[str]
+    needs: list[str]
+
+    def __init__(
+        self,
+        name: str,
+        command: str | list[str],
+        inputs: Optional[list[str]] = None,
+        outputs: Optional[list[str]] = None,
+        needs: Optional[list[str]] = None,
+    ):
+        self.name = name
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.needs = needs or []
+
+
+def hash_files(root: Path, patterns: list[str], digest) -> None:
+    """
+    Add the names and contents of all files matching glob patterns to a
+    running digest. Files are visited in sorted order so that the result
+    doesn't depend on the file system.
+    """
+    for pattern in patterns:
+        digest.update(pattern.encode("utf-8"))
+        for path in sorted(root.glob(pattern)):
+            if not path.is_file():
+                continue
+            digest.update(str(path.relative_to(root)).encode("utf-8"))
+            with open(path, "rb") as fid:
+                while chunk := fid.read(1 << 20):
+                    digest.update(chunk)
+
+
+class Pipeline:
+    """
+    Stages loaded from a pipeline file, and the keys of their last successful runs.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.root = path.parent
+        with open(path, "r", encoding="utf-8") as fid:
+            config = safe_load(fid) or {}
+        self.stages = {
+            name: Stage(name, **options) for name, options in config.get("stages", {}).items()
+        }
+        for stage in self.stages.values():
+            unknown = set(stage.needs) - set(self.stages)
+            if unknown:
+                raise click.ClickException(
+                    f"Stage '{stage.name}' needs unknown stages: {', '.join(sorted(unknown))}"
+                )
+        self.order = self.topological_order()
+        self.state_path = path.with_suffix(".state.json")
+        self.state: dict[str, str] = {}
+        if self.state_path.exists():
+            with open(self.state_path, "r", encoding="utf-8") as fid:
+                self.state = json.load(fid)
+
+    def topological_order(self) -> list[str]:
+        """
+        Order stages so that every stage comes after the stages it needs.
+        """
+        order: list[str] = []
+        visiting: set[str] = set()
+
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise click.ClickException(f"Pipeline has a cycle through stage '{name}'")
+            visiting.add(name)
+            for each in self.stages[name].needs:
+                visit(each)
+            visiting.remove(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def key(self, stage: Stage) -> str:
+        """
+        Content hash of everything that determines the result of a stage.
+        """
+        digest = sha256(json.dumps(stage.command).encode("utf-8"))
+        hash_files(self.root, stage.inputs, digest)
+        for each in stage.needs:
+            hash_files(self.root, self.stages[each].outputs, digest)
+        return digest.hexdigest()
+
+    def is_fresh(self, stage: Stage, key: str) -> bool:
+        """
+        A stage is fresh if it last succeeded with the same key, and
+        all of its outputs still exist.
+        """
+        outputs_exist = all(any(self.root.glob(pattern)) for pattern in stage.outputs)
+        return self.state.get(stage.name) == key and outputs_exist
+
+    def save(self):
+        """
+        Write stage keys to disk.
+        """
+        with open(self.state_path, "w", encoding="utf-8") as fid:
+            json.dump(self.state, fid, indent=2, sort_keys=True)
+
+
+def run_stage(command: list[str]) -> None:
+    """
+    Run a CLI command in a worker process. Imported here, because the
+    entry point lazily loads this module.
+    """
+    # pylint: disable=import-outside-toplevel
+    from cli import cli
+
+    cli.main(args=command, prog_name="penbay", standalone_mode=False)
+
+
+@click.command(name="run")
+@click.argument("pipeline", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--jobs", "-j", default=None, type=click.IntRange(min=1), help="Maximum number of stages to run at once. Defaults to the number of processors.")
+@click.option("--force", is_flag=True, help="Run every stage, even if it is fresh.")
+@click.option("--dry-run", is_flag=True, help="Show which stages would run, without running them.")
+def run(pipeline: Path, jobs: Optional[int], force: bool, dry_run: bool):
+    """
+    Run the stale stages of a declarative pipeline file.
+    """
+    config = Pipeline(pipeline.resolve())
+    if dry_run:
+        stale: set[str] = set()
+        for name in config.order:
+            stage = config.stages[name]
+            if force or stale & set(stage.needs) or not config.is_fresh(stage, config.key(stage)):
+                stale.add(name)
+            click.echo(f"{name}: {'stale' if name in stale else 'fresh'}")
+        return
+
+    pending = list(config.order)
+    done: set[str] = set()
+    failed: set[str] = set()
+    running: dict[Future, tuple[str, str]] = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage = config.stages[name]
+                if failed & set(stage.needs):
+                    pending.remove(name)
+                    failed.add(name)
+                    click.echo(f"{name}: skipped, because a stage it needs failed")
+                    continue
+                if not set(stage.needs) <= done:
+                    continue
+                pending.remove(name)
+                key = config.key(stage)
+                if not force and config.is_fresh(stage, key):
+                    done.add(name)
+                    click.echo(f"{name}: fresh")
+                    continue
+                click.echo(f"{name}: running {shlex.join(stage.command)}")
+                running[pool.submit(run_stage, stage.command)] = (name, key)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key = running.pop(future)
+                try:
+                    future.result()
+                # Any error in a command is reported, and only stops stages that need it
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    failed.add(name)
+                    click.echo(f"{name}: failed, {error}", err=True)
+                    continue
+                done.add(name)
+                config.state[name] = key
+                config.save()
+                click.echo(f"{name}: done")
+    if failed:
+        raise click.ClickException(f"{len(failed)} stage(s) did not complete: {', '.join(sorted(failed))}")
@@ -0,0 +1,99 @@
+"""
+Test the pipeline runner.
+
+Stages use fast commands, and read inputs from a temporary
+directory so that staleness can be controlled.
+"""
+import pytest
+from click.testing import CliRunner
+from . import run
+
+runner = CliRunner()
+
+PIPELINE = """
+stages:
+  first:
+    command: buoys file list
+    inputs: [inputs/*.txt]
+  second:
+    command: buoys firmware mock wynken
+    inputs: [other.txt]
+  last:
+    command: buoys file list
+    needs: [first, second]
+"""
+
+
+@pytest.fixture(name="pipeline")
+def fixture_pipeline(tmp_path):
+    """
+    Pipeline file with input files next to it.
+    """
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "inputs" / "a.txt").write_text("a", encoding="utf-8")
+    (tmp_path / "other.txt").write_text("b", encoding="utf-8")
+    path = tmp_path / "pipeline.yaml"
+    path.write_text(PIPELINE, encoding="utf-8")
+    return path
+
+
+def test_cli_run_only_stale_stages(pipeline):
+    """
+    Expect stages to run once, and then again only when inputs change
+    """
+    result = runner.invoke(run, [str(pipeline), "--jobs", "2"])
+    assert result.exit_code == 0
+    assert result.output.count("running") == 3
+    result = runner.invoke(run, [str(pipeline)])
+    assert result.exit_code == 0
+    assert result.output.count("fresh") == 3
+    (pipeline.parent / "inputs" / "b.txt").write_text("b", encoding="utf-8")
+    result = runner.invoke(run, [str(pipeline), "--dry-run"])
+    assert "first: stale" in result.output
+    assert "second: fresh" in result.output
+    result = runner.invoke(run, [str(pipeline)])
+    assert result.exit_code == 0
+    assert "first: running" in result.output
+    assert "second: fresh" in result.output
+
+
+def test_cli_run_missing_output(pipeline):
+    """
+    Expect a stage with missing outputs to re-run every time
+    """
+    pipeline.write_text(
+        "stages:\n  missing:\n    command: buoys file list\n    outputs: [nothing.csv]\n",
+        encoding="utf-8",
+    )
+    for _ in range(2):
+        result = runner.invoke(run, [str(pipeline)])
+        assert "missing: running" in result.output
+
+
+def test_cli_run_failed_stage(pipeline):
+    """
+    Expect stages that need a failed stage to be skipped
+    """
+    pipeline.write_text(
+        "stages:\n"
+        "  broken:\n    command: buoys plot tail wynken sonde sea_water_temperature\n"
+        "  after:\n    command: buoys file list\n    needs: [broken]\n",
+        encoding="utf-8",
+    )
+    result = runner.invoke(run, [str(pipeline)])
+    assert result.exit_code == 1
+    assert "after: skipped" in result.output
+
+
+def test_cli_run_cycle(pipeline):
+    """
+    Expect cycles to be rejected before anything runs
+    """
+    pipeline.write_text(
+        "stages:\n  a:\n    command: buoys file list\n    needs: [b]\n"
+        "  b:\n    command: buoys file list\n    needs: [a]\n",
+        encoding="utf-8",
+    )
+    result = runner.invoke(run, [str(pipeline)])
+    assert result.exit_code == 1
+    assert "cycle" in result.output
@@ -6,7 +6,6 @@ import click
 from pathlib import Path
 from pandas import read_csv, DataFrame, Series, cut
 from numpy import arange
-from matplotlib.pyplot import subplots
 
 DATA_DIR = Path(__file__).parent / "data"
 FIGURES_DIR = Path(__file__).parent / "figures"
@@ -42,6 +41,8 @@ def profiles_plot(filename: str, step: float, figsize: tuple) -> None:
     """
     Plot a single depth profile, e.g., temperature, salinity, or density.
     """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.pyplot import subplots
 
     # Need to tell program how to find the data 
     filename: Path = (DATA_DIR / filename).with_suffix(".csv")
@@ -0,0 +1,310 @@
+"""
+Resident daemon that keeps parsed data in memory between requests.
+
+Every CLI call pays for interpreter startup, imports, file parsing, and QC
+from scratch. `penbay serve` does that work once, and answers repeated
+queries from dashboards, scripts, and forwarding CLI commands over a local
+HTTP/JSON API:
+
+- `GET /health`
+- `GET /metrics`, performance metrics in Prometheus text format
+- `GET /buoys/<station>/<table>/describe`
+- `GET /buoys/<station>/<table>/tail?series=...&days=30&end=YYYY-MM-DD`
+- `GET /buoys/<station>/<table>/qartod?series=...&qartod=...&test=rollup&days=30`
+- `GET /buoys/<station>/<table>/pyramid?resample=1D&start=...&end=...&series=...`
+- `GET /buoys/<station>/<table>/figure?series=...&qartod=...&test=rollup&days=30`
+- `GET /weather/<station>/describe`
+
+Parsed buoy files and QARTOD configurations are cached by the modules that
+read them, and checked against file modification times, so new recoveries
+are picked up without restarting the daemon.
+
+Only `buoys file describe` and `weather file describe` forward to the
+daemon. The tail, QARTOD, and figure routes answer HTTP clients, but the
+matching commands compute locally. The figure route runs `buoys plot tail`
+in the daemon, which would forward to itself.
+
+Requests are handled in threads, so that a slow figure doesn't hold up
+health checks and metrics scrapes. Figures are rendered one at a time,
+because pyplot keeps global state, and pyramids are updated and queried
+under a lock, because updates rewrite their files. The caches of parsed
+files hold a lock of their own.
+"""
+# Route handlers share a signature, even when they don't use the cache
+# pylint: disable=unused-argument
+
+import re
+import json
+from datetime import datetime, timedelta
+from enum import Enum
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+from threading import Lock
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+import click
+from lib import AggregatePyramid, ResponseHandler, frame_to_payload, metrics
+from buoys import (
+    StationName as BuoyStationName,
+    TableName,
+    PYRAMID_DIR,
+    buoys_plot_tail,
+    format_column_standard_name,
+    load_and_subset_multifile_table,
+    summarize_station_table,
+)
+from buoys.qartod import TestTypes, load_and_merge_qa_configs, run_qartod_tests
+from weather import (
+    StationName as WeatherStationName,
+    WeatherLinkArchive,
+    summarize_archive,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Held while rendering a figure, because pyplot state is global
+FIGURE_LOCK = Lock()
+
+
+class ServeError(Exception):
+    """
+    A request that can't be answered, with the HTTP status to report.
+    """
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class WarmCache:
+    """
+    In-memory state that outlives a single request. Buoy files, WeatherLink
+    exports, and QARTOD configurations are cached where they are parsed, so
+    this only holds what is specific to the daemon.
+    """
+
+    def __init__(self):
+        self.pyramids: dict[tuple[str, str], AggregatePyramid] = {}
+        self.lock = Lock()
+
+    def pyramid(self, name: BuoyStationName, table: TableName) -> AggregatePyramid:
+        """
+        Aggregate pyramid for a station table, brought up to date with the
+        current files. Call with the lock held, and query under it too.
+        """
+        key = (name.value, table.value)
+        if key not in self.pyramids:
+            self.pyramids[key] = AggregatePyramid(PYRAMID_DIR / name.value / table.value)
+        df, _ = load_and_subset_multifile_table(name, table, None, None)
+        df = df.drop(columns=["RECORD"], errors="ignore")
+        df.columns = list(map(format_column_standard_name, df.columns))
+        self.pyramids[key].update(df)
+        return self.pyramids[key]
+
+
+def parse_choice(enum: type[Enum], value: str) -> Enum:
+    """
+    Match a path or query value to an Enum, case-insensitively by value.
+    """
+    for each in enum:
+        if each.value.lower() == value.lower() or each.name.lower() == value.lower():
+            return each
+    choices = ", ".join(each.value for each in enum)
+    raise ServeError(f"Unknown value '{value}', expected one of: {choices}", HTTPStatus.NOT_FOUND)
+
+
+def single(params: dict[str, list[str]], key: str, default: Optional[str] = None) -> str:
+    """
+    Get a single query parameter, which is required if there is no default.
+    """
+    values = params.get(key)
+    if values:
+        return values[-1]
+    if default is None:
+        raise ServeError(f"Missing query parameter '{key}'")
+    return default
+
+
+def window(params: dict[str, list[str]]) -> tuple[datetime, datetime]:
+    """
+    Time window from `end` and `days` query parameters, matching the
+    defaults of `buoys plot tail`.
+    """
+    end = single(params, "end", "")
+    _end = datetime.strptime(end, "%Y-%m-%d") if end else datetime.now()
+    return _end - timedelta(days=int(single(params, "days", "30"))), _end
+
+
+def buoy_tail(
+    cache: WarmCache, name: BuoyStationName, table: TableName, params: dict
+) -> dict:
+    """
+    Recent values of one or more series, with standard names.
+    """
+    start, end = window(params)
+    df, _ = load_and_subset_multifile_table(name, table, start, end)
+    df.columns = list(map(format_column_standard_name, df.columns))
+    series = params.get("series")
+    if series:
+        missing = set(series) - set(df.columns)
+        if missing:
+            raise ServeError(f"Unknown series: {', '.join(sorted(missing))}", HTTPStatus.NOT_FOUND)
+        df = df[series]
+    return frame_to_payload(df.rename_axis("time"))
+
+
+def buoy_qartod(
+    cache: WarmCache, name: BuoyStationName, table: TableName, params: dict
+) -> dict:
+    """
+    QARTOD flags for a single series over a recent window.
+    """
+    series = single(params, "series")
+    test = parse_choice(TestTypes, single(params, "test", TestTypes.ROLLUP.value))
+    config = load_and_merge_qa_configs(tuple(params.get("qartod", ["qartod.yaml"])))
+    if series not in config.get("streams", {}):
+        raise ServeError(f"No QARTOD configuration for '{series}'", HTTPStatus.NOT_FOUND)
+    start, end = window(params)
+    df, _ = load_and_subset_multifile_table(name, table, start, end)
+    gps, _ = load_and_subset_multifile_table(name, TableName.DIAGNOSTIC, start, end)
+    df = df.drop(columns=["RECORD"]).join(gps, how="left")
+    df.columns = list(map(format_column_standard_name, df.columns))
+    df = df[["Latitude", "Longitude", series]]
+    flags = run_qartod_tests(
+        df, {"streams": {series: config["streams"][series]}}
+    ).get_group(series)
+    result = df[[series]].assign(flag=flags[test.value].astype(int))
+    return frame_to_payload(result.rename_axis("time"))
+
+
+def buoy_pyramid(
+    cache: WarmCache, name: BuoyStationName, table: TableName, params: dict
+) -> dict:
+    """
+    Aggregates for any window and resolution, from the coarsest adequate level.
+    """
+    start = params.get("start")
+    end = params.get("end")
+    try:
+        with cache.lock:
+            summary = cache.pyramid(name, table).query(
+                single(params, "resample", "1D"),
+                datetime.fromisoformat(start[-1]) if start else None,
+                datetime.fromisoformat(end[-1]) if end else None,
+                streams=params.get("series"),
+            )
+    except ValueError as error:
+        raise ServeError(str(error)) from error
+    return frame_to_payload(summary.reset_index())
+
+
+def buoy_figure(
+    cache: WarmCache, name: BuoyStationName, table: TableName, params: dict
+) -> dict:
+    """
+    Render `buoys plot tail` in-process, and return the output path.
+    """
+    # Click matches Enum choices by name
+    args = [name.name.lower(), table.name.lower(), single(params, "series")]
+    for each in params.get("qartod", ["qartod.yaml"]):
+        args += ["--qartod", each]
+    for key in ("test", "days", "end", "image-format"):
+        if key in params:
+            args += [f"--{key}", single(params, key)]
+    try:
+        with FIGURE_LOCK:
+            filepath = buoys_plot_tail.main(args, standalone_mode=False)
+    except click.ClickException as error:
+        raise ServeError(error.format_message()) from error
+    return {"path": str(filepath)}
+
+
+def buoy_describe(
+    cache: WarmCache, name: BuoyStationName, table: TableName, params: dict
+) -> dict:
+    """
+    Same summary as `buoys file describe`.
+    """
+    return frame_to_payload(summarize_station_table(name, table))
+
+
+BUOY_ROUTES: dict[str, Callable[[WarmCache, BuoyStationName, TableName, dict], dict]] = {
+    "describe": buoy_describe,
+    "tail": buoy_tail,
+    "qartod": buoy_qartod,
+    "pyramid": buoy_pyramid,
+    "figure": buoy_figure,
+}
+
+
+def route(cache: WarmCache, path: str, params: dict[str, list[str]]) -> dict:
+    """
+    Dispatch a request path to the function that answers it.
+    """
+    if path == "/health":
+        return {"status": "ok"}
+    match = re.fullmatch(r"/buoys/([^/]+)/([^/]+)/([^/]+)", path)
+    if match and match.group(3) in BUOY_ROUTES:
+        name = parse_choice(BuoyStationName, match.group(1))
+        table = parse_choice(TableName, match.group(2))
+        return BUOY_ROUTES[match.group(3)](cache, name, table, params)
+    match = re.fullmatch(r"/weather/([^/]+)/describe", path)
+    if match:
+        station = parse_choice(WeatherStationName, match.group(1))
+        return frame_to_payload(summarize_archive(WeatherLinkArchive(station.value).df))
+    raise ServeError(f"No route for {path}", HTTPStatus.NOT_FOUND)
+
+
+def create_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server with its own warm cache. Use port 0
+    to pick any free port, as in testing.
+    """
+    cache = WarmCache()
+
+    class Handler(ResponseHandler):
+        """
+        Answer GET requests with JSON.
+        """
+
+        # pylint: disable=invalid-name
+        def do_GET(self):
+            """
+            Route the request, and report errors as JSON too. Unexpected
+            errors are logged, and answered as a server error, instead of
+            dropping the connection.
+            """
+            url = urlparse(self.path)
+            if url.path == "/metrics":
+                self.respond(HTTPStatus.OK, metrics.exposition(), "text/plain; version=0.0.4")
+                return
+            try:
+                status, body = HTTPStatus.OK, route(cache, url.path, parse_qs(url.query))
+            except ServeError as error:
+                status, body = error.status, {"error": str(error)}
+            except (FileNotFoundError, KeyError, ValueError) as error:
+                status, body = HTTPStatus.BAD_REQUEST, {"error": str(error)}
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                self.log_error("Failed %s: %r", self.path, error)
+                status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(error).__name__}: {error}"}
+            self.respond(status, json.dumps(body), "application/json")
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+@click.command(name="serve")
+@click.option("--host", default=DEFAULT_HOST, help="Address to listen on. Defaults to localhost.")
+@click.option("--port", default=DEFAULT_PORT, type=int, help="Port to listen on.")
+def serve(host: str, port: int):
+    """
+    Run a resident daemon that keeps parsed data in memory.
+    """
+    server = create_server(host, port)
+    url = f"http://{host}:{server.server_port}"
+    click.echo(f"Serving on {url}, set PENBAY_SERVE_URL={url} to forward commands")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
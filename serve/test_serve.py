@@ -0,0 +1,152 @@
+"""
+Test the resident daemon and forwarding from CLI commands.
+
+The server runs in a background thread on a free port for the
+duration of the module.
+"""
+import json
+from threading import Thread
+from urllib.request import urlopen
+from urllib.error import HTTPError
+import pytest
+from click.testing import CliRunner
+from buoys import buoys_file_describe
+from weather import weather_file_describe
+from . import BUOY_ROUTES, create_server
+
+runner = CliRunner()
+by_station = pytest.mark.parametrize("name", ["wynken", "blynken"])
+
+
+@pytest.fixture(scope="module", name="url")
+def fixture_url():
+    """
+    Start the server, and shut it down after the tests.
+    """
+    server = create_server(port=0)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def get(url: str) -> dict:
+    """
+    Decode a JSON response.
+    """
+    with urlopen(url, timeout=120) as response:
+        return json.load(response)
+
+
+def test_serve_health(url):
+    """
+    Expect the server to report it is running
+    """
+    assert get(f"{url}/health") == {"status": "ok"}
+
+
+@by_station
+def test_serve_buoys_tail(url, name):
+    """
+    Expect recent values with standard names
+    """
+    result = get(f"{url}/buoys/{name}/sonde/tail?series=sea_water_temperature&days=1000")
+    assert result["columns"] == ["sea_water_temperature"]
+    assert len(result["data"]) > 0
+
+
+@by_station
+def test_serve_buoys_qartod(url, name):
+    """
+    Expect a flag for every value
+    """
+    result = get(
+        f"{url}/buoys/{name}/sonde/qartod?series=sea_water_temperature"
+        f"&qartod=qartod.yaml&qartod={name}.yaml&days=1000&test=gross_range"
+    )
+    assert result["columns"] == ["sea_water_temperature", "flag"]
+
+
+@by_station
+def test_serve_buoys_pyramid(url, name):
+    """
+    Expect monthly aggregates
+    """
+    result = get(f"{url}/buoys/{name}/sonde/pyramid?resample=ME&series=sea_water_temperature")
+    assert "mean" in result["columns"]
+
+
+def test_serve_metrics(url):
+    """
+    Expect Prometheus text exposition
+    """
+    get(f"{url}/buoys/wynken/sonde/tail?days=1")
+    with urlopen(f"{url}/metrics", timeout=120) as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        text = response.read().decode("utf-8")
+    assert "# TYPE penbay_rows_parsed_total counter" in text
+
+
+def test_serve_not_found(url):
+    """
+    Expect unknown stations to be reported as JSON errors
+    """
+    with pytest.raises(HTTPError) as error:
+        get(f"{url}/buoys/nobody/sonde/tail")
+    assert error.value.code == 404
+
+
+def test_serve_unexpected_error(url, monkeypatch):
+    """
+    Expect a bug in a route to be answered as a JSON server error, and
+    the server to keep answering
+    """
+
+    def broken(*args):
+        raise RuntimeError("broken route")
+
+    monkeypatch.setitem(BUOY_ROUTES, "describe", broken)
+    with pytest.raises(HTTPError) as error:
+        get(f"{url}/buoys/wynken/sonde/describe")
+    assert error.value.code == 500
+    assert json.load(error.value) == {"error": "RuntimeError: broken route"}
+    assert get(f"{url}/health") == {"status": "ok"}
+
+
+@by_station
+@pytest.mark.parametrize("table", ["sonde", "diagnostic"])
+def test_cli_buoys_file_describe_forwarded(url, name, table):
+    """
+    Expect the same rows whether or not the command is forwarded. Mixed type
+    columns are numeric after a round trip through JSON, so values may
+    be formatted differently.
+    """
+    local = runner.invoke(buoys_file_describe, [name, table])
+    forwarded = runner.invoke(buoys_file_describe, [name, table, "--serve-url", url])
+    assert forwarded.exit_code == 0
+    # Server request logs may be interleaved before the summary
+    rows = [
+        [line.split()[:1] for line in result.output.split("Samples:")[1].splitlines()]
+        for result in (local, forwarded)
+    ]
+    assert rows[0] == rows[1]
+
+
+def test_cli_weather_file_describe_forwarded(url):
+    """
+    Expect command line output from the daemon
+    """
+    result = runner.invoke(weather_file_describe, ["apprenticeshop", "--serve-url", url])
+    assert result.exit_code == 0
+    assert "air_temperature" in result.output
+
+
+def test_cli_forward_unreachable():
+    """
+    Expect commands to fall back to local processing
+    """
+    result = runner.invoke(
+        buoys_file_describe, ["wynken", "sonde", "--serve-url", "http://127.0.0.1:9"]
+    )
+    assert result.exit_code == 0
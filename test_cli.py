@@ -0,0 +1,118 @@
+"""
+Test the CLI entry point, startup cost, and instrumentation.
+
+Startup is measured in a fresh interpreter, because the test session
+has already imported everything.
+"""
+import sys
+import json
+import subprocess
+from pathlib import Path
+from pstats import Stats
+import pytest
+from click.testing import CliRunner
+from cli import cli
+
+ENTRY_POINT = Path(__file__).parent / "cli.py"
+# Modules that are slow to import and must only load for commands that use them
+HEAVY_MODULES = {
+    "pandas",
+    "matplotlib",
+    "scipy",
+    "pyproj",
+    "gpxpy",
+    "ioos_qc",
+    "influxdb_client_3",
+    "requests",
+}
+# Total time spent importing modules for trivial commands, in milliseconds
+IMPORT_BUDGET = 100
+
+
+def import_times(*args: str) -> dict[str, int]:
+    """
+    Run the CLI with `-X importtime` and return the time spent importing
+    each module itself, in microseconds. Pass no arguments to get the
+    modules loaded by interpreter startup alone.
+    """
+    command = [str(ENTRY_POINT), *args] if args else ["-c", "pass"]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *command],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(self_time)
+    return times
+
+
+@pytest.mark.parametrize("args", [["--help"], ["buoys", "--help"], ["buoys", "file", "list"]])
+def test_cli_lazy_imports(args):
+    """
+    Expect heavy dependencies to stay unloaded, besides Pandas
+    for commands inside a platform group
+    """
+    loaded = {name.split(".")[0] for name in import_times(*args)}
+    allowed = {"pandas"} if len(args) > 1 else set()
+    assert not (HEAVY_MODULES - allowed) & loaded
+
+
+def test_cli_help_import_budget():
+    """
+    Expect top level help to load within the import budget, not
+    counting modules the interpreter loads on startup
+    """
+    startup = import_times()
+    times = import_times("--help")
+    assert sum(times[name] for name in times.keys() - startup.keys()) / 1000 < IMPORT_BUDGET
+
+
+runner = CliRunner()
+
+
+@pytest.mark.parametrize("suffix", [".json", ".folded"])
+def test_cli_spans(tmp_path, suffix):
+    """
+    Expect named timing spans to be written in the format of the file suffix
+    """
+    path = (tmp_path / "spans").with_suffix(suffix)
+    result = runner.invoke(cli, ["--spans", str(path), "buoys", "file", "describe", "wynken", "sonde"])
+    assert result.exit_code == 0
+    text = path.read_text(encoding="utf-8")
+    if suffix == ".json":
+        assert json.loads(text)[0]["name"] == "read_campbell_logger_files"
+    else:
+        assert text.startswith("read_campbell_logger_files ")
+
+
+def test_cli_profile(tmp_path):
+    """
+    Expect cProfile statistics to be saved
+    """
+    path = tmp_path / "penbay.prof"
+    result = runner.invoke(cli, ["--profile-output", str(path), "buoys", "file", "list"])
+    assert result.exit_code == 0
+    assert Stats(str(path)).total_calls > 0
+
+
+def test_cli_metrics(tmp_path):
+    """
+    Expect counters to accumulate across commands in the textfile
+    """
+    path = tmp_path / "penbay.prom"
+    args = ["--metrics", str(path), "buoys", "file", "describe", "wynken", "sonde"]
+    totals = []
+    for _ in range(2):
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0
+        lines = path.read_text(encoding="utf-8").splitlines()
+        totals.append(
+            sum(float(each.split()[-1]) for each in lines if each.startswith("penbay_cache_hits_total"))
+        )
+    # Files parsed by the first command are cached for the second
+    assert totals[1] > totals[0]
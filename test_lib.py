@@ -0,0 +1,300 @@
+"""
+Test shared processing functions.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from numpy import arange, inf, nan
+from numpy.random import default_rng
+from pandas import DataFrame, Series, Timedelta, Timestamp, date_range, isna
+from pyarrow import Table
+from lib import (
+    CARDINAL_DEGREES,
+    FAHRENHEIT_OFFSET,
+    FAHRENHEIT_SCALE,
+    AggregatePyramid,
+    Aggregator,
+    QueryCache,
+    LruCache,
+    Metrics,
+    Source,
+    UnitConversions,
+    Watermarks,
+    bulk_write,
+    line_protocol,
+    cardinal_direction_to_degrees,
+    fahrenheit_to_kelvin,
+    frame_from_arrow,
+    resample_frame,
+    time_periods,
+)
+
+
+def test_aggregate_pyramid_incremental_update(tmp_path):
+    """
+    Expect incremental updates to match aggregating all samples at once,
+    and queries to match resampling the raw data.
+    """
+    index = date_range("2025-01-01", periods=24 * 90, freq="10min")
+    rng = default_rng(0)
+    df = DataFrame({"a": rng.normal(size=len(index)), "b": rng.normal(size=len(index))}, index=index)
+    df.iloc[5:50, 1] = nan
+    pyramid = AggregatePyramid(tmp_path)
+    assert pyramid.update(df.iloc[:1000]) == 1000
+    # Overlapping samples are skipped by the watermark
+    assert AggregatePyramid(tmp_path).update(df.iloc[900:]) == len(df) - 1000
+    pyramid = AggregatePyramid(tmp_path)
+    for freq in ["2h", "1D", "W", "ME"]:
+        summary = pyramid.query(freq)
+        expected = df.resample(freq).agg(["count", "mean", "std", "min", "max", "first", "last"])
+        for stream in ["a", "b"]:
+            actual = summary.loc[stream]
+            reference = expected[stream].loc[expected[stream]["count"] > 0]
+            assert (actual["count"].values == reference["count"].values).all()
+            for column in ["mean", "std", "min", "max", "first", "last"]:
+                assert abs(actual[column].values - reference[column].values).max() < 1e-9
+
+
+class FlakyClient:
+    """
+    Fails the first write of every batch with a server error, and
+    rejects batches that contain a negative value.
+    """
+
+    def __init__(self):
+        self.attempts: dict = {}
+        self.written: list = []
+
+    def write(self, record, **kwargs):
+        # pylint: disable=import-outside-toplevel,unused-argument
+        from influxdb_client_3.write_client.rest import ApiException
+
+        lines = record.splitlines()
+        key = int(lines[0].split()[-1])
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        if "value=-" in record:
+            raise ApiException(status=400, reason="Bad Request")
+        if self.attempts[key] == 1:
+            raise ApiException(status=503, reason="Service Unavailable")
+        self.written.append(lines)
+
+
+def test_bulk_write_retries_and_dead_letter(tmp_path):
+    """
+    Expect transient failures to be retried, and rejected batches
+    to be saved as line protocol without stopping the others
+    """
+    index = date_range("2025-01-01", periods=100, freq="h", name="time")
+    df = DataFrame({"station": "wynken", "value": range(100)}, index=index, dtype=object)
+    df["value"] = df["value"].astype(float)
+    df.iloc[42, 1] = -1.0
+    client = FlakyClient()
+    dead_letter = tmp_path / "dead.lp"
+    written, failed = bulk_write(
+        client, df, "test", ["station"], batch_size=10, concurrency=3, retries=2,
+        backoff=0.0, dead_letter=dead_letter,
+    )
+    assert (written, failed) == (90, 10)
+    assert sum(len(each) for each in client.written) == 90
+    assert client.attempts[index[40].value] == 1
+    lines = dead_letter.read_text(encoding="utf-8").splitlines()
+    assert lines[0].startswith("#") and len(lines) == 11
+    assert lines[1].startswith("test,station=wynken value=40")
+
+
+def test_line_protocol_escaping_and_missing_values():
+    """
+    Expect escaped names and tags, typed fields, missing values dropped from
+    each row, rows without fields skipped, and chunks of bounded size
+    """
+    index = date_range("2026-01-01", periods=4, freq="h", name="time")
+    df = DataFrame({
+        "location": ["wyn ken", "a,b", None, "x"],
+        "temp": [1.5, nan, inf, 0.1],
+        "count": [1, 2, 3, 4],
+        "note": ['say "hi"', None, None, "ok"],
+    }, index=index)
+    chunks = list(line_protocol(df, "my table", ["location"], precision="s", chunk_size=3))
+    assert [count for count, _ in chunks] == [3, 1]
+    lines = "\n".join(text for _, text in chunks).splitlines()
+    seconds = index.as_unit("s").asi8
+    assert lines[0] == f'my\\ table,location=wyn\\ ken temp=1.5,count=1i,note="say \\"hi\\"" {seconds[0]}'
+    assert lines[1] == f"my\\ table,location=a\\,b count=2i {seconds[1]}"
+    assert lines[2] == f"my\\ table count=3i {seconds[2]}"
+    empty = DataFrame({"temp": [nan]}, index=index[:1])
+    assert not list(line_protocol(empty, "test"))
+
+
+def test_watermarks_verify(tmp_path):
+    """
+    Expect the stored watermark to be used, unless the database is behind or empty
+    """
+    path = tmp_path / "watermarks.json"
+    key = Watermarks.key("buoys", "Ai1", location="wynken")
+    watermarks = Watermarks(path)
+    remote = Timestamp("2026-01-02")
+    assert watermarks.verify(key, remote) == remote
+    watermarks.set(key, Timestamp("2026-01-01"))
+    watermarks = Watermarks(path)
+    assert watermarks.verify(key, remote) == Timestamp("2026-01-01")
+    assert watermarks.verify(key, Timestamp("2025-12-01")) == Timestamp("2025-12-01")
+    assert watermarks.verify(key, None) is None
+
+
+def test_query_cache_refresh(tmp_path):
+    """
+    Expect only rows newer than the cached ones to be fetched, and appended
+    """
+    calls = []
+    index = date_range("2026-01-01", periods=4, freq="h")
+
+    def fetch(after):
+        calls.append(after)
+        if after is None:
+            return Table.from_pandas(DataFrame({"time": index[:2], "value": [0.0, 1.0]}))
+        return Table.from_pandas(DataFrame({"time": index[index > after], "value": [2.0, 3.0]}))
+
+    cache = QueryCache(tmp_path, "localhost", "weather", "archive")
+    assert cache.refresh(fetch, "time").num_rows == 2
+    table = QueryCache(tmp_path, "localhost", "weather", "archive").refresh(fetch, "time")
+    assert calls == [None, index[1]]
+    assert table["value"].to_pylist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_lru_cache():
+    """
+    Expect the least recently used entry to be dropped when full
+    """
+    cache = LruCache(2)
+    cache["a"], cache["b"] = 1, 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert list(cache) == ["a", "c"] and cache.get("b") is None
+
+
+def test_metrics_exposition(tmp_path):
+    """
+    Expect label values to be escaped, counts from many threads to add
+    up, and large values to keep every digit
+    """
+    registry = Metrics()
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(8):
+            executor.submit(lambda: [registry.inc("penbay_cache_hits_total", cache="a") for _ in range(1000)])
+    registry.inc("penbay_cache_hits_total", cache='C:\\cache "b"\nc')
+    registry.set("penbay_weather_ingest_latency_seconds", 1760000000.5, station="dev")
+    lines = registry.exposition().splitlines()
+    assert 'penbay_cache_hits_total{cache="a"} 8000.0' in lines
+    assert 'penbay_cache_hits_total{cache="C:\\\\cache \\"b\\"\\nc"} 1.0' in lines
+    assert 'penbay_weather_ingest_latency_seconds{station="dev"} 1760000000.5' in lines
+    path = tmp_path / "penbay.prom"
+    registry.write_textfile(path)
+    registry.write_textfile(path)
+    assert 'penbay_cache_hits_total{cache="a"} 16000.0' in path.read_text(encoding="utf-8").splitlines()
+
+
+def test_query_cache_overlap(tmp_path):
+    """
+    Expect cached rows in the overlap to be replaced by fetched ones, so
+    that late records are picked up without duplicates
+    """
+    index = date_range("2026-01-01", periods=4, freq="h")
+    # The record at index[1] arrives after the first query
+    tables = [
+        DataFrame({"time": index[[0, 2]], "value": [0.0, 2.0]}),
+        DataFrame({"time": index[1:], "value": [1.0, 2.0, 3.0]}),
+    ]
+    calls = []
+
+    def fetch(after):
+        calls.append(after)
+        return Table.from_pandas(tables[len(calls) - 1], preserve_index=False)
+
+    cache = QueryCache(tmp_path, "localhost", "weather", "archive")
+    cache.refresh(fetch, "time", Timedelta(hours=1.5))
+    table = cache.refresh(fetch, "time", Timedelta(hours=1.5))
+    assert calls == [None, index[2] - Timedelta(hours=1.5)]
+    assert table["time"].to_pylist() == list(index)
+    assert table["value"].to_pylist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_frame_from_arrow():
+    """
+    Expect columns converted in one pass under standard names, with
+    missing values and unknown labels as NaN
+    """
+    table = Table.from_pydict({
+        "time": date_range("2026-01-01", periods=3, freq="h").to_numpy(),
+        "outTemp": [32.0, None, 212.0],
+        "windDir": ["N", "E", "calm"],
+        "windGustDir": [90.0, 180.0, None],
+    })
+    conversions = UnitConversions({
+        "outTemp": ("air_temperature", Source("outTemp", FAHRENHEIT_SCALE, FAHRENHEIT_OFFSET)),
+        "windDir": ("wind_from_direction", Source("windDir", lookup=CARDINAL_DEGREES)),
+        "windGustDir": ("wind_gust_from_direction", Source("windGustDir", lookup=CARDINAL_DEGREES)),
+        "missing": ("rain", Source("missing", 25.4)),
+    })
+    df = frame_from_arrow(table, "time", conversions)
+    assert list(df.columns) == ["air_temperature", "wind_from_direction", "wind_gust_from_direction"]
+    assert abs(df["air_temperature"].iloc[2] - fahrenheit_to_kelvin(212.0)) < 1e-9
+    assert isna(df["air_temperature"].iloc[1])
+    assert df["wind_from_direction"].iloc[1] == 90.0 and isna(df["wind_from_direction"].iloc[2])
+    assert df["wind_gust_from_direction"].iloc[1] == 180.0
+    assert (cardinal_direction_to_degrees(Series(["N", "E"])) == [0.0, 90.0]).all()
+
+
+def test_resample_frame_aggregators():
+    """
+    Expect directions to be averaged as speed weighted vectors, gusts to
+    take the maximum, rain to be summed, and everything else averaged,
+    whatever the order of the samples
+    """
+    index = date_range("2026-01-01", periods=8, freq="30min")
+    df = DataFrame({
+        "wind_from_direction": [350, 10, nan, 90, 180, 180, 0, nan],
+        "wind_speed": [1, 1, 5, 2, 0, 0, 0, 1],
+        "wind_speed_of_gust": [1, 3, 2, nan, 4, 1, nan, nan],
+        "rainfall_amount": [0.1, 0.2, 0, nan, 1, 1, nan, nan],
+        "air_temperature": [1, 2, 3, 4, 5, 6, nan, nan],
+    }, index=index)
+    result = resample_frame(df.iloc[::-1], "1h")
+    assert list(result.index) == list(date_range("2026-01-01", periods=4, freq="1h"))
+    # Across north, and missing when calm
+    assert result["wind_from_direction"].iloc[:2].round(6).tolist() == [0.0, 90.0]
+    assert result["wind_from_direction"].iloc[2:].isna().all()
+    assert result["wind_speed_of_gust"].iloc[:3].tolist() == [3.0, 2.0, 4.0]
+    assert result["rainfall_amount"].iloc[:3].round(6).tolist() == [0.3, 0.0, 2.0]
+    assert result["air_temperature"].iloc[:3].tolist() == [1.5, 3.5, 5.5]
+    assert isna(result.iloc[3]).sum() == 4
+    # Everything averaged when aggregators are given
+    means = resample_frame(df, "1h", aggregators={})
+    assert means.equals(df.resample("1h").mean())
+    assert resample_frame(df, "1h", {"air_temperature": Aggregator.MAX})["air_temperature"].iloc[0] == 2
+
+
+@pytest.mark.parametrize("every", ["W", "ME"])
+def test_resample_frame_calendar(every):
+    """
+    Expect calendar frequencies, which have bins of varying width, to be
+    grouped and labeled like pandas resampling, without empty bins
+    """
+    index = date_range("2026-01-01", periods=3000, freq="37min")
+    df = DataFrame({"air_temperature": arange(3000.0), "rainfall_amount": 0.5}, index=index)
+    df = df[(index < "2026-01-10") | (index > "2026-01-25")]
+    result = resample_frame(df.iloc[::-1], every)
+    expected = df.resample(every).agg({"air_temperature": "mean", "rainfall_amount": "sum"})
+    expected = expected[df["air_temperature"].resample(every).count() > 0]
+    assert result.index.equals(expected.index)
+    assert (result - expected).abs().max().max() < 1e-9
+
+
+def test_time_periods():
+    """
+    Expect chunks of rows to be regrouped into calendar months, whatever
+    the size of the chunks
+    """
+    df = DataFrame({"a": range(90)}, index=date_range("2026-01-01", periods=90, freq="D"))
+    chunks = [df.iloc[start : start + 7] for start in range(0, len(df), 7)]
+    months = list(time_periods(chunks, "M"))
+    assert [len(each) for each in months] == [31, 28, 31]
+    assert months[1].index[0] == Timestamp("2026-02-01")
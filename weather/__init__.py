@@ -7,6 +7,7 @@ This module provides a command-line interface for using weather station data, in
 - `export`:Concatenate CSV files from a single station
 - `describe`: Show summary statistics for a station
 - `db`: Get information about the Influx database
+- `qc`: Flag station data with QARTOD tests
 - TBD: Backfill Influx database from CSV files
 - Convert CSV names to WeeWx/InfluxDB names
 
@@ -21,26 +22,102 @@ Questions:
 
 """
 
+from datetime import datetime, timedelta
 from pathlib import Path
 from enum import Enum
+from time import perf_counter
+from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+import json
+import sqlite3
+from contextlib import closing
+from functools import cached_property
 import click
-from pandas import read_csv, to_datetime, DataFrame, Series, concat
-from influxdb_client_3 import InfluxDBClient3
+from yaml import safe_load
+from pandas import (
+    read_csv,
+    read_parquet,
+    read_sql_query,
+    to_datetime,
+    date_range,
+    factorize,
+    merge_asof,
+    DataFrame,
+    DatetimeIndex,
+    Series,
+    Timedelta,
+    Timestamp,
+    concat,
+)
+from numpy import array, arctan2, concatenate, cos, deg2rad, diff, flatnonzero, hypot, int8, minimum, ones, rad2deg, sin, tile
+from numpy.typing import NDArray
+from pandas.tseries.frequencies import to_offset
 from lib import (
+    CF_UNITS,
+    ExportFormat,
+    ImageFormat,
+    export_frames,
     plot_options,
+    plot_stations,
     influx_options,
     boxplot,
     plot_tail,
-    fahrenheit_to_kelvin,
-    cardinal_direction_to_degrees,
+    Aggregator,
+    RESAMPLE_AGGREGATORS,
+    VECTOR_WEIGHTS,
+    FAHRENHEIT_SCALE,
+    FAHRENHEIT_OFFSET,
+    CARDINAL_DEGREES,
+    UnitConversions,
     StandardUnits,
-    Source
+    Source,
+    serve_url_option,
+    forward_to_server,
+    frame_from_payload,
+    timing_span,
+    metrics,
+    influx_write,
+    line_protocol,
+    influx_max_time,
+    sync_options,
+    Watermarks,
+    QueryCache,
+    frame_from_arrow,
+    is_fixed_frequency,
+    resample_frame,
+    utc_now,
+    local_to_utc,
 )
+from weather.derived import FEET_TO_METERS, derive
+from weather.monitor import GapIndex
+from weather.qartod import QARTOD_CONFIG, QartodTest, flag_column, load_qartod_config, summarize_flags
+
+if TYPE_CHECKING:
+    from pyarrow import Table
 
 
 DATA_DIR = Path(__file__).parent / "data"
+# Time zone of the clocks of WeatherLink exports, which have naive times
+WEATHER_LINK_TIME_ZONE = "America/New_York"
+# Destination of `weather db backfill`
+BACKFILL_DATABASE = "neracoos"
+BACKFILL_MEASUREMENT = "weather"
 FIGURES_DIR = Path(__file__).parent / "figures"
+CACHE_DIR = Path(__file__).parent / "cache"
+DASHBOARD = Path(__file__).parent.parent / "grafana" / "weather.json"
+STATIONS_REGISTRY = Path(__file__).parent / "stations.yaml"
+MONITOR_INDEX = CACHE_DIR / "monitor.json"
+# Cached archive records this recent are queried again, for records that
+# the device sends late, after an outage of the cellular link
+CACHE_OVERLAP = Timedelta(days=2)
+# Downsampled measurements are named with these suffixes, and dashboards
+# switch to them once the panel interval, in milliseconds, is this long
+DOWNSAMPLES = {"1h": 3_600_000, "1d": 86_400_000}
+# Grafana plugin of the wind rose panel
+WINDROSE_PANEL = "operato-windrose-panel"
 TIME = "time"
+STATION = "station"
+# WeeWX unit system of the archive records that CF_STANDARDS converts from
+US_UNITS = 1
 KNOTS_TO_SPEED = 0.514444
 INCHES_OF_MERCURY_TO_PRESSURE = 3386.389
 MILES_PER_HOUR_TO_SPEED = 0.44704
@@ -80,6 +157,12 @@ class ClickCommands(Enum):
     DESCRIBE = "describe"
     BACKFILL = "backfill"
     EXPORT = "export"
+    DOWNSAMPLE = "downsample"
+    DASHBOARD = "dashboard"
+    # multi-station commands
+    COMPARE = "compare"
+    STATIONS = "stations"
+    MONITOR = "monitor"
 
 
 # pylint: disable=too-few-public-methods
@@ -93,9 +176,9 @@ class ObservedProperty:
     name: str
     units: str
     weewx: Source
-    weather_link: Source
+    weather_link: Optional[Source]
 
-    def __init__(self, name: str, unit: str, weewx: Source, weather_link: Source):
+    def __init__(self, name: str, unit: str, weewx: Source, weather_link: Optional[Source] = None):
         self.name = name
         self.unit = unit
         self.weewx = weewx
@@ -125,6 +208,7 @@ class StandardNames(Enum):
     HEAT_INDEX_OF_AIR_TEMPERATURE = "heat_index_of_air_temperature"
     DEW_POINT_TEMPERATURE = "dew_point_temperature"
     WATER_EVAPOTRANSPIRATION_FLUX = "water_evapotranspiration_flux"
+    SURFACE_AIR_PRESSURE = "surface_air_pressure"
 
 
 # Standard units for display, not used in determining value conversions
@@ -132,132 +216,164 @@ CF_STANDARDS = {
     StandardNames.AIR_TEMPERATURE: ObservedProperty(
         name=StandardNames.AIR_TEMPERATURE.value,
         unit=StandardUnits.TEMPERATURE.value,
-        weather_link=Source(name="Temp Out", transform=fahrenheit_to_kelvin),
-        weewx=Source(name="outTemp", transform=fahrenheit_to_kelvin),
+        weather_link=Source(name="Temp Out", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
+        weewx=Source(name="outTemp", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
     ),
     StandardNames.RELATIVE_HUMIDITY: ObservedProperty(
         name=StandardNames.RELATIVE_HUMIDITY.value,
         unit="",
-        weather_link=Source(
-            name="Out Hum", transform=lambda x: x * PERCENT_TO_FRACTION
-        ),
-        weewx=Source(name="outHumidity", transform=lambda x: x * PERCENT_TO_FRACTION),
+        weather_link=Source(name="Out Hum", scale=PERCENT_TO_FRACTION),
+        weewx=Source(name="outHumidity", scale=PERCENT_TO_FRACTION),
     ),
     StandardNames.WIND_SPEED: ObservedProperty(
         name=StandardNames.WIND_SPEED.value,
         unit=StandardUnits.SPEED.value,
-        weather_link=Source(
-            name="Wind Speed",
-            transform=lambda x: x * KNOTS_TO_SPEED,
-        ),
-        weewx=Source(name="windSpeed", transform=lambda x: x * MILES_PER_HOUR_TO_SPEED),
+        weather_link=Source(name="Wind Speed", scale=KNOTS_TO_SPEED),
+        weewx=Source(name="windSpeed", scale=MILES_PER_HOUR_TO_SPEED),
     ),
     StandardNames.WIND_FROM_DIRECTION: ObservedProperty(
         name=StandardNames.WIND_FROM_DIRECTION.value,
         unit=StandardUnits.DIRECTION.value,
-        weather_link=Source(name="Wind Dir", transform=lambda x: x),
-        weewx=Source(name="windDir", transform=cardinal_direction_to_degrees),
+        weather_link=Source(name="Wind Dir", lookup=CARDINAL_DEGREES),
+        weewx=Source(name="windDir", lookup=CARDINAL_DEGREES),
     ),
     StandardNames.AIR_PRESSURE: ObservedProperty(
         name=StandardNames.AIR_PRESSURE.value,
         unit=StandardUnits.PRESSURE.value,
-        weather_link=Source(
-            name="Bar", transform=lambda x: x * INCHES_OF_MERCURY_TO_PRESSURE
-        ),
-        weewx=Source(
-            name="barometer", transform=lambda x: x * INCHES_OF_MERCURY_TO_PRESSURE
-        ),
+        weather_link=Source(name="Bar", scale=INCHES_OF_MERCURY_TO_PRESSURE),
+        weewx=Source(name="barometer", scale=INCHES_OF_MERCURY_TO_PRESSURE),
     ),
     StandardNames.WIND_SPEED_OF_GUST: ObservedProperty(
         name=StandardNames.WIND_SPEED_OF_GUST.value,
         unit=StandardUnits.SPEED.value,
-        weather_link=Source(
-            name="Hi Speed", transform=lambda x: x * KNOTS_TO_SPEED
-        ),
-        weewx=Source(name="windGust", transform=lambda x: x * MILES_PER_HOUR_TO_SPEED),
+        weather_link=Source(name="Hi Speed", scale=KNOTS_TO_SPEED),
+        weewx=Source(name="windGust", scale=MILES_PER_HOUR_TO_SPEED),
     ),
     StandardNames.WIND_GUST_FROM_DIRECTION: ObservedProperty(
         name=StandardNames.WIND_GUST_FROM_DIRECTION.value,
         unit=StandardUnits.DIRECTION.value,
-        weather_link=Source(name="Hi Dir", transform=lambda x: x),
-        weewx=Source(name="windGustDir", transform=cardinal_direction_to_degrees),
+        weather_link=Source(name="Hi Dir", lookup=CARDINAL_DEGREES),
+        weewx=Source(name="windGustDir", lookup=CARDINAL_DEGREES),
     ),
     StandardNames.WIND_CHILL_OF_AIR_TEMPERATURE: ObservedProperty(
         name=StandardNames.WIND_CHILL_OF_AIR_TEMPERATURE.value,
         unit=StandardUnits.TEMPERATURE.value,
-        weather_link=Source(name="Wind Chill", transform=fahrenheit_to_kelvin),
-        weewx=Source(name="windchill", transform=fahrenheit_to_kelvin),
+        weather_link=Source(name="Wind Chill", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
+        weewx=Source(name="windchill", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
     ),
     StandardNames.SOLAR_IRRADIANCE: ObservedProperty(
         name=StandardNames.SOLAR_IRRADIANCE.value,
         unit=StandardUnits.ENERGY.value,
-        weather_link=Source(name="Solar Rad.", transform=lambda x: x),
-        weewx=Source(name="radiation", transform=lambda x: x),
+        weather_link=Source(name="Solar Rad."),
+        weewx=Source(name="radiation"),
     ),
     StandardNames.ULTRAVIOLET_INDEX: ObservedProperty(
         name=StandardNames.ULTRAVIOLET_INDEX.value,
         unit="",
-        weather_link=Source(name="UV Index", transform=lambda x: x),
-        weewx=Source(name="UV", transform=lambda x: x),
+        weather_link=Source(name="UV Index"),
+        weewx=Source(name="UV"),
     ),
     StandardNames.RAINFALL_AMOUNT: ObservedProperty(
         name=StandardNames.RAINFALL_AMOUNT.value,
         unit=StandardUnits.AMOUNT.value,
-        weather_link=Source(name="Rain", transform=lambda x: x * INCHES_TO_MILLIMETERS),
-        weewx=Source(name="rain", transform=lambda x: x * INCHES_TO_MILLIMETERS),
+        weather_link=Source(name="Rain", scale=INCHES_TO_MILLIMETERS),
+        weewx=Source(name="rain", scale=INCHES_TO_MILLIMETERS),
     ),
     StandardNames.RAINFALL_RATE: ObservedProperty(
         name=StandardNames.RAINFALL_RATE.value,
         unit=StandardUnits.FLUX.value,
         weather_link=Source(
             name="Rain Rate",
-            transform=lambda x: x
-            * INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
+            scale=INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
         ),
         weewx=Source(
             name="rainRate",
-            transform=lambda x: x
-            * INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
+            scale=INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
         ),
     ),
     StandardNames.HEAT_INDEX_OF_AIR_TEMPERATURE: ObservedProperty(
         name=StandardNames.HEAT_INDEX_OF_AIR_TEMPERATURE.value,
         unit=StandardUnits.TEMPERATURE.value,
-        weather_link=Source(name="Heat Index", transform=fahrenheit_to_kelvin),
-        weewx=Source(name="heatindex", transform=fahrenheit_to_kelvin),
+        weather_link=Source(name="Heat Index", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
+        weewx=Source(name="heatindex", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
     ),
     StandardNames.DEW_POINT_TEMPERATURE: ObservedProperty(
         name=StandardNames.DEW_POINT_TEMPERATURE.value,
         unit=StandardUnits.TEMPERATURE.value,
-        weather_link=Source(name="Dew Pt.", transform=fahrenheit_to_kelvin),
-        weewx=Source(name="dewpoint", transform=fahrenheit_to_kelvin),
+        weather_link=Source(name="Dew Pt.", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
+        weewx=Source(name="dewpoint", scale=FAHRENHEIT_SCALE, offset=FAHRENHEIT_OFFSET),
     ),
     StandardNames.WATER_EVAPOTRANSPIRATION_FLUX: ObservedProperty(
         name=StandardNames.WATER_EVAPOTRANSPIRATION_FLUX.value,
         unit=StandardUnits.FLUX.value,
         weewx=Source(
             name="ET",
-            transform=lambda x: x
-            * INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
+            scale=INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
         ),
         weather_link=Source(
             name="ET",
-            transform=lambda x: x
-            * INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
+            scale=INCHES_PER_HOUR_TO_KILOGRAMS_PER_SQUARE_METER_PER_SECOND,
         ),
     ),
+    # Station pressure, before reduction to sea level, which WeatherLink
+    # exports don't have. Reduced with the station altitude by `derive`.
+    StandardNames.SURFACE_AIR_PRESSURE: ObservedProperty(
+        name=StandardNames.SURFACE_AIR_PRESSURE.value,
+        unit=StandardUnits.PRESSURE.value,
+        weewx=Source(name="pressure", scale=INCHES_OF_MERCURY_TO_PRESSURE),
+    ),
 }
 
 
-class StationName(Enum):
+class Station:
+    """
+    A weather station in the registry, with the location that tags its
+    records in InfluxDB, and its coordinates if they are known. Records
+    without a location tag, written before stations were tagged, belong to
+    the `untagged` station.
+    """
+
+    name: str
+    location: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    untagged: bool
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        name: str,
+        location: Optional[str] = None,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        untagged: bool = False,
+    ):
+        self.name = name
+        self.location = location
+        self.latitude = latitude
+        self.longitude = longitude
+        self.untagged = untagged
+
+
+def load_stations(path: Path = STATIONS_REGISTRY) -> tuple[str, dict[str, Station]]:
     """
-    Valid station names. For now just includes weather
-    stations, but these could be used to refer to all
-    sensing platforms and systems at a single location.
+    Read the station registry, and the name of the tag that identifies
+    the records of each station location in InfluxDB.
     """
+    with open(path, "r", encoding="utf-8") as fid:
+        config = safe_load(fid)
+    stations = {
+        name: Station(name, **(options or {})) for name, options in config["stations"].items()
+    }
+    if sum(each.untagged for each in stations.values()) > 1:
+        raise ValueError(f"Only one station in {path} can own the untagged records")
+    return config["tag"], stations
 
-    APPRENTICESHOP = "apprenticeshop"
-    DEV = "dev"
+
+STATION_TAG, STATIONS = load_stations()
+# Valid station names, from the registry. Used to ensure consistent
+# station naming across CLI.
+StationName = Enum("StationName", {name.upper(): name for name in STATIONS})
 
 
 @click.group(name="weather")
@@ -288,10 +404,18 @@ def file():
     """
 
 
+@click.group(name="qc")
+def qc():
+    """
+    Commands that run QARTOD tests over weather station data.
+    """
+
+
 # Subcommands assignment
 weather.add_command(plot)
 weather.add_command(database)
 weather.add_command(file)
+weather.add_command(qc)
 
 
 def source_options(function):
@@ -308,6 +432,128 @@ def source_options(function):
     return function
 
 
+cache_option = click.option(
+    "--cache/--no-cache",
+    default=False,
+    envvar="PENBAY_INFLUX_CACHE",
+    help=(
+        "Keep all InfluxDB archive records on disk, and only query the last "
+        "two days of them again. Records that arrive later than that are "
+        "missed. Defaults to querying the window of each command."
+    ),
+)
+
+
+# Conversions of each source to standard names and units, compiled once
+WEATHER_LINK_CONVERSIONS = UnitConversions(
+    {
+        value.weather_link.name: (key.value, value.weather_link)
+        for key, value in CF_STANDARDS.items()
+        if value.weather_link is not None
+    }
+)
+WEEWX_CONVERSIONS = UnitConversions(
+    {value.weewx.name: (key.value, value.weewx) for key, value in CF_STANDARDS.items()}
+)
+# Format of normalized exports kept on disk, changed when normalization does
+ARCHIVE_FORMAT = 2
+# Normalized exports, checked against modification time and size before
+# reuse, like parsed buoy files. Frames are also kept on disk, so that
+# separate commands don't parse an unchanged export again.
+parsed_archives: dict[Path, tuple[tuple[int, int], DataFrame]] = {}
+
+
+def parse_clock_times(dates: Series, times: Series) -> DatetimeIndex:
+    """
+    Combine WeatherLink dates like "05/09/25" with 12 hour times like
+    "7:00 p". Each distinct date and time is parsed once, and rows are
+    assembled by adding integer offsets, instead of parsing a joined
+    string for every row.
+    """
+    date_codes, date_values = factorize(dates)
+    time_codes, time_values = factorize(times)
+    days = to_datetime(Series(date_values), format="%m/%d/%y").to_numpy()
+    minutes = []
+    for each in time_values:
+        clock, meridiem = each.split()
+        hour, minute = clock.split(":")
+        minutes.append((int(hour) % 12 + (12 if meridiem.lower() == "p" else 0)) * 60 + int(minute))
+    offsets = array(minutes, dtype="timedelta64[m]")
+    return DatetimeIndex(days[date_codes] + offsets[time_codes], name=TIME)
+
+
+sqlite_option = click.option(
+    "--sqlite",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    envvar="WEEWX_SQLITE",
+    help=(
+        "Read WeeWX records from this archive database, like weewx.sdb, "
+        "instead of InfluxDB."
+    ),
+)
+
+altitude_option = click.option(
+    "--altitude",
+    type=float,
+    default=None,
+    envvar="TEMPLATE_STATION_ALTITUDE",
+    help=(
+        "Altitude of the station in feet, like the WeeWX configuration, for "
+        "reducing station pressure to sea level. Defaults to environment "
+        "variable TEMPLATE_STATION_ALTITUDE."
+    ),
+)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def read_weather_link(
+    filename: Path,
+    chunksize: Optional[int] = None,
+    skiprows: int = 2,
+    delimiter: str = "\t",
+    na_value: str = "---",
+    date: str = "Date",
+    time: str = "Time",
+) -> Iterator[DataFrame]:
+    """
+    Parse and normalize a WeatherLink export, like `WeatherLinkArchive`
+    but without caching. With `chunksize`, rows are parsed and yielded in
+    chunks, so that exports larger than memory can be streamed. Otherwise
+    the whole file is a single frame.
+    """
+    rows: list[list[str]] = []
+    with open(filename, "r", encoding="utf-8") as fid:
+        for _ in range(skiprows):
+            rows.append(fid.readline().split(delimiter))
+    names = []
+    for items in zip(*rows):
+        header = ""
+        for each in items:
+            header += str(each).strip() + " "
+        header = header.strip()
+        names.append(header)
+    options = {
+        "delimiter": delimiter,
+        "skiprows": skiprows,
+        "names": names,
+        "na_values": [na_value],
+        "usecols": [date, time, *(each for each in names if each in WEATHER_LINK_CONVERSIONS.sources)],
+    }
+
+    def normalize(df: DataFrame) -> DataFrame:
+        index = parse_clock_times(df[date], df[time])
+        metrics.inc("penbay_rows_parsed_total", len(df), source="weather_link")
+        return WEATHER_LINK_CONVERSIONS.apply(df, index)
+
+    if chunksize is None:
+        yield normalize(read_csv(filename, **options))
+        return
+    with read_csv(filename, chunksize=chunksize, **options) as reader:
+        for df in reader:
+            yield normalize(df)
+
+
 # pylint: disable=too-few-public-methods
 class WeatherLinkArchive:
     """
@@ -315,6 +561,7 @@ class WeatherLinkArchive:
     """
 
     # pylint: disable=too-many-arguments, too-many-locals, too-many-positional-arguments
+    @timing_span("WeatherLinkArchive")
     def __init__(
         self,
         # Source name
@@ -338,40 +585,188 @@ class WeatherLinkArchive:
 
         Normalize headers from a multiple header line file. Rename them if they
         have a known mapping, but otherwise leave them as is.
+
+        Normalized frames are cached in memory and in `CACHE_DIR`, and
+        only parsed again when the file changes.
         """
         self.name = name
         filename = DATA_DIR / f"{name}.txt"
-        rows: list[list[str]] = []
-        with open(filename, "r", encoding="utf-8") as fid:
-            for _ in range(skiprows):
-                rows.append(fid.readline().split(delimiter))
-        names = []
-        lookup = {}
-        transforms = {}
-        for key, value in CF_STANDARDS.items():
-            lookup[value.weather_link.name] = key.value
-            transforms[key.value] = value.weather_link.transform
-
-        for items in zip(*rows):
-            header = ""
-            for each in items:
-                header += str(each).strip() + " "
-            header = header.strip()
-            names.append(lookup.get(header, header))
-        df = read_csv(
-            filename,
-            delimiter=delimiter,
-            skiprows=skiprows,
-            names=names,
-            na_values=[na_value],
+        stat = filename.stat()
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        options = f"{ARCHIVE_FORMAT}{skiprows}{delimiter}{na_value}{date}{time}".encode("utf-8").hex()
+        stored = CACHE_DIR / "weather_link" / name / f"{stat.st_mtime_ns}-{stat.st_size}-{options}.parquet"
+        cached = parsed_archives.get(filename)
+        if cached is not None and cached[0] == fingerprint:
+            metrics.inc("penbay_cache_hits_total", cache="weather_link_files")
+        elif stored.exists():
+            metrics.inc("penbay_cache_hits_total", cache="weather_link_files")
+            cached = (fingerprint, read_parquet(stored))
+            parsed_archives[filename] = cached
+        else:
+            metrics.inc("penbay_bytes_read_total", stat.st_size, source="weather_link")
+            df = next(read_weather_link(filename, None, skiprows, delimiter, na_value, date, time))
+            cached = (fingerprint, df)
+            parsed_archives[filename] = cached
+            for each in stored.parent.glob("*.parquet"):
+                each.unlink()
+            stored.parent.mkdir(parents=True, exist_ok=True)
+            temporary = stored.with_suffix(".tmp")
+            df.to_parquet(temporary)
+            temporary.replace(stored)
+        # Shallow copy, so that adding columns doesn't modify the cached frame
+        self.df = cached[1].copy(deep=False)
+
+
+# Series that are cardinal directions in WeeWX, and can't be averaged
+DIRECTIONAL = {StandardNames.WIND_FROM_DIRECTION, StandardNames.WIND_GUST_FROM_DIRECTION}
+
+
+def bin_seconds(every: str, series: Optional[list[StandardNames]]) -> int:
+    """
+    Width in seconds of the bins that a database averages series into.
+    Only fixed frequencies, like "1h", have a width.
+    """
+    if series is None or DIRECTIONAL & set(series):
+        raise ValueError("Only named, non-directional series can be aggregated")
+    if not is_fixed_frequency(every):
+        raise ValueError(f"Only fixed frequencies can be binned by the database, not {every}")
+    return int(to_offset(every).nanos // 1_000_000_000)
+
+
+def split_bins(
+    every: Optional[str], series: Optional[list[StandardNames]]
+) -> tuple[Optional[str], Optional[str]]:
+    """
+    Frequencies to bin by in the database, and to resample by afterward.
+    Calendar frequencies, like "W" or "ME", are resampled from raw rows.
+    """
+    if every is None or is_fixed_frequency(every):
+        return every, None
+    if series is None or DIRECTIONAL & set(series):
+        raise ValueError("Only named, non-directional series can be aggregated")
+    return None, every
+
+
+def bin_means(df: DataFrame, every: str) -> DataFrame:
+    """
+    Average the series of each station into time bins, like the database
+    does for fixed frequencies.
+    """
+    if STATION not in df.columns:
+        return resample_frame(df, every, aggregators={})
+    frames = [
+        resample_frame(group.drop(columns=STATION), every, aggregators={}).assign(**{STATION: name})
+        for name, group in df.groupby(STATION)
+    ]
+    return concat(frames).sort_index(kind="stable") if frames else df
+
+
+def weewx_query(
+    measurement: str,
+    time: str = TIME,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    series: Optional[Iterable[StandardNames]] = None,
+    every: Optional[str] = None,
+    locations: Optional[Iterable[Optional[str]]] = None,
+) -> str:
+    """
+    SQL for WeeWX archive records, restricted to a time window and the
+    WeeWX columns of some standard names, so that filtering happens in the
+    database. With `every`, a pandas frequency like "1h", rows are averaged
+    into time bins by the database too. With `locations`, records of all
+    of those stations are read at once, and keep the tag that identifies
+    their station. A location of None reads records without the tag.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    selected = list(series) if series is not None else None
+    tags = [f'"{STATION_TAG}"'] if locations is not None else []
+    if selected is None:
+        columns = ["*"]
+    else:
+        quoted = [f'"{CF_STANDARDS[each].weewx.name}"' for each in selected]
+        columns = [time, *tags, *quoted]
+    if every is not None:
+        seconds = bin_seconds(every, selected)
+        columns = [
+            f"date_bin(INTERVAL '{seconds} seconds', {time}) AS {time}",
+            *tags,
+            *(f"avg({column}) AS {column}" for column in quoted),
+        ]
+    conditions = ["binding IN ('archive')"]
+    if locations is not None:
+        locations = list(locations)
+        quoted_locations = ", ".join(
+            "'" + each.replace("'", "''") + "'" for each in locations if each is not None
         )
-        # create a string that can be parsed as a datetime by pandas
-        time_string = df[date] + " " + df[time].str.upper() + "M"
-        series = Series(time_string, name=TIME)
-        timestamps = to_datetime(series, format="%m/%d/%y %I:%M %p")
-        df.set_index(timestamps, inplace=True)
-        df.drop(columns=[date, time], inplace=True)
-        self.df = df.transform(transforms)
+        matches = [f"{tags[0]} IN ({quoted_locations})"] if quoted_locations else []
+        if None in locations:
+            matches.append(f"{tags[0]} IS NULL")
+        conditions.append(f"({' OR '.join(matches)})" if len(matches) > 1 else matches[0])
+    if start is not None:
+        conditions.append(f"{time} > '{start:%Y-%m-%dT%H:%M:%S}'")
+    if end is not None:
+        conditions.append(f"{time} <= '{end:%Y-%m-%dT%H:%M:%S}'")
+    query = f"SELECT {', '.join(columns)} FROM {measurement} WHERE {' AND '.join(conditions)}"
+    if every is not None:
+        query += " GROUP BY " + ", ".join(str(each) for each in range(1, len(tags) + 2))
+    return query + f" ORDER BY {time}"
+
+
+def select_window(
+    table: "Table",
+    time: str = TIME,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    series: Optional[Iterable[StandardNames]] = None,
+    every: Optional[str] = None,
+    locations: Optional[Iterable[Optional[str]]] = None,
+) -> "Table":
+    """
+    Apply the same window, columns, station locations, and binning as
+    `weewx_query` to archive records that were already fetched. Bins
+    start at the epoch, like `date_bin` in the database. Records fetched
+    before any had the location tag don't have its column.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,import-outside-toplevel
+    import pyarrow.compute as pc
+    from pyarrow import array as arrow_array, nulls, scalar, string
+
+    tags = [STATION_TAG] if locations is not None else []
+    if locations is not None:
+        if STATION_TAG not in table.column_names:
+            table = table.append_column(STATION_TAG, nulls(table.num_rows, string()))
+        value_set = arrow_array(list(locations), type=string())
+        table = table.filter(pc.is_in(table[STATION_TAG], value_set=value_set, skip_nulls=False))
+    time_type = table.schema.field(time).type
+    if start is not None:
+        table = table.filter(pc.greater(table[time], scalar(start).cast(time_type)))
+    if end is not None:
+        table = table.filter(pc.less_equal(table[time], scalar(end).cast(time_type)))
+    if series is None:
+        return table
+    selected = list(series)
+    columns = [CF_STANDARDS[each].weewx.name for each in selected]
+    table = table.select([time, *tags, *columns])
+    if every is None:
+        return table
+    seconds = bin_seconds(every, selected)
+    bins = pc.floor_temporal(table[time], multiple=seconds, unit="second")
+    binned = (
+        table.set_column(0, time, bins)
+        .group_by([time, *tags])
+        .aggregate([(column, "mean") for column in columns])
+    )
+    binned = (
+        binned.rename_columns([name.removesuffix("_mean") for name in binned.column_names])
+        .select([time, *tags, *columns])
+        .sort_by(time)
+    )
+    missing = [pc.is_null(binned[column]) for column in columns]
+    empty = missing[0]
+    for each in missing[1:]:
+        empty = pc.and_(empty, each)
+    return binned.filter(pc.invert(empty))
 
 
 class WeeWxInfluxArchive:
@@ -379,7 +774,8 @@ class WeeWxInfluxArchive:
     WeeWx archive data from InfluxDB.
     """
 
-    # pylint: disable=redefined-outer-name
+    # pylint: disable=redefined-outer-name,too-many-arguments,too-many-positional-arguments
+    @timing_span("WeeWxInfluxArchive")
     def __init__(
         self,
         measurement: str,
@@ -387,40 +783,392 @@ class WeeWxInfluxArchive:
         host: str,
         time: str = TIME,
         database: str = "weather",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        series: Optional[Iterable[StandardNames]] = None,
+        every: Optional[str] = None,
+        cache: bool = False,
+        stations: Optional[Iterable[Station]] = None,
     ):
         """
-        Get data from InfluxDB and format as a DataFrame.
+        Get data from InfluxDB and format as a DataFrame. Only rows in the
+        time window and the columns of the given series are queried, and
+        averaged into bins if `every` is given. The database only bins by
+        fixed frequencies, so calendar ones, like "W" or "ME", are averaged
+        locally from the rows in the window.
+
+        With `stations`, records of all of them are read with one query,
+        filtered by their location tag, and a `station` column names the
+        station of each row.
+
+        With `cache`, all archive records are kept on disk instead, and
+        only records newer than the cached ones, less `CACHE_OVERLAP`, are
+        queried. The window, columns, and bins are then applied locally.
+
+        Results stay in Arrow until the selected columns are converted to
+        standard units, so large reads aren't copied by pandas on the way.
         """
+        # The Influx client is slow to import, and unused by file commands
+        # pylint: disable=import-outside-toplevel
+        from influxdb_client_3 import InfluxDBClient3
+
+        series = list(series) if series is not None else None
+        every, calendar = split_bins(every, series)
+        stations = list(stations) if stations is not None else None
+        names = {each.location: each.name for each in stations} if stations is not None else None
+        untagged = next((each.name for each in stations or [] if each.untagged), None)
+        locations = [*names, *([None] if untagged else [])] if names is not None else None
         client = InfluxDBClient3(host=host, database=database, token=token)
-        df: DataFrame = client.query(
-            f"SELECT * FROM {measurement} WHERE binding IN ('archive') ORDER BY {time}",
-            mode="pandas",
+
+        def fetch(query: str) -> "Table":
+            started = perf_counter()
+            with timing_span("influx_query"):
+                result: "Table" = client.query(query, mode="all")
+            metrics.observe("penbay_influx_query_seconds", perf_counter() - started)
+            metrics.observe("penbay_influx_query_rows", result.num_rows)
+            return result
+
+        if cache:
+            records = QueryCache(CACHE_DIR, host, database, measurement, "archive").refresh(
+                lambda after: fetch(weewx_query(measurement, time, start=after)), time, CACHE_OVERLAP
+            )
+            table = select_window(records, time, start, end, series, every, locations)
+        else:
+            table = fetch(weewx_query(measurement, time, start, end, series, every, locations))
+        # Keep the Arrow table until columns are converted to standard units
+        with timing_span("frame_from_arrow"):
+            self.df = frame_from_arrow(table, time, WEEWX_CONVERSIONS)
+        if names is not None:
+            owners = table[STATION_TAG].to_pandas().map(names)
+            self.df[STATION] = (owners.fillna(untagged) if untagged else owners).to_numpy()
+        if calendar is not None:
+            self.df = bin_means(self.df, calendar)
+
+
+class WeeWxSqliteArchive:
+    """
+    WeeWx archive data from the SQLite database on a device.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        path: Path,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        series: Optional[Iterable[StandardNames]] = None,
+        every: Optional[str] = None,
+        chunksize: int = 100_000,
+    ):
+        """
+        Read the wide `archive` table in chunks, converting each one to
+        standard names and units before the next is read. Only rows in the
+        time window, and the columns of the given series, are read, and
+        averaged into bins if `every` is given, like `WeeWxInfluxArchive`.
+
+        Nothing is read until `chunks` or `df` are used, so that archives
+        with years of records can be streamed a chunk at a time, and are
+        only held in memory whole by `df`.
+
+        The database is opened read-only, so that it is never written, and
+        can be read from a copy or from the volume of a running `weewxd`.
+        """
+        self.path = path
+        series = list(series) if series is not None else None
+        every, self.calendar = split_bins(every, series)
+        self.query, self.parameters = self.select(start, end, series, every)
+        self.chunksize = chunksize
+
+    @cached_property
+    @timing_span("WeeWxSqliteArchive")
+    def df(self) -> DataFrame:
+        """
+        Every record in one frame, in calendar bins if those were asked for.
+        """
+        chunks = list(self.chunks())
+        df = concat(chunks) if chunks else WEEWX_CONVERSIONS.apply({}, DatetimeIndex([], name=TIME))
+        return bin_means(df, self.calendar) if self.calendar is not None else df
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the database read-only. It isn't opened as immutable, which
+        skips locking, because `weewxd` may be writing to it.
+        """
+        uri = f"{self.path.resolve().as_uri()}?mode=ro"
+        return sqlite3.connect(uri, uri=True)
+
+    def select(
+        self,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        series: Optional[Iterable[StandardNames]],
+        every: Optional[str],
+    ) -> tuple[str, list]:
+        """
+        SQL and parameters for archive records, using the primary key on
+        `dateTime`, in Unix seconds, for the time window. Series that the
+        archive doesn't have are left out.
+        """
+        with closing(self.connect()) as connection:
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(archive)")}
+        selected = list(series) if series is not None else list(StandardNames)
+        names = [
+            CF_STANDARDS[each].weewx.name
+            for each in selected
+            if CF_STANDARDS[each].weewx.name in existing
+        ]
+        time, units = "dateTime", "usUnits"
+        columns = [f'"{name}"' for name in names]
+        if every is not None:
+            seconds = bin_seconds(every, selected)
+            time, units = f"(dateTime / {seconds}) * {seconds}", "max(usUnits) AS usUnits"
+            columns = [f"avg({column}) AS {column}" for column in columns]
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("dateTime > ?")
+            parameters.append(int(Timestamp(start).timestamp()))
+        if end is not None:
+            conditions.append("dateTime <= ?")
+            parameters.append(int(Timestamp(end).timestamp()))
+        query = f"SELECT {time} AS dateTime, {', '.join([units, *columns])} FROM archive"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        if every is not None:
+            query += " GROUP BY 1"
+        return query + " ORDER BY 1", parameters
+
+    def chunks(self) -> Iterator[DataFrame]:
+        """
+        Stream converted frames of at most `chunksize` records, in time
+        order. Calendar bins span chunks, so they are only applied by `df`.
+        """
+        with closing(self.connect()) as connection:
+            for chunk in read_sql_query(
+                self.query, connection, params=self.parameters, chunksize=self.chunksize
+            ):
+                if (chunk["usUnits"] != US_UNITS).any():
+                    raise click.ClickException(
+                        f"{self.path} has records that aren't in US units, which can't be converted"
+                    )
+                index = DatetimeIndex(to_datetime(chunk["dateTime"], unit="s"), name=TIME)
+                metrics.inc("penbay_rows_parsed_total", len(chunk), source="weewx_sqlite")
+                yield WEEWX_CONVERSIONS.apply(chunk, index)
+
+
+def weewx_archive(
+    measurement: str,
+    token: str,
+    host: str,
+    sqlite: Optional[Path] = None,
+    cache: bool = False,
+    station: Optional["StationName"] = None,
+    **kwargs,
+) -> DataFrame:
+    """
+    WeeWX archive records in standard names and units, from a local SQLite
+    database if one is given, and otherwise from InfluxDB. Keyword
+    arguments are the time window, series, and bins of both sources.
+
+    With `station`, only records with its location tag are read from
+    InfluxDB, which stores every station in one measurement, and records
+    without the tag if the station owns them. A SQLite archive belongs to
+    a single device, and is read whole.
+    """
+    if sqlite is not None:
+        return WeeWxSqliteArchive(sqlite, **kwargs).df
+    if station is None:
+        return WeeWxInfluxArchive(measurement, token, host, cache=cache, **kwargs).df
+    registered = STATIONS[station.value]
+    if registered.location is None:
+        raise click.ClickException(f"{station.value} has no location tag in InfluxDB")
+    df = WeeWxInfluxArchive(measurement, token, host, cache=cache, stations=[registered], **kwargs).df
+    return df.drop(columns=STATION)
+
+
+def station_records(
+    stations: Iterable[Station],
+    source: Middleware,
+    series: list[StandardNames],
+    measurement: str,
+    token: str,
+    host: str,
+    cache: bool = False,
+    start: Optional[datetime] = None,
+) -> DataFrame:
+    """
+    Records of many stations in one long frame, with a `station` column.
+    WeeWX records of every station with a location are read with a single
+    tag filtered query, with untagged records as those of the station that
+    owns them, and WeatherLink exports of stations that have one are
+    stacked.
+    """
+    stations = list(stations)
+    if source == Middleware.WEEWX:
+        located = [each for each in stations if each.location is not None]
+        if not located:
+            raise click.ClickException("None of the stations have a location tag in InfluxDB")
+        return WeeWxInfluxArchive(
+            measurement, token, host, start=start, series=series, cache=cache, stations=located
+        ).df
+    frames = []
+    for each in stations:
+        if not (DATA_DIR / f"{each.name}.txt").exists():
+            continue
+        df = WeatherLinkArchive(each.name).df
+        df = df[[name.value for name in series if name.value in df.columns]]
+        if start is not None:
+            df = df[df.index > start]
+        frames.append(df.assign(**{STATION: each.name}))
+    if not frames:
+        raise click.ClickException("None of the stations have a WeatherLink export")
+    return concat(frames)
+
+
+def align_stations(
+    df: DataFrame, every: str, tolerance: Optional[Timedelta] = None
+) -> DataFrame:
+    """
+    Align the records of many stations, in a long frame with a `station`
+    column, on a common time grid. Each grid time takes the nearest record
+    of every station within the tolerance, which is half of the grid
+    spacing by default, with one `merge_asof` grouped by station instead
+    of a join per station. Columns are the station and then the series.
+    """
+    tolerance = tolerance if tolerance is not None else Timedelta(every) / 2
+    records = df.rename_axis(TIME).reset_index().sort_values(TIME, kind="stable")
+    names = sorted(records[STATION].dropna().unique())
+    times = records[TIME]
+    if records.empty:
+        grid = DatetimeIndex([], name=TIME)
+    else:
+        grid = date_range(times.iloc[0].floor(every), times.iloc[-1].ceil(every), freq=every, name=TIME)
+    grid = grid.as_unit(times.dt.unit)
+    left = DataFrame({TIME: grid.repeat(len(names)), STATION: tile(array(names, dtype=object), len(grid))})
+    aligned = merge_asof(
+        left, records, on=TIME, by=STATION, direction="nearest", tolerance=tolerance
+    )
+    wide = aligned.pivot(index=TIME, columns=STATION)
+    return wide.swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+
+def stations_options(function):
+    """
+    Choose a series and the stations to compare it across. Re-usable
+    decorator for commands that align many stations.
+    """
+    function = click.option(
+        "--days",
+        default=30,
+        type=click.IntRange(min=1),
+        help="The time range to compare.",
+    )(function)
+    function = click.option(
+        "--every",
+        default="1h",
+        help="Spacing of the common time grid that stations are aligned on.",
+    )(function)
+    function = click.option(
+        "--source",
+        default=Middleware.WEEWX,
+        type=click.Choice(Middleware, case_sensitive=False),
+        help="Compare WeeWX archive records, or WeatherLink exports.",
+    )(function)
+    function = click.option(
+        "--station",
+        "stations",
+        multiple=True,
+        type=click.Choice(StationName, case_sensitive=False),
+        help="A station to compare. Defaults to every station in the registry.",
+    )(function)
+    function = click.argument(
+        "series", type=click.Choice(StandardNames, case_sensitive=False)
+    )(function)
+    return function
+
+
+def aligned_series(
+    series: StandardNames,
+    stations: tuple[StationName, ...],
+    source: Middleware,
+    every: str,
+    days: int,
+    host: str,
+    measurement: str,
+    token: str,
+    cache: bool,
+) -> DataFrame:
+    """
+    A series of many stations on a common time grid, with a column for each station.
+    """
+    selected = [STATIONS[each.value] for each in stations] or list(STATIONS.values())
+    start = utc_now() - timedelta(days=days)
+    df = station_records(selected, source, [series], measurement, token, host, cache, start)
+    if series.value not in df.columns:
+        raise click.ClickException(f"No {series.value} records for the stations")
+    return align_stations(df[[series.value, STATION]], every).xs(series.value, axis=1, level=1)
+
+
+@weather.command(name=ClickCommands.COMPARE.value)
+@stations_options
+@influx_options
+@cache_option
+def weather_compare(**kwargs):
+    """
+    Compare a series across stations, aligned on a common time grid.
+    Shows the samples of each station, and how they differ from the first.
+    """
+    aligned = aligned_series(**kwargs)
+    print("\nSamples:\n")
+    print(summarize_archive(aligned))
+    if aligned.shape[1] > 1:
+        first = aligned.columns[0]
+        difference = aligned.drop(columns=first).sub(aligned[first], axis=0)
+        print(f"\nDifference from {first}:\n")
+        print(
+            DataFrame({
+                "count": difference.count(),
+                "mean": difference.mean(),
+                "mean absolute": difference.abs().mean(),
+                "std": difference.std(),
+            })
         )
-        # Invert the dictionary, keeping the second value as key
-        columns = {}
-        transforms = {}
-        for key, value in CF_STANDARDS.items():
-            columns[value.weewx.name] = key.value
-            transforms[key.value] = value.weewx.transform
-        df.rename(columns=columns, inplace=True)
-        df.set_index(time, inplace=True)
-        self.df = df.transform(transforms)
+
+
+@plot.command(name=ClickCommands.STATIONS.value)
+@stations_options
+@influx_options
+@plot_options
+@cache_option
+def weather_plot_stations(image_format: ImageFormat, **kwargs):
+    """
+    Plot a series of many stations together, aligned on a common time grid.
+    """
+    aligned = aligned_series(**kwargs)
+    series: StandardNames = kwargs["series"]
+    prefix = f"{FIGURES_DIR}/{ClickCommands.STATIONS.value}"
+    plot_stations(aligned, series.value, prefix, CF_STANDARDS[series].unit, image_format)
 
 
 @weather.command(name=ClickCommands.DESCRIBE.value)
 @source_options
 @influx_options
+@cache_option
+@sqlite_option
 def weather_describe_series(
-    station: StandardNames,
+    station: StationName,
     series: StandardNames,
     host: str,
     measurement: str,
     token: str,
+    cache: bool,
+    sqlite: Optional[Path],
 ):
     """
     Compare local and database data before merging or backfilling.
     """
-    remote: Series = WeeWxInfluxArchive(measurement, token, host).df[series.value]
+    remote: Series = weewx_archive(
+        measurement, token, host, sqlite, cache, station, series=[series]
+    )[series.value]
     remote.name = "influx"
     local: Series = WeatherLinkArchive(station.value).df[series.value]
     local.name = "local"
@@ -445,23 +1193,61 @@ def weather_describe_series(
 @click.option(
     "--qartod",
     default=None,
-    help="Path to the QARTOD configuration file.",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Overlay suspect and failed values flagged by this QARTOD configuration file.",
 )
+@cache_option
+@sqlite_option
 def weather_plot_tail(
     station: StationName,
     series: StandardNames,
     host: str,
     measurement: str,
     token: str,
+    cache: bool,
+    sqlite: Optional[Path],
     **kwargs,
 ):
     """
     Plot a comparison of local and InfluxDB data for a specific series.
 
-    Keyword arguments are passed through to the rendering function
+    Keyword arguments are passed through to the rendering function. Only
+    the plotted window and series are queried, and averaged by the
+    database when resampling with the mean. Other series are resampled
+    with their own aggregator, and directions with their speeds.
     """
-    remote: Series = WeeWxInfluxArchive(measurement, token, host).df[series.value]
-    local: Series = WeatherLinkArchive(station.value).df[series.value]
+    resample = kwargs.get("resample")
+    # Only means can be binned by the database, and directions need speeds
+    aggregator = RESAMPLE_AGGREGATORS.get(series.value, Aggregator.MEAN)
+    speed = VECTOR_WEIGHTS.get(series.value)
+    selected = [series] if speed is None else [series, StandardNames(speed)]
+    remote_frame = weewx_archive(
+        measurement,
+        token,
+        host,
+        sqlite,
+        cache,
+        station,
+        start=utc_now() - timedelta(days=kwargs["days"]),
+        series=selected,
+        every=resample if resample and aggregator is Aggregator.MEAN else None,
+    )
+    local_frame = WeatherLinkArchive(station.value).df.sort_index()
+    # Plotted on the same clock as WeeWX records, and the UTC window
+    local_frame.index = local_to_utc(local_frame.index, WEATHER_LINK_TIME_ZONE)
+    # Archives without the series are plotted with local data only
+    remote: Optional[Series] = remote_frame.get(series.value)
+    local: Series = local_frame[series.value]
+    if speed is not None:
+        kwargs["weights"] = local_frame.get(speed)
+        kwargs["remote_weights"] = remote_frame.get(speed)
+    qartod: Optional[Path] = kwargs.pop("qartod")
+    if qartod is not None:
+        config = load_qartod_config(qartod)
+        column = flag_column(series.value, QartodTest.ROLLUP)
+        kwargs["flags"] = config.run(local.to_frame()).get(column)
+        if remote is not None:
+            kwargs["remote_flags"] = config.run(remote.to_frame()).get(column)
     prefix = f"{FIGURES_DIR}/{ClickCommands.TAIL.value}"
     unit = CF_STANDARDS.get(series).unit
     plot_tail(local, remote, station.value, series.value, prefix, units=unit, **kwargs)
@@ -471,6 +1257,8 @@ def weather_plot_tail(
 @source_options
 @influx_options
 @plot_options
+@cache_option
+@sqlite_option
 # pylint: disable=too-many-locals,redefined-builtin
 def weather_plot_daily(
     station: StationName,
@@ -478,12 +1266,16 @@ def weather_plot_daily(
     host: str,
     measurement: str,
     token: str,
+    cache: bool,
+    sqlite: Optional[Path],
     **kwargs,
 ):
     """
     Display a single `DataStream` aggregated by day.
     """
-    remote = WeeWxInfluxArchive(measurement, token, host).df[series.value]
+    remote = weewx_archive(
+        measurement, token, host, sqlite, cache, station, series=[series]
+    )[series.value]
     local = WeatherLinkArchive(station.value).df[series.value]
     df = concat([local, remote], axis=0)
     mask = ~df.index.duplicated(keep="first")
@@ -493,68 +1285,766 @@ def weather_plot_daily(
     boxplot(unique, station.value, series.value, prefix, units, **kwargs)
 
 
+def summarize_archive(df: DataFrame) -> DataFrame:
+    """
+    Sample counts and ranges of every column in a normalized archive.
+    """
+    return df.describe().T.drop(columns=["25%", "50%", "75%", "std", "mean"])
+
+
 @file.command(name=ClickCommands.DESCRIBE.value)
 @click.argument("station", type=click.Choice(StationName, case_sensitive=False))
-def weather_file_describe(station: StationName):
+@serve_url_option
+def weather_file_describe(station: StationName, serve_url: Optional[str]):
     """
     Parse and normalize weather station data for display
     """
-    df = WeatherLinkArchive(station.value).df
-    summary = df.describe().T.drop(columns=["25%", "50%", "75%", "std", "mean"])
+    forwarded = forward_to_server(serve_url, f"/weather/{station.value}/describe")
+    if forwarded is not None:
+        summary = frame_from_payload(forwarded)
+    else:
+        summary = summarize_archive(WeatherLinkArchive(station.value).df)
     print("\nSamples:\n")
     print(summary)
 
 
+def cf_attributes() -> dict[str, dict[str, str]]:
+    """
+    CF standard name, canonical units, and long name of each normalized
+    column, for the metadata of typed exports.
+    """
+    return {
+        key.value: {
+            "standard_name": key.value,
+            "long_name": key.value.replace("_", " "),
+            "units": CF_UNITS[StandardUnits(value.unit)] if value.unit else "1",
+        }
+        for key, value in CF_STANDARDS.items()
+    }
+
+
 @file.command(name=ClickCommands.EXPORT.value)
 @click.argument("station", type=click.Choice(StationName, case_sensitive=False))
-def weather_file_export(station: StationName):
+@click.option(
+    "--format",
+    "file_format",
+    default=ExportFormat.CSV,
+    type=click.Choice(ExportFormat, case_sensitive=False),
+    help="File format. Parquet and NetCDF are typed, compressed, and carry CF names and units.",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="File to write. Defaults to the station name next to the source file.",
+)
+@click.option(
+    "--chunksize",
+    default=100_000,
+    type=click.IntRange(min=1),
+    help="Number of rows to parse at a time.",
+)
+@click.option(
+    "--every",
+    default="M",
+    help="Calendar period of each Parquet row group or NetCDF write, like M for months or Y for years.",
+)
+def weather_file_export(
+    station: StationName, file_format: ExportFormat, output: Optional[Path], chunksize: int, every: str
+):
     """
-    Export normalized weather station data to CSV.
+    Export normalized weather station data to CSV, Parquet, or NetCDF.
+    The source file is parsed and written in chunks, so that it never
+    needs to fit in memory.
     """
-    df = WeatherLinkArchive(station.value).df
-    filename = DATA_DIR / f"{station.value}.csv"
-    df.to_csv(filename)
+    output = output or DATA_DIR / f"{station.value}.{file_format.value}"
+    registered = STATIONS[station.value]
+    metadata = {
+        "title": f"{station.value} weather station",
+        "source": "Davis WeatherLink export",
+        "station": station.value,
+        "latitude": registered.latitude,
+        "longitude": registered.longitude,
+    }
+    chunks = read_weather_link(DATA_DIR / f"{station.value}.txt", chunksize)
+    rows = export_frames(
+        output, chunks, file_format, cf_attributes(), metadata, every, time_zone=WEATHER_LINK_TIME_ZONE
+    )
+    click.echo(f"Wrote {rows} rows to {output}")
 
 
 @database.command(name=ClickCommands.DESCRIBE.value)
 @influx_options
-def weather_db_describe(host: str, measurement: str, token: str):
+@cache_option
+@sqlite_option
+def weather_db_describe(
+    host: str, measurement: str, token: str, cache: bool, sqlite: Optional[Path]
+):
     """
-    Show information about the data already stored in Influx database.
+    Show information about the data already stored in Influx database,
+    or in a WeeWX archive database with `--sqlite`.
     """
-    df = WeeWxInfluxArchive(measurement, token, host).df
-    summary = df.describe().T.drop(columns=["25%", "50%", "75%", "std", "mean"])
+    df = weewx_archive(measurement, token, host, sqlite, cache)
+    summary = summarize_archive(df)
     print("\nSamples:\n")
     print(summary)
 
 
+def find_gaps(
+    local: DatetimeIndex, remote: DatetimeIndex, tolerance: Timedelta
+) -> tuple[NDArray, DataFrame]:
+    """
+    Find local times that have no remote record within `tolerance`, with a
+    sorted merge of both indexes, so the cost is linear in their length.
+    Returns a mask of the missing local times, and the gap intervals they
+    form, with the first and last missing time and the number of rows.
+    """
+    theirs = remote.sort_values().unique().as_unit("ns").asi8
+    ours = local.as_unit("ns").asi8
+    limit = Timedelta(tolerance).value
+    if len(theirs) == 0:
+        missing = ones(len(ours), dtype=bool)
+    else:
+        after = theirs.searchsorted(ours).clip(max=len(theirs) - 1)
+        before = (after - 1).clip(min=0)
+        nearest = minimum(abs(theirs[after] - ours), abs(ours - theirs[before]))
+        missing = nearest > limit
+    # Gaps are runs of consecutive missing rows in the sorted local index
+    edges = diff(concatenate([[0], missing.astype(int8), [0]]))
+    starts = flatnonzero(edges == 1)
+    ends = flatnonzero(edges == -1)
+    gaps = DataFrame({
+        "start": local[starts],
+        "end": local[ends - 1],
+        "rows": ends - starts,
+    })
+    return missing, gaps
+
+
 @database.command(name=ClickCommands.BACKFILL.value)
 @click.argument("station", type=click.Choice(StationName, case_sensitive=False))
 @influx_options
-def weather_db_backfill(station: StationName, host: str, measurement: str, token: str):
+@sync_options
+@cache_option
+@click.option(
+    "--tolerance",
+    default=30.0,
+    type=click.FloatRange(min=0),
+    help=(
+        "Minutes from the nearest WeeWX record within which a local record "
+        "is already covered. Defaults to half the WeatherLink interval."
+    ),
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Show the gaps that would be filled, without writing anything.",
+)
+@sqlite_option
+@altitude_option
+def weather_db_backfill(
+    station: StationName,
+    host: str,
+    measurement: str,
+    token: str,
+    overlap: float,
+    full: bool,
+    cache: bool,
+    tolerance: float,
+    dry_run: bool,
+    sqlite: Optional[Path],
+    altitude: Optional[float],
+):
     """
-    Backfill missing data from local to database.
+    Backfill missing data from local to database. New WeeWX records are
+    synced as they are, and local WeatherLink records only where WeeWX has
+    gaps. Each source only sends rows newer than its last sync, unless the
+    database is behind. With `--sqlite`, WeeWX records are read from a
+    device's archive database instead of InfluxDB.
+
+    Dew point, heat index and wind chill of both sources are recomputed
+    with the same formulas, and sea level pressure too with `--altitude`.
     """
-    local = WeatherLinkArchive(station.value).df
-    remote = WeeWxInfluxArchive(measurement, token, host).df
+    # pylint: disable=import-outside-toplevel,too-many-arguments,too-many-positional-arguments
+    from influxdb_client_3 import InfluxDBClient3
+
     selected = [each.value for each in StandardNames]
-    filtered = local[selected]
-    remote_filtered = remote[selected]
-    filtered["station"] = station.value
-    filtered["device"] = Device.DAVIS_VANTAGE_PRO_2.value
-    filtered["source"] = Middleware.WEATHER_LINK.value
-
-    remote_filtered["station"] = station.value
-    remote_filtered["device"] = Device.DAVIS_VANTAGE_PRO_2.value
-    remote_filtered["source"] = Middleware.WEEWX.value
-
-    df = concat([filtered, remote_filtered]).drop_duplicates(
-        keep="first", ignore_index=False
-    )
+    tags = ["station", "device", "source"]
+
+    def fill_gaps(start: Optional[datetime]) -> DataFrame:
+        df = WeatherLinkArchive(station.value).df.sort_index()
+        # Compared to WeeWX records, and uploaded, in UTC
+        df.index = local_to_utc(df.index, WEATHER_LINK_TIME_ZONE)
+        if start is not None:
+            df = df[df.index > start]
+        if df.empty:
+            return df
+        margin = timedelta(minutes=tolerance)
+        remote = weewx_archive(
+            measurement,
+            token,
+            host,
+            sqlite,
+            cache,
+            station,
+            start=df.index.min() - margin,
+            end=df.index.max() + margin,
+            series=[],
+        ).index
+        missing, gaps = find_gaps(df.index, remote, Timedelta(margin))
+        click.echo(f"{len(gaps)} gaps in WeeWX records, with {missing.sum()} of {len(df)} local rows")
+        if not gaps.empty:
+            click.echo(gaps.to_string(index=False))
+        return df[missing]
+
+    def weewx_records(start: Optional[datetime]) -> Iterator[DataFrame]:
+        # Device archives are streamed, because they can hold years of records
+        if sqlite is not None:
+            yield from WeeWxSqliteArchive(sqlite, start=start, series=StandardNames).chunks()
+        else:
+            yield weewx_archive(measurement, token, host, station=station, start=start, series=StandardNames)
+
+    sources = {
+        Middleware.WEATHER_LINK: lambda start: iter([fill_gaps(start)]),
+        Middleware.WEEWX: weewx_records,
+    }
+    watermarks = Watermarks()
+    with InfluxDBClient3(host=host, database=BACKFILL_DATABASE, token=token) as client:
+        for source, load in sources.items():
+            labels = {"station": station.value, "source": source.value}
+            key = Watermarks.key(BACKFILL_DATABASE, BACKFILL_MEASUREMENT, **labels)
+            since = None
+            if not full:
+                since = watermarks.verify(key, influx_max_time(client, BACKFILL_MEASUREMENT, **labels))
+            start = since - timedelta(hours=overlap) if since is not None else None
+            total, latest = 0, None
+            for df in load(start):
+                df = derive(df, altitude * FEET_TO_METERS if altitude is not None else None)
+                df = df[[each for each in selected if each in df.columns]]
+                if start is not None:
+                    df = df[df.index > start]
+                # Chunks are in time order, so only rows within a chunk can repeat
+                df = df[~df.index.duplicated(keep="first")]
+                if latest is not None:
+                    df = df[df.index > latest]
+                if df.empty:
+                    continue
+                total, latest = total + len(df), df.index.max()
+                if dry_run:
+                    continue
+                df = df.assign(
+                    station=station.value,
+                    device=Device.DAVIS_VANTAGE_PRO_2.value,
+                    source=source.value,
+                )
+                for rows, records in line_protocol(df, BACKFILL_MEASUREMENT, tags):
+                    influx_write(client, records, rows)
+            if not total:
+                click.echo(f"No new rows from {source.value} since {since}")
+                continue
+            if dry_run:
+                click.echo(f"Would upload {total} rows from {source.value}")
+                continue
+            click.echo(f"Uploaded {total} rows from {source.value}")
+            watermarks.set(key, max(latest, since) if since is not None else latest)
+
+
+# Directions paired with the speeds that weight their vector means
+WIND_VECTORS = {
+    StandardNames.WIND_FROM_DIRECTION: StandardNames.WIND_SPEED,
+    StandardNames.WIND_GUST_FROM_DIRECTION: StandardNames.WIND_SPEED_OF_GUST,
+}
 
-    with InfluxDBClient3(host=host, database="neracoos", token=token) as client:
-        client.write(
-            df,
-            data_frame_measurement_name="weather",
-            data_frame_tag_columns=["station", "device", "source"],
+
+def downsample(df: DataFrame, every: str) -> DataFrame:
+    """
+    Aggregate WeeWX archive records into time bins, with the mean, min, and
+    max of each series as `<name>_mean`, `<name>_min`, and `<name>_max`.
+    Directions can't be averaged, so wind gets speed weighted vector means
+    as `<name>_vector` for each direction and its speed instead. Records
+    with a location tag are aggregated for each station, and keep the tag.
+    """
+    if STATION_TAG in df.columns:
+        frames = [
+            downsample(group.drop(columns=STATION_TAG), every).assign(**{STATION_TAG: location})
+            for location, group in df.groupby(STATION_TAG, sort=True)
+        ]
+        return concat(frames).sort_index(kind="stable") if frames else df.iloc[:0]
+    directions = {CF_STANDARDS[each].weewx.name for each in WIND_VECTORS}
+    scalars = [name for name in df.columns if name not in directions]
+    bins = df.resample(every)
+    aggregates = bins[scalars].agg(["mean", "min", "max"])
+    aggregates.columns = [f"{name}_{stat}" for name, stat in aggregates.columns]
+    for direction, speed in WIND_VECTORS.items():
+        angle, magnitude = CF_STANDARDS[direction].weewx.name, CF_STANDARDS[speed].weewx.name
+        if angle not in df.columns or magnitude not in df.columns:
+            continue
+        radians = deg2rad(df[angle])
+        components = DataFrame({
+            "east": df[magnitude] * sin(radians),
+            "north": df[magnitude] * cos(radians),
+        }).resample(every).mean()
+        aggregates[f"{angle}_vector"] = rad2deg(arctan2(components["east"], components["north"])) % 360
+        aggregates[f"{magnitude}_vector"] = hypot(components["east"], components["north"])
+    return aggregates.dropna(how="all")
+
+
+@database.command(name=ClickCommands.DOWNSAMPLE.value)
+@influx_options
+@sync_options
+def weather_db_downsample(host: str, measurement: str, token: str, overlap: float, full: bool):
+    """
+    Maintain hourly and daily aggregates of archive records, in measurements
+    named with a `_1h` or `_1d` suffix, so dashboards over long time ranges
+    don't scan every record. Run it on a schedule. Bins since the last run
+    are recomputed, and replace the partial ones written before.
+    """
+    # pylint: disable=import-outside-toplevel
+    from influxdb_client_3 import InfluxDBClient3
+
+    database = "weather"
+    # Aggregates keep WeeWX names and units, like the dashboard queries
+    names = [CF_STANDARDS[each].weewx.name for each in StandardNames]
+    identity = UnitConversions({name: (name, Source(name)) for name in names})
+    # Stations share the measurement, and are aggregated apart
+    located = [each for each in STATIONS.values() if each.location is not None]
+    untagged = next((each.location for each in located if each.untagged), None)
+    locations = [*(each.location for each in located), *([None] if untagged else [])]
+    watermarks = Watermarks()
+    with InfluxDBClient3(host=host, database=database, token=token) as client:
+        for every in DOWNSAMPLES:
+            target = f"{measurement}_{every}"
+            key = Watermarks.key(database, target)
+            since = None
+            if not full:
+                since = watermarks.verify(key, influx_max_time(client, target))
+            start = None
+            if since is not None:
+                start = (since - timedelta(hours=overlap)).floor(every)
+            # Records on the first bin edge are excluded by the query
+            after = start - timedelta(seconds=1) if start is not None else None
+            table = client.query(
+                weewx_query(measurement, start=after, series=StandardNames, locations=locations),
+                mode="all",
+            )
+            df = frame_from_arrow(table, TIME, identity)
+            tag = table[STATION_TAG].to_pandas()
+            # Untagged records are tagged with the location of their station
+            df[STATION_TAG] = (tag.fillna(untagged) if untagged else tag).to_numpy()
+            if start is not None:
+                df = df[df.index >= start]
+            aggregates = downsample(df, every)
+            if aggregates.empty:
+                click.echo(f"No new records for {target} since {since}")
+                continue
+            for rows, records in line_protocol(aggregates, target, [STATION_TAG]):
+                influx_write(client, records, rows)
+            click.echo(f"Wrote {len(aggregates)} bins to {target}")
+            watermarks.set(key, aggregates.index.max())
+
+
+def downsampled_column(name: str) -> str:
+    """
+    Column of downsampled measurements that stands for a WeeWX series over
+    a bin, with the aggregator that suits it, like `resample_frame`.
+    """
+    standard = next((each.value for each in StandardNames if CF_STANDARDS[each].weewx.name == name), None)
+    aggregator = RESAMPLE_AGGREGATORS.get(standard, Aggregator.MEAN)
+    if aggregator is Aggregator.VECTOR_MEAN:
+        return f"{name}_vector"
+    return f"{name}_max" if aggregator is Aggregator.MAX else f"{name}_mean"
+
+
+def resolution_query(
+    columns: list[str],
+    measurement: str = "observations",
+    downsampled: Optional[dict[str, str]] = None,
+) -> str:
+    """
+    Grafana SQL that reads archive records for short panel intervals, and
+    downsampled measurements for long ones, with the column of each series
+    from `downsampled`, or `downsampled_column`. Only the branch that
+    matches `$__interval_ms` returns rows, and the others are pruned as
+    constant false.
+    """
+    downsampled = downsampled or {}
+    window = '"time" >= $__timeFrom AND "time" <= $__timeTo'
+    quoted = ", ".join(f'"{name}"' for name in columns)
+    bounds = [0, *DOWNSAMPLES.values(), None]
+    branches = [
+        f'SELECT "time", {quoted} FROM "{measurement}" '
+        f"WHERE {window} AND \"binding\" = 'archive' AND $__interval_ms < {bounds[1]}"
+    ]
+    for index, every in enumerate(DOWNSAMPLES, start=1):
+        aggregates = ", ".join(
+            f'"{downsampled.get(name) or downsampled_column(name)}" AS "{name}"' for name in columns
         )
+        condition = f"$__interval_ms >= {bounds[index]}"
+        if bounds[index + 1] is not None:
+            condition += f" AND $__interval_ms < {bounds[index + 1]}"
+        branches.append(
+            f'SELECT "time", {aggregates} FROM "{measurement}_{every}" WHERE {window} AND {condition}'
+        )
+    return "\nUNION ALL\n".join(branches) + '\nORDER BY "time" ASC'
+
+
+def windrose_query(measurement: str = "observations") -> str:
+    """
+    Grafana SQL for the wind rose panel, which is drawn from the direction
+    the wind blows toward. Long time ranges read the speed weighted vector
+    means of downsampled measurements, which are the only direction and
+    speed that can be paired over a bin.
+    """
+    direction = CF_STANDARDS[StandardNames.WIND_FROM_DIRECTION].weewx.name
+    speed = CF_STANDARDS[StandardNames.WIND_SPEED].weewx.name
+    records = resolution_query(
+        [direction, speed], measurement, {direction: f"{direction}_vector", speed: f"{speed}_vector"}
+    )
+    return (
+        f'SELECT ("{direction}" + 180) % 360 AS "wind_direction", "{speed}" AS "wind_speed"\n'
+        f"FROM (\n{records}\n)"
+    )
+
+
+@database.command(name=ClickCommands.DASHBOARD.value)
+@click.option(
+    "--path",
+    default=DASHBOARD,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Grafana dashboard JSON to update in place.",
+)
+def weather_db_dashboard(path: Path):
+    """
+    Point time series panels that read archive records at the downsampled
+    measurements for long time ranges, and the wind rose at their vector
+    means. The columns of each query are kept, so this can be run again
+    after editing panels.
+    """
+    with open(path, "r", encoding="utf-8") as fid:
+        dashboard = json.load(fid)
+    updated = 0
+    for panel in dashboard.get("panels", []):
+        if panel.get("type") == WINDROSE_PANEL:
+            for target in panel.get("targets", []):
+                target.update(
+                    editorMode="code",
+                    rawQuery=True,
+                    rawSql=windrose_query(target.get("table", "observations")),
+                )
+                updated += 1
+        if panel.get("type") != "timeseries":
+            continue
+        for target in panel.get("targets", []):
+            sql = target.get("sql", {})
+            if "archive" not in sql.get("whereString", ""):
+                continue
+            columns = [
+                parameter["name"]
+                for column in sql.get("columns", [])
+                for parameter in column.get("parameters", [])
+                if parameter["name"] != TIME
+            ]
+            target.update(
+                editorMode="code",
+                rawQuery=True,
+                rawSql=resolution_query(columns, target.get("table", "observations")),
+            )
+            updated += 1
+    with open(path, "w", encoding="utf-8") as fid:
+        json.dump(dashboard, fid, indent=2, ensure_ascii=False)
+    click.echo(f"Updated {updated} queries in {path}")
+
+
+def qc_options(function):
+    """
+    Choose the station data and QARTOD configuration to run tests on.
+    Re-usable decorator for `qc` commands.
+    """
+    function = click.option(
+        "--days",
+        default=None,
+        type=click.IntRange(min=1),
+        help="Only test the most recent days of data, for example each archive interval.",
+    )(function)
+    function = click.option(
+        "--qartod",
+        default=QARTOD_CONFIG,
+        type=click.Path(exists=True, dir_okay=False, path_type=Path),
+        help="QARTOD configuration file. Defaults to the weather configuration.",
+    )(function)
+    function = click.option(
+        "--source",
+        default=Middleware.WEATHER_LINK,
+        type=click.Choice(Middleware, case_sensitive=False),
+        help="Test a WeatherLink export of the station, or WeeWX archive records.",
+    )(function)
+    function = click.argument(
+        "station", type=click.Choice(StationName, case_sensitive=False)
+    )(function)
+    return function
+
+
+def qc_flags(
+    station: StationName,
+    source: Middleware,
+    qartod: Path,
+    days: Optional[int],
+    measurement: str,
+    token: str,
+    host: str,
+    cache: bool,
+    sqlite: Optional[Path],
+) -> tuple[DataFrame, DataFrame]:
+    """
+    Normalized records of a station from one source, and their QARTOD flags.
+    WeatherLink exports keep the station clock, so their window ends at
+    the time on that clock, and WeeWX records at the time in UTC.
+    """
+    if source == Middleware.WEATHER_LINK:
+        df = WeatherLinkArchive(station.value).df.sort_index()
+        if days is not None:
+            now = Timestamp.now(WEATHER_LINK_TIME_ZONE).tz_localize(None)
+            df = df[df.index > now - timedelta(days=days)]
+    else:
+        start = utc_now() - timedelta(days=days) if days is not None else None
+        df = weewx_archive(measurement, token, host, sqlite, cache, station, start=start)
+    return df, load_qartod_config(qartod).run(df)
+
+
+@qc.command(name=ClickCommands.DESCRIBE.value)
+@qc_options
+@influx_options
+@cache_option
+@sqlite_option
+def weather_qc_describe(**kwargs):
+    """
+    Count the QARTOD flags of each test and series.
+    """
+    _, flags = qc_flags(**kwargs)
+    print("\nFlags:\n")
+    print(summarize_flags(flags))
+
+
+@qc.command(name=ClickCommands.EXPORT.value)
+@qc_options
+@influx_options
+@cache_option
+@sqlite_option
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="File to write values and flags to, as Parquet if it ends in .parquet and otherwise CSV.",
+)
+def weather_qc_export(output: Optional[Path], **kwargs):
+    """
+    Export normalized station data with a QARTOD flag column for each test.
+    """
+    df, flags = qc_flags(**kwargs)
+    if output is None:
+        output = DATA_DIR / f"{kwargs['station'].value}-{kwargs['source'].value}-qartod.csv"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    combined = concat([df, flags], axis=1)
+    if output.suffix == ".parquet":
+        combined.to_parquet(output)
+    else:
+        combined.to_csv(output)
+    click.echo(f"Wrote {len(combined)} rows to {output}")
+
+
+def monitor_records(
+    index: GapIndex,
+    stations: list[Station],
+    now: Timestamp,
+    days: float,
+    overlap: float,
+    sqlite: Optional[Path] = None,
+    **kwargs,
+) -> dict[str, tuple[DataFrame, int, int]]:
+    """
+    Recent WeeWX records of some stations, with the window of the gap index
+    that each one updates. Records of every station are read with one query,
+    from the earliest start of their windows, or from the archive database
+    of a single station with `sqlite`. Keyword arguments are the InfluxDB
+    measurement, token, and host. The index isn't changed.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    windows = {each.name: index.window(each.name, now, days, overlap) for each in stations}
+    start = Timestamp(min(first for first, _ in windows.values()), unit="s").to_pydatetime()
+    end = Timestamp(max(last for _, last in windows.values()), unit="s").to_pydatetime()
+    if sqlite is not None:
+        records = {stations[0].name: WeeWxSqliteArchive(sqlite, start=start, end=end).df}
+    else:
+        df = WeeWxInfluxArchive(
+            kwargs["measurement"], kwargs["token"], kwargs["host"], start=start, end=end, stations=stations
+        ).df
+        records = {name: group.drop(columns=STATION) for name, group in df.groupby(STATION)}
+    empty = DataFrame(index=DatetimeIndex([], name=TIME))
+    return {name: (records.get(name, empty), first, last) for name, (first, last) in windows.items()}
+
+
+def monitor_update(
+    index: GapIndex, records: dict[str, tuple[DataFrame, int, int]], now: Timestamp, retain: float
+):
+    """
+    Bring the gap index up to date with the records of `monitor_records`,
+    save it, and set its metrics.
+    """
+    for name, (df, first, last) in records.items():
+        index.update(name, df, first, last, retain)
+    index.save()
+    index.record_metrics(now)
+
+
+@weather.command(name=ClickCommands.MONITOR.value)
+@click.option(
+    "--station",
+    "stations",
+    multiple=True,
+    type=click.Choice(StationName, case_sensitive=False),
+    help=(
+        "A station to monitor. Defaults to every station with a location in "
+        "the registry. Give exactly one with --sqlite."
+    ),
+)
+@influx_options
+@sqlite_option
+@click.option(
+    "--interval",
+    default=3600,
+    type=click.IntRange(min=1),
+    help="The WeeWX archive interval in seconds, `archive_interval` in weewx.conf.",
+)
+@click.option(
+    "--days",
+    default=7.0,
+    type=click.FloatRange(min=0),
+    help="Days of records to read for a station that isn't in the index yet.",
+)
+@click.option(
+    "--overlap",
+    default=24.0,
+    type=click.FloatRange(min=0),
+    help="Hours before the last update to read again, for records that arrived late.",
+)
+@click.option(
+    "--retain",
+    default=30.0,
+    type=click.FloatRange(min=0),
+    help="Days to keep closed gaps in the index.",
+)
+@click.option(
+    "--index",
+    "path",
+    default=MONITOR_INDEX,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="File that keeps the gap index between updates.",
+)
+@click.option(
+    "--daemon",
+    is_flag=True,
+    help="Keep updating, and serve the index at /gaps and metrics at /metrics.",
+)
+@click.option(
+    "--every",
+    default=300.0,
+    type=click.FloatRange(min=1),
+    help="Seconds between updates when running as a daemon.",
+)
+@click.option(
+    "--listen",
+    default="127.0.0.1",
+    help="Address to serve on when running as a daemon. Defaults to localhost.",
+)
+@click.option("--port", default=8766, type=int, help="Port to serve on when running as a daemon.")
+def weather_monitor(
+    stations: tuple[StationName, ...],
+    sqlite: Optional[Path],
+    interval: int,
+    path: Path,
+    daemon: bool,
+    every: float,
+    listen: str,
+    port: int,
+    **kwargs,
+):
+    """
+    Find gaps in the WeeWX archive records of each station and variable,
+    and how long ago each station last reported. Prints the index as JSON,
+    and sets Prometheus metrics, for `penbay --metrics`. Only records since
+    the last update are read, with some overlap, so it is cheap to run on
+    a schedule or as a daemon.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,import-outside-toplevel
+    selected = [STATIONS[each.value] for each in stations] or list(STATIONS.values())
+    if sqlite is not None:
+        if len(stations) != 1:
+            raise click.UsageError("Give the station of the archive database with --station")
+    else:
+        selected = [each for each in selected if each.location is not None]
+        if not selected:
+            raise click.ClickException("None of the stations have a location tag in InfluxDB")
+    index = GapIndex(path, interval)
+    retain = kwargs.pop("retain")
+    options = {**kwargs, "sqlite": sqlite}
+
+    def now() -> Timestamp:
+        return Timestamp.now("UTC").tz_localize(None)
+
+    if not daemon:
+        time = now()
+        monitor_update(index, monitor_records(index, selected, time, **options), time, retain)
+        click.echo(json.dumps(index.payload(now()), indent=2))
+        return
+
+    from copy import deepcopy
+    from http import HTTPStatus
+    from http.server import ThreadingHTTPServer
+    from threading import Lock, Thread
+    from time import sleep
+    from lib import ResponseHandler
+
+    lock = Lock()
+
+    class Handler(ResponseHandler):
+        """
+        Answer GET requests with the gap index or metrics.
+        """
+
+        # pylint: disable=invalid-name
+        def do_GET(self):
+            """
+            Serve the current index. It is replaced, never changed, by
+            updates, so it is only read under the lock.
+            """
+            if self.path == "/metrics":
+                self.respond(HTTPStatus.OK, metrics.exposition(), "text/plain; version=0.0.4")
+            elif self.path == "/gaps":
+                with lock:
+                    current = index
+                self.respond(HTTPStatus.OK, json.dumps(current.payload(now())), "application/json")
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+
+    server = ThreadingHTTPServer((listen, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    click.echo(f"Serving gaps on http://{listen}:{server.server_port}/gaps")
+    try:
+        while True:
+            try:
+                # Query and update a copy without the lock, so that slow
+                # queries don't block requests, and then swap it in
+                time = now()
+                updated = deepcopy(index)
+                monitor_update(updated, monitor_records(updated, selected, time, **options), time, retain)
+                with lock:
+                    index = updated
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                # Keep serving the last index while the database is unreachable
+                click.echo(f"Update failed: {error}", err=True)
+            sleep(every)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
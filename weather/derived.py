@@ -0,0 +1,133 @@
+"""
+Meteorological variables derived from the base observations of normalized
+weather station data.
+
+WeeWX computes dew point, heat index and wind chill on the device, and
+WeatherLink exports carry their own precomputed, rounded values, so the
+two sources disagree. Recomputing them from temperature, humidity and wind
+with one set of formulas makes backfilled and live records consistent.
+
+Each formula is a single vectorized expression over whole columns, in the
+standard units of normalized frames, with the constants that WeeWX uses.
+Sea level pressure is reduced from WeeWX station pressure with the
+altitude of the station, which WeeWX is configured with in feet, and
+replaces the `barometer` value of the source.
+"""
+
+from typing import Optional
+from numpy import abs as absolute, clip, float64, isnan, log, nan, sqrt, where
+from numpy.typing import NDArray
+from pandas import DataFrame
+from lib import FAHRENHEIT_OFFSET, FAHRENHEIT_SCALE, timing_span
+
+FREEZING = 273.15
+FEET_TO_METERS = 0.3048
+MILES_PER_HOUR_TO_SPEED = 0.44704
+# Magnus coefficients for saturation vapor pressure over water
+MAGNUS_B = 17.27
+MAGNUS_C = 237.7
+# Standard atmosphere lapse rate, in K/m, and the exponent of the
+# barometric formula that goes with it
+LAPSE_RATE = 0.0065
+BAROMETRIC_EXPONENT = 5.257
+
+
+def to_fahrenheit(kelvin: NDArray) -> NDArray:
+    """
+    Convert Kelvin to Fahrenheit, for formulas fit in Fahrenheit.
+    """
+    return (kelvin - FAHRENHEIT_OFFSET) / FAHRENHEIT_SCALE
+
+
+def dew_point(temperature: NDArray, humidity: NDArray) -> NDArray:
+    """
+    Dew point from air temperature and relative humidity, as a fraction,
+    with the Magnus formula. Dry air has no dew point.
+    """
+    celsius = temperature - FREEZING
+    gamma = MAGNUS_B * celsius / (MAGNUS_C + celsius) + log(where(humidity > 0, humidity, nan))
+    return MAGNUS_C * gamma / (MAGNUS_B - gamma) + FREEZING
+
+
+def heat_index(temperature: NDArray, humidity: NDArray) -> NDArray:
+    """
+    Heat index from air temperature and relative humidity, with the
+    National Weather Service algorithm. The simple formula is used unless
+    it averages to more than 80 °F with the temperature, and then the
+    Rothfusz regression, adjusted at low and high humidity. Below 40 °F,
+    the heat index is the temperature.
+    """
+    t = to_fahrenheit(temperature)
+    rh = humidity * 100
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    regression = (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * rh
+        - 0.22475541 * t * rh
+        - 6.83783e-3 * t**2
+        - 5.481717e-2 * rh**2
+        + 1.22874e-3 * t**2 * rh
+        + 8.5282e-4 * t * rh**2
+        - 1.99e-6 * t**2 * rh**2
+    )
+    dry = (rh < 13) & (t > 80) & (t < 112)
+    regression -= where(dry, (13 - rh) / 4 * sqrt(clip((17 - absolute(t - 95)) / 17, 0, None)), 0)
+    humid = (rh > 85) & (t >= 80) & (t < 87)
+    regression += where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+    index = where((simple + t) / 2 >= 80, regression, simple)
+    index = where(t < 40, t, index)
+    return index * FAHRENHEIT_SCALE + FAHRENHEIT_OFFSET
+
+
+def wind_chill(temperature: NDArray, speed: NDArray) -> NDArray:
+    """
+    Wind chill from air temperature and wind speed, with the 2001 National
+    Weather Service formula. At 50 °F and above, or in wind of 3 mph or
+    less, the wind chill is the temperature.
+    """
+    t = to_fahrenheit(temperature)
+    power = (speed / MILES_PER_HOUR_TO_SPEED) ** 0.16
+    chill = 35.74 + 0.6215 * t - 35.75 * power + 0.4275 * t * power
+    calm = (t >= 50) | (speed <= 3 * MILES_PER_HOUR_TO_SPEED)
+    return where(calm, t, chill) * FAHRENHEIT_SCALE + FAHRENHEIT_OFFSET
+
+
+def sea_level_pressure(pressure: NDArray, temperature: NDArray, altitude: float) -> NDArray:
+    """
+    Reduce station pressure to sea level with the barometric formula,
+    assuming the standard lapse rate below the station.
+    """
+    column = LAPSE_RATE * altitude
+    return pressure * (1 - column / (temperature + column)) ** -BAROMETRIC_EXPONENT
+
+
+@timing_span("weather_derive")
+def derive(df: DataFrame, altitude: Optional[float] = None) -> DataFrame:
+    """
+    Recompute dew point, heat index and wind chill of a normalized frame,
+    and sea level pressure if the frame has station pressure and the
+    altitude of the station, in meters, is known. Values of the source are
+    kept where an input is missing, and variables without inputs are left
+    as they are.
+    """
+    def values(name: str) -> Optional[NDArray]:
+        return df[name].to_numpy(float64) if name in df.columns else None
+
+    temperature = values("air_temperature")
+    humidity = values("relative_humidity")
+    speed = values("wind_speed")
+    pressure = values("surface_air_pressure")
+    derived: dict[str, NDArray] = {}
+    if temperature is not None and humidity is not None:
+        derived["dew_point_temperature"] = dew_point(temperature, humidity)
+        derived["heat_index_of_air_temperature"] = heat_index(temperature, humidity)
+    if temperature is not None and speed is not None:
+        derived["wind_chill_of_air_temperature"] = wind_chill(temperature, speed)
+    if temperature is not None and pressure is not None and altitude is not None:
+        derived["air_pressure"] = sea_level_pressure(pressure, temperature, altitude)
+    for name, result in derived.items():
+        source = values(name)
+        if source is not None:
+            derived[name] = where(isnan(result), source, result)
+    return df.assign(**derived)
@@ -0,0 +1,195 @@
+"""
+Gaps and ingest latency of WeeWX archive records, for telling whether a
+station stopped reporting without looking at dashboards.
+
+WeeWX writes one archive record per archive interval, at the end of each
+interval, so the records that should exist are known in advance. Each
+station and variable has a list of gaps, runs of intervals without a
+value, that is kept on disk and brought up to date with the records of a
+recent window, instead of the full history. The window overlaps the last
+update, so that late records, sent after an outage of the cellular link,
+close the gaps they fill. Missing intervals up to the present are a gap
+too, which is open until the station reports again.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+from numpy import arange, concatenate, diff, flatnonzero, float64, int8, isnan, nonzero, zeros
+from numpy.typing import NDArray
+from pandas import DataFrame, DatetimeIndex, Timestamp
+from lib import metrics
+
+# Key of the gaps in any archive record, as opposed to a single variable
+RECORDS = "records"
+
+
+def seconds(time: Timestamp) -> int:
+    """
+    Unix time of a naive UTC timestamp.
+    """
+    return int(Timestamp(time).timestamp())
+
+
+def isoformat(value: int) -> str:
+    """
+    Naive UTC timestamp of a Unix time, as text.
+    """
+    return Timestamp(value, unit="s").isoformat()
+
+
+def missing_runs(present: NDArray) -> list[tuple[int, int]]:
+    """
+    First and last positions of each run of missing values in a boolean
+    column of present values.
+    """
+    edges = diff(concatenate([[0], (~present).astype(int8), [0]]))
+    return list(zip(flatnonzero(edges == 1).tolist(), (flatnonzero(edges == -1) - 1).tolist()))
+
+
+class GapIndex:
+    """
+    Gap intervals of each station and variable, and the time of their
+    newest value, as Unix times of archive records. Saved as JSON, and
+    replaced atomically, like `Watermarks`.
+    """
+
+    def __init__(self, path: Path, interval: int = 3600):
+        self.path = path
+        self.interval = interval
+        self.stations: dict[str, dict] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as fid:
+                saved = json.load(fid)
+            if saved.get("interval") == interval:
+                self.stations = saved.get("stations", {})
+
+    def checked(self, station: str) -> Optional[int]:
+        """
+        Time of the last archive record that the index of a station covers.
+        """
+        return self.stations.get(station, {}).get("checked")
+
+    def window(self, station: str, now: Timestamp, days: float, overlap: float) -> tuple[int, int]:
+        """
+        Times after which, and through which, records of a station need to
+        be read. The first update reads `days` of records, and later ones
+        re-read `overlap` hours before the last update, for late records.
+        """
+        end = seconds(now) // self.interval * self.interval
+        checked = self.checked(station)
+        if checked is None:
+            start = end - int(days * 86400)
+        else:
+            start = min(checked, end) - int(overlap * 3600)
+        return start // self.interval * self.interval, end
+
+    def update(self, station: str, df: DataFrame, start: int, end: int, retain: float = 30.0):
+        """
+        Replace the gaps of a station in the window after `start` and
+        through `end` with those in its records, a time indexed frame with
+        a column for each variable. Variables are indexed once they have a
+        value, so that those a station doesn't measure are left out, and
+        then are missing for the whole window if they have no column.
+        Gaps that ended more than `retain` days ago are dropped.
+        """
+        # pylint: disable=too-many-locals,too-many-arguments,too-many-positional-arguments
+        state = self.stations.setdefault(station, {"checked": None, "latest": {}, "gaps": {}})
+        observed = df.columns[df.notna().any().to_numpy()] if len(df.columns) else []
+        variables = [each for each in dict.fromkeys([*observed, *state["latest"]]) if each != RECORDS]
+        first = start + self.interval
+        slots = arange(first, end + self.interval, self.interval)
+        times = DatetimeIndex(df.index).as_unit("s").asi8
+        # Records are stamped at the end of their interval, which is a slot
+        position = (times - first + self.interval - 1) // self.interval
+        inside = (position >= 0) & (position < len(slots))
+        values = df.reindex(columns=variables).to_numpy(float64)
+        valid = ~isnan(values) & inside[:, None]
+        present = zeros((len(slots), len(variables) + 1), dtype=bool)
+        rows, columns = nonzero(valid)
+        present[position[rows], columns] = True
+        present[position[inside], -1] = True
+        for column, name in enumerate([*variables, RECORDS]):
+            kept = []
+            for gap_start, gap_end in state["gaps"].get(name, []):
+                if gap_start < first:
+                    kept.append([gap_start, min(gap_end, start)])
+                if gap_end > end:
+                    kept.append([max(gap_start, end + self.interval), gap_end])
+            found = [
+                [int(slots[run_start]), int(slots[run_end])]
+                for run_start, run_end in missing_runs(present[:, column])
+            ]
+            gaps = []
+            for gap in sorted(kept + found):
+                if gaps and gap[0] <= gaps[-1][1] + self.interval:
+                    gaps[-1][1] = max(gaps[-1][1], gap[1])
+                else:
+                    gaps.append(gap)
+            horizon = end - int(retain * 86400)
+            state["gaps"][name] = [gap for gap in gaps if gap[1] >= horizon]
+            newest = flatnonzero(present[:, column])
+            if len(newest):
+                state["latest"][name] = max(state["latest"].get(name) or 0, int(slots[newest[-1]]))
+        state["checked"] = max(state["checked"] or end, end)
+
+    def save(self):
+        """
+        Save the index of every station.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with open(temporary, "w", encoding="utf-8") as fid:
+            json.dump({"interval": self.interval, "stations": self.stations}, fid, indent=2, sort_keys=True)
+        temporary.replace(self.path)
+
+    def payload(self, now: Timestamp) -> dict:
+        """
+        Ingest latency of each station, and the age and gaps of each of its
+        variables, in seconds and ISO 8601 times. Gaps that reach the last
+        checked record are open.
+        """
+        current = seconds(now)
+        stations = {}
+        for station, state in sorted(self.stations.items()):
+            variables = {}
+            for name in sorted(set(state["gaps"]) | set(state["latest"])):
+                latest = state["latest"].get(name)
+                variables[name] = {
+                    "latest": isoformat(latest) if latest is not None else None,
+                    "age": current - latest if latest is not None else None,
+                    "gaps": [
+                        {
+                            "start": isoformat(start),
+                            "end": isoformat(end),
+                            "missing": (end - start) // self.interval + 1,
+                            "open": end >= state["checked"],
+                        }
+                        for start, end in state["gaps"].get(name, [])
+                    ],
+                }
+            records = variables.get(RECORDS, {})
+            stations[station] = {
+                "checked": isoformat(state["checked"]) if state["checked"] is not None else None,
+                "latency": records.get("age"),
+                "variables": variables,
+            }
+        return {"interval": self.interval, "time": isoformat(current), "stations": stations}
+
+    def record_metrics(self, now: Timestamp):
+        """
+        Set Prometheus gauges of the latency, variable ages, and gaps.
+        """
+        for station, summary in self.payload(now)["stations"].items():
+            if summary["latency"] is not None:
+                metrics.set("penbay_weather_ingest_latency_seconds", summary["latency"], station=station)
+            for name, variable in summary["variables"].items():
+                labels = {"station": station, "variable": name}
+                if variable["age"] is not None:
+                    metrics.set("penbay_weather_variable_age_seconds", variable["age"], **labels)
+                metrics.set("penbay_weather_gaps", len(variable["gaps"]), **labels)
+                metrics.set(
+                    "penbay_weather_missing_records",
+                    sum(each["missing"] for each in variable["gaps"]),
+                    **labels,
+                )
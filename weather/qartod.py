@@ -0,0 +1,246 @@
+"""
+Quality control (QC) for normalized weather station data using QARTOD tests.
+
+Configuration files have the same layout as `ioos_qc` stream configurations,
+but are compiled once into arrays of thresholds. Each test then runs as a
+single vectorized expression over every configured series, and flags are
+stored as `uint8`, so that checking each archive interval is cheap enough
+for station devices.
+
+Supported tests are `gross_range_test`, `rate_of_change_test`, `spike_test`
+and `flat_line_test`, with the `ioos_qc` parameter names. Thresholds are in
+the standard units of the normalized frames, and rates and durations are
+per second.
+"""
+
+from enum import Enum, IntEnum
+from pathlib import Path
+from time import perf_counter
+from numpy import abs as absolute, arange, array, diff, float64, full, inf, isnan, maximum, uint8, where
+from numpy.typing import NDArray
+from pandas import DataFrame, DatetimeIndex
+from yaml import safe_load
+from lib import metrics, timing_span
+
+QARTOD_CONFIG = Path(__file__).parent / "qartod.yaml"
+
+
+class Flag(IntEnum):
+    """
+    QARTOD flag values.
+    """
+
+    GOOD = 1
+    NOT_EVALUATED = 2
+    SUSPECT = 3
+    FAIL = 4
+    MISSING = 9
+
+
+class QartodTest(Enum):
+    """
+    Supported tests, and the rollup of all tests of a series.
+    """
+
+    GROSS_RANGE = "gross_range"
+    RATE_OF_CHANGE = "rate_of_change"
+    SPIKE = "spike"
+    FLAT_LINE = "flat_line"
+    ROLLUP = "rollup"
+
+
+def flag_column(series: str, test: QartodTest) -> str:
+    """
+    Name of the flag column of a single test of a series, like `ioos_qc` uses.
+    """
+    return f"{series}_qartod_{test.value}"
+
+
+def gross_range(values: NDArray, suspect: NDArray, fail: NDArray) -> NDArray:
+    """
+    Flag values outside of the suspect and fail spans of each column.
+    """
+    flags = full(values.shape, Flag.GOOD, dtype=uint8)
+    flags[(values < suspect[0]) | (values > suspect[1])] = Flag.SUSPECT
+    flags[(values < fail[0]) | (values > fail[1])] = Flag.FAIL
+    return flags
+
+
+def rate_of_change(values: NDArray, seconds: NDArray, threshold: NDArray) -> NDArray:
+    """
+    Flag values that changed faster than the threshold since the previous one.
+    """
+    flags = full(values.shape, Flag.GOOD, dtype=uint8)
+    rate = absolute(diff(values, axis=0)) / diff(seconds)[:, None]
+    flags[1:][rate > threshold] = Flag.SUSPECT
+    return flags
+
+
+def spike(values: NDArray, suspect: NDArray, fail: NDArray) -> NDArray:
+    """
+    Flag values that differ from the mean of their neighbors by more than
+    the thresholds. The first and last values have no neighbors to compare.
+    """
+    flags = full(values.shape, Flag.GOOD, dtype=uint8)
+    flags[:1] = flags[-1:] = Flag.NOT_EVALUATED
+    delta = absolute(values[1:-1] - (values[:-2] + values[2:]) / 2)
+    flags[1:-1][delta > suspect] = Flag.SUSPECT
+    flags[1:-1][delta > fail] = Flag.FAIL
+    return flags
+
+
+def flat_line(
+    values: NDArray, seconds: NDArray, tolerance: NDArray, suspect: NDArray, fail: NDArray
+) -> NDArray:
+    """
+    Flag values that have stayed within the tolerance of the previous value
+    for longer than the thresholds. The start of the current run of each
+    value is found with a running maximum, instead of searching a window.
+    """
+    rows = arange(len(values))[:, None]
+    changed = full(values.shape, True)
+    changed[1:] = ~(absolute(diff(values, axis=0)) <= tolerance)
+    start = maximum.accumulate(where(changed, rows, 0), axis=0)
+    duration = seconds[:, None] - seconds[start]
+    flags = full(values.shape, Flag.GOOD, dtype=uint8)
+    flags[duration >= suspect] = Flag.SUSPECT
+    flags[duration >= fail] = Flag.FAIL
+    return flags
+
+
+class QartodConfig:
+    """
+    A QARTOD configuration compiled into columns and threshold arrays for
+    each test. Thresholds have one value per series, or one row of lower and
+    upper bounds for spans, so that they broadcast against a block of values
+    with one column per series.
+    """
+
+    def __init__(self, config: dict):
+        self.streams: list[str] = []
+        self.tests: dict[QartodTest, tuple[list[str], dict[str, NDArray]]] = {}
+        collected: dict[QartodTest, tuple[list[str], dict[str, list]]] = {}
+        for name, stream in (config or {}).get("streams", {}).items():
+            self.streams.append(name)
+            for key, options in (stream or {}).get("qartod", {}).items():
+                test = QartodTest(key.removesuffix("_test"))
+                columns, parameters = collected.setdefault(test, ([], {}))
+                columns.append(name)
+                for parameter, value in self.parameters(test, options or {}).items():
+                    parameters.setdefault(parameter, []).append(value)
+        for test, (columns, parameters) in collected.items():
+            self.tests[test] = (
+                columns,
+                {key: array(value, dtype=float64).T for key, value in parameters.items()},
+            )
+
+    @staticmethod
+    def parameters(test: QartodTest, options: dict) -> dict:
+        """
+        Parameters of a single test, with missing spans and thresholds
+        replaced by ones that never flag.
+        """
+        if test == QartodTest.GROSS_RANGE:
+            fail = options.get("fail_span") or (-inf, inf)
+            return {"suspect": options.get("suspect_span") or fail, "fail": fail}
+        if test == QartodTest.RATE_OF_CHANGE:
+            return {"threshold": options.get("threshold", inf)}
+        if test == QartodTest.SPIKE:
+            return {
+                "suspect": options.get("suspect_threshold", inf),
+                "fail": options.get("fail_threshold", inf),
+            }
+        if test == QartodTest.FLAT_LINE:
+            return {
+                "tolerance": options.get("tolerance", 0.0),
+                "suspect": options.get("suspect_threshold", inf),
+                "fail": options.get("fail_threshold", inf),
+            }
+        raise ValueError(f"Unsupported weather QARTOD test: {test.value}")
+
+    def run(self, df: DataFrame) -> DataFrame:
+        """
+        Flag every configured series that is in a normalized frame, with
+        one `uint8` column for each test and a rollup of the worst flag.
+        Missing values are flagged as missing by every test.
+        """
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        streams = [each for each in self.streams if each in df.columns]
+        values = df[streams].to_numpy(float64)
+        seconds = DatetimeIndex(df.index).as_unit("ns").asi8 / 1e9
+        missing = isnan(values)
+        rollup = full(values.shape, Flag.GOOD, dtype=uint8)
+        flags: dict[str, NDArray] = {}
+        with timing_span("weather_qartod"):
+            started = perf_counter()
+            for test, (columns, parameters) in self.tests.items():
+                selected = [index for index, each in enumerate(columns) if each in df.columns]
+                if not selected:
+                    continue
+                positions = [streams.index(columns[index]) for index in selected]
+                block = values[:, positions]
+                options = {key: value[..., selected] for key, value in parameters.items()}
+                if test == QartodTest.GROSS_RANGE:
+                    result = gross_range(block, **options)
+                elif test == QartodTest.RATE_OF_CHANGE:
+                    result = rate_of_change(block, seconds, **options)
+                elif test == QartodTest.SPIKE:
+                    result = spike(block, **options)
+                else:
+                    result = flat_line(block, seconds, **options)
+                result[missing[:, positions]] = Flag.MISSING
+                rollup[:, positions] = maximum(
+                    rollup[:, positions],
+                    where(result == Flag.NOT_EVALUATED, Flag.GOOD, result),
+                )
+                for column, each in zip(positions, result.T):
+                    flags[flag_column(streams[column], test)] = each
+            rollup[missing] = Flag.MISSING
+            elapsed = perf_counter() - started
+        samples = values.size
+        metrics.inc("penbay_qc_samples_total", samples)
+        metrics.inc("penbay_qc_seconds_total", elapsed)
+        if elapsed > 0:
+            metrics.set("penbay_qc_samples_per_second", samples / elapsed)
+        ordered = {}
+        for column, name in enumerate(streams):
+            for test in QartodTest:
+                key = flag_column(name, test)
+                if test == QartodTest.ROLLUP:
+                    ordered[key] = rollup[:, column]
+                elif key in flags:
+                    ordered[key] = flags[key]
+        return DataFrame(ordered, index=df.index)
+
+
+def summarize_flags(flags: DataFrame) -> DataFrame:
+    """
+    Count each flag value in every flag column.
+    """
+    block = flags.to_numpy(uint8)
+    return DataFrame(
+        {each.name.lower(): (block == each).sum(axis=0) for each in Flag},
+        index=flags.columns,
+    )
+
+
+# Compiled configuration files, checked against modification time before reuse
+compiled_configs: dict[Path, tuple[int, QartodConfig]] = {}
+
+
+def load_qartod_config(path: Path = QARTOD_CONFIG) -> QartodConfig:
+    """
+    Parse and compile a weather QARTOD configuration file.
+    """
+    if not path.exists():
+        raise FileNotFoundError(f"QARTOD configuration file not found: {path}")
+    modified = path.stat().st_mtime_ns
+    cached = compiled_configs.get(path)
+    if cached is None or cached[0] != modified:
+        with open(path, "r", encoding="utf-8") as fid:
+            cached = (modified, QartodConfig(safe_load(fid)))
+        compiled_configs[path] = cached
+    else:
+        metrics.inc("penbay_cache_hits_total", cache="weather_qartod_configs")
+    return cached[1]
@@ -1,3 +1,4 @@
 #!/bin/ash
 python3 weewx-data/template.py
+python3 weewx-data/tailer.py &
 python3 weewx/src/weewxd.py
@@ -0,0 +1,361 @@
+"""
+Run inside the docker container, next to `weewxd`, to write new WeeWX
+archive records to InfluxDB in batches. Replaces the `user.influx.Influx`
+RESTful service, which posts records one at a time as they are archived,
+and loses them when the cellular link is down.
+
+Records are found by `dateTime`, the primary key of the `archive` table,
+after a watermark that is kept on disk. Each batch is encoded as line
+protocol, compressed, and saved to a spool directory before the watermark
+moves past it, so that records survive outages and restarts. Spooled
+batches are sent oldest first. Sending stops at the first failure, and is
+tried again with exponential backoff. Only batches that the server refuses
+as malformed are moved aside, instead of blocking the rest. Failures of
+authorization, or a missing bucket, are retried too, so that the spool is
+kept until the configuration is fixed.
+
+Progress is written as a Prometheus textfile, when `TAILER_METRICS` is
+set, for the node exporter collector of the Grafana Alloy container.
+
+Only the standard library is used, because the container doesn't have the
+dependencies of the CLI. Configured from the container environment, like
+`template.py`.
+"""
+
+import gzip
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from http.client import HTTPException
+from pathlib import Path
+from random import uniform
+from time import sleep
+from typing import Optional
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+ARCHIVE = "/root/weewx-data/archive/weewx.sdb"
+SPOOL = "/root/weewx-data/spool"
+SUFFIX = ".lp.gz"
+# Longest wait between attempts to flush the spool, in seconds
+MAX_BACKOFF = 900.0
+# Statuses of batches that are refused as malformed or too large
+REJECTED = (400, 413, 422)
+# Statuses of a wrong token, bucket, or URL, that every batch fails with
+MISCONFIGURED = (401, 403, 404)
+# Help and type of each metric in the textfile
+METRICS = {
+    "penbay_tailer_records_spooled_total": ("counter", "Archive records spooled by the tailer."),
+    "penbay_tailer_batches_written_total": ("counter", "Spooled batches written to InfluxDB."),
+    "penbay_tailer_batches_rejected_total": ("counter", "Spooled batches refused by InfluxDB as malformed."),
+    "penbay_tailer_write_failures_total": ("counter", "Attempts to flush the spool that failed."),
+    "penbay_tailer_spooled_batches": ("gauge", "Batches in the spool waiting to be written."),
+    "penbay_tailer_watermark_seconds": ("gauge", "dateTime of the last archive record that was spooled."),
+}
+
+log = logging.getLogger("tailer")
+
+
+def escape(value: str, characters: str) -> str:
+    """
+    Backslash escape special characters in one element of line protocol.
+    Give backslashes first, so that they aren't escaped twice.
+    """
+    for character in characters:
+        value = value.replace(character, "\\" + character)
+    return value
+
+
+def encode_records(
+    columns: list[str], rows: list[tuple], measurement: str, tags: dict[str, str]
+) -> list[str]:
+    """
+    Encode archive records as line protocol with second precision. Every
+    value is written as a float, like the RESTful service did, so that
+    fields keep the same type in the database. Missing values are skipped.
+    """
+    prefix = escape(measurement, ", ") + "".join(
+        f",{escape(key, ', =')}={escape(value, ', =')}" for key, value in sorted(tags.items()) if value
+    )
+    keys = [escape(name, ", =") for name in columns]
+    time = columns.index("dateTime")
+    lines = []
+    for row in rows:
+        fields = ",".join(
+            f"{key}={float(value)!r}"
+            for index, (key, value) in enumerate(zip(keys, row))
+            if index != time and isinstance(value, (int, float))
+        )
+        if fields:
+            lines.append(f"{prefix} {fields} {row[time]}")
+    return lines
+
+
+class Spool:
+    """
+    Compressed batches of line protocol waiting to be sent, and the
+    watermark of the last archive record that was spooled. Files are
+    written to a temporary name, synced, and renamed, so that a power
+    cut never leaves a partial batch. Batches are named by the `dateTime`
+    of their last record, so that they sort in time order.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.rejected = path / "rejected"
+        self.rejected.mkdir(parents=True, exist_ok=True)
+
+    def replace(self, name: str, data: bytes):
+        """
+        Atomically write a file in the spool directory.
+        """
+        temporary = self.path / (name + ".tmp")
+        with open(temporary, "wb") as fid:
+            fid.write(data)
+            fid.flush()
+            os.fsync(fid.fileno())
+        temporary.replace(self.path / name)
+
+    @property
+    def watermark(self) -> Optional[int]:
+        """
+        `dateTime` of the last record that was spooled.
+        """
+        path = self.path / "watermark"
+        return int(path.read_text(encoding="utf-8")) if path.exists() else None
+
+    def put(self, last: int, lines: list[str]):
+        """
+        Save a batch, and then move the watermark past it. If the process
+        stops in between, the same records are read and spooled again.
+        """
+        if lines:
+            self.replace(f"{last:012d}{SUFFIX}", gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+        self.replace("watermark", str(last).encode("utf-8"))
+
+    def batches(self) -> list[Path]:
+        """
+        Spooled batches, oldest first.
+        """
+        return sorted(self.path.glob("*" + SUFFIX))
+
+    def reject(self, batch: Path):
+        """
+        Move a batch that the server won't accept out of the way.
+        """
+        batch.replace(self.rejected / batch.name)
+
+
+def write_metrics(path: Path, values: dict[str, float]):
+    """
+    Replace a textfile for the node exporter textfile collector. The file
+    is written to a temporary name and renamed, so that a scrape never
+    sees a partial write. Values are written in full, because timestamps
+    and long running counters lose digits in the shortest format.
+    """
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        if name in values:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            lines.append(f"{name} {float(values[name])!r}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    temporary.replace(path)
+
+
+def is_rejected(error: Exception) -> bool:
+    """
+    Whether the server refused a batch itself, so that it will be refused
+    again. Throttling, timeouts, server errors, and dropped connections
+    are usually transient on cellular links, and a wrong token or bucket
+    fails every batch, so those are retried instead.
+    """
+    return isinstance(error, HTTPError) and error.code in REJECTED
+
+
+def retry_delay(error: Exception, attempt: int, backoff: float) -> float:
+    """
+    Exponential backoff with jitter, unless the server asked for a delay.
+    Either is at most `MAX_BACKOFF`, so that a proxy asking for hours
+    doesn't stall the spool.
+    """
+    headers = getattr(error, "headers", None)
+    try:
+        delay = float((headers.get("Retry-After") if headers else None) or "")
+    except ValueError:
+        delay = min(backoff * 2 ** min(attempt, 32), MAX_BACKOFF) * uniform(0.5, 1.0)
+    return min(max(delay, 0.0), MAX_BACKOFF)
+
+
+class ArchiveTailer:
+    """
+    Follow the archive table of a WeeWX SQLite database, spool new records,
+    and flush the spool to the InfluxDB v2 compatible write endpoint.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-instance-attributes
+    def __init__(
+        self,
+        archive: Path,
+        spool: Path,
+        server_url: str,
+        bucket: str,
+        token: str,
+        measurement: str,
+        tags: dict[str, str],
+        batch_size: int = 1000,
+        max_batches: int = 1000,
+        timeout: float = 30.0,
+        metrics: Optional[Path] = None,
+    ):
+        self.archive = archive
+        self.spool = Spool(spool)
+        self.url = server_url.rstrip("/") + "/api/v2/write?" + urlencode({"bucket": bucket, "precision": "s"})
+        self.token = token
+        self.measurement = measurement
+        self.tags = tags
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.timeout = timeout
+        self.metrics = metrics
+        self.counts = {name: 0.0 for name, (kind, _) in METRICS.items() if kind == "counter"}
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the database read-only. Unlike reading a copy of the archive,
+        `weewxd` is writing to it, so it can't be opened as immutable.
+        """
+        uri = f"{self.archive.resolve().as_uri()}?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=self.timeout)
+
+    def tail(self) -> int:
+        """
+        Spool records after the watermark, a batch at a time, until there
+        are no more or the spool is full. A full spool stops reading rather
+        than dropping batches, because the records are still in the archive.
+        Returns the number of records spooled.
+        """
+        total = 0
+        with closing(self.connect()) as connection:
+            while len(self.spool.batches()) < self.max_batches:
+                cursor = connection.execute(
+                    "SELECT * FROM archive WHERE dateTime > ? ORDER BY dateTime LIMIT ?",
+                    (self.spool.watermark or 0, self.batch_size),
+                )
+                columns = [each[0] for each in cursor.description]
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last = rows[-1][columns.index("dateTime")]
+                self.spool.put(last, encode_records(columns, rows, self.measurement, self.tags))
+                total += len(rows)
+                self.counts["penbay_tailer_records_spooled_total"] += len(rows)
+        return total
+
+    def send(self, data: bytes):
+        """
+        Post one compressed batch of line protocol.
+        """
+        request = Request(
+            self.url,
+            data=data,
+            method="POST",
+            headers={
+                "Authorization": f"Token {self.token}",
+                "Content-Encoding": "gzip",
+                "Content-Type": "text/plain; charset=utf-8",
+            },
+        )
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def flush(self) -> int:
+        """
+        Send spooled batches oldest first, deleting each one once it is
+        written. Rejected batches are moved aside. Other failures are
+        raised, and leave the rest of the spool in place. Returns the number
+        of batches written.
+        """
+        written = 0
+        for batch in self.spool.batches():
+            try:
+                self.send(batch.read_bytes())
+            except OSError as error:  # Including HTTPError and URLError
+                if not is_rejected(error):
+                    raise
+                log.error("Rejected %s: %s", batch.name, error)
+                self.spool.reject(batch)
+                self.counts["penbay_tailer_batches_rejected_total"] += 1
+                continue
+            batch.unlink()
+            written += 1
+            self.counts["penbay_tailer_batches_written_total"] += 1
+        return written
+
+    def export(self):
+        """
+        Write the counters, and the state of the spool, to the textfile. A
+        failure is only logged, because metrics mustn't stop the tailer.
+        """
+        if self.metrics is None:
+            return
+        values = {**self.counts, "penbay_tailer_spooled_batches": len(self.spool.batches())}
+        if self.spool.watermark is not None:
+            values["penbay_tailer_watermark_seconds"] = self.spool.watermark
+        try:
+            write_metrics(self.metrics, values)
+        except OSError as error:
+            log.warning("Could not write %s: %s", self.metrics, error)
+
+    def run(self, interval: float = 60.0, backoff: float = 5.0):
+        """
+        Tail and flush forever, every `interval` seconds while the link is
+        up, and backing off while it is down.
+        """
+        attempt = 0
+        while True:
+            try:
+                spooled = self.tail()
+            except sqlite3.Error as error:
+                log.warning("Could not read %s: %s", self.archive, error)
+                spooled = 0
+            try:
+                written = self.flush()
+            except (OSError, HTTPException) as error:  # Including IncompleteRead
+                delay = retry_delay(error, attempt, backoff)
+                attempt += 1
+                self.counts["penbay_tailer_write_failures_total"] += 1
+                fatal = isinstance(error, HTTPError) and error.code in MISCONFIGURED
+                (log.error if fatal else log.warning)(
+                    "Write failed, %d batches spooled, retrying in %.0f s: %s",
+                    len(self.spool.batches()), delay, error,
+                )
+                self.export()
+                sleep(delay)
+                continue
+            attempt = 0
+            if spooled or written:
+                log.info("Spooled %d records, wrote %d batches", spooled, written)
+            self.export()
+            sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    ArchiveTailer(
+        archive=Path(os.getenv("WEEWX_SQLITE") or ARCHIVE),
+        spool=Path(os.getenv("TAILER_SPOOL") or SPOOL),
+        server_url=os.environ["INFLUX_SERVER_URL"],
+        bucket=os.environ["INFLUX_BUCKET"],
+        token=os.environ["INFLUX_API_TOKEN"],
+        measurement=os.environ["INFLUX_MEASUREMENT"],
+        tags={
+            "binding": os.getenv("INFLUX_BINDING") or "archive",
+            "location": os.getenv("TEMPLATE_STATION_LOCATION", ""),
+        },
+        batch_size=int(os.getenv("TAILER_BATCH_SIZE", "1000")),
+        metrics=Path(os.environ["TAILER_METRICS"]) if os.getenv("TAILER_METRICS") else None,
+    ).run(interval=float(os.getenv("TAILER_INTERVAL", "60")))
@@ -5,16 +5,59 @@ Decorated commands need to be run with `standalone_mode=False`, or
 tests will fail due to a system exit event.
 """
 
+from datetime import datetime, timezone
+from email.message import Message
+import gzip
+from http.client import IncompleteRead
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sqlite3
+from threading import Thread
+from urllib.error import HTTPError
 import pytest
+from numpy import nan, uint8
+from numpy.ma import filled
+from pandas import DataFrame, DatetimeIndex, Series, Timedelta, Timestamp, concat, date_range, read_parquet
+from pyarrow import Table
+import click
 from click.testing import CliRunner
 from . import (
+    DASHBOARD,
+    STATIONS,
+    StationName,
+    WeatherLinkArchive,
+    align_stations,
+    StandardNames,
+    WEATHER_LINK_TIME_ZONE,
+    WeeWxInfluxArchive,
+    WeeWxSqliteArchive,
+    STATION,
+    downsample,
+    find_gaps,
+    monitor_records,
+    monitor_update,
+    parse_clock_times,
+    select_window,
+    weewx_archive,
+    weewx_query,
+    weather_db_dashboard,
+    weather_compare,
     weather_db_describe,
     weather_file_describe,
     weather_file_export,
+    weather_monitor,
     weather_plot_daily,
     weather_plot_tail,
     weather_describe_series,
+    weather_qc_describe,
+    weather_qc_export,
 )
+from lib import local_to_utc
+from .derived import derive
+from .monitor import GapIndex
+from .qartod import Flag, QartodConfig
+from . import tailer as tailer_module
+from .tailer import MAX_BACKOFF, ArchiveTailer, retry_delay
 
 runner = CliRunner()
 by_station = pytest.mark.parametrize("name", ["apprenticeshop"])
@@ -48,6 +91,37 @@ def test_cli_weather_file_export(name):
     assert result.exit_code == 0
 
 
+@pytest.mark.parametrize("file_format", ["parquet", "netcdf"])
+def test_cli_weather_file_export_typed(tmp_path, file_format):
+    """
+    Expect typed exports, written in chunks, to match the normalized
+    frame and carry CF standard names and units
+    """
+    output = tmp_path / f"apprenticeshop.{file_format}"
+    args = ["apprenticeshop", "--format", file_format, "--output", str(output), "--chunksize", "500"]
+    result = runner.invoke(weather_file_export, args)
+    assert result.exit_code == 0, result.output
+    expected = WeatherLinkArchive("apprenticeshop").df
+    if file_format == "parquet":
+        from pyarrow.parquet import ParquetFile  # pylint: disable=import-outside-toplevel
+
+        assert read_parquet(output).equals(expected)
+        field = ParquetFile(output).schema_arrow.field("air_temperature")
+        assert field.metadata[b"units"] == b"K"
+        return
+    netcdf = pytest.importorskip("h5netcdf.legacyapi")
+    with netcdf.Dataset(output) as dataset:
+        assert dataset.Conventions == "CF-1.8"
+        assert dataset["air_pressure"].standard_name == "air_pressure"
+        assert dataset["wind_speed"].units == "m s-1"
+        # Station clock times are written in UTC
+        times = dataset["time"][:]
+        local = expected.index.tz_localize("America/New_York", ambiguous="infer", nonexistent="shift_forward")
+        assert list(times) == list(local.as_unit("ns").asi8 / 1e9)
+        values = filled(dataset["air_temperature"][:], nan)
+    assert (abs(values - expected["air_temperature"].to_numpy()) < 1e-9).sum() == expected["air_temperature"].count()
+
+
 @by_station
 @by_observed_property
 def test_cli_weather_plot_tail(name, observed_property):
@@ -87,3 +161,607 @@ def test_cli_weather_db_describe():
     """
     result = runner.invoke(weather_db_describe, [])
     assert result.exit_code == 0
+
+
+def test_weewx_query_pushdown():
+    """
+    Expect the time window, columns, and aggregation to be part of the query
+    """
+    query = weewx_query(
+        "archive",
+        start=datetime(2026, 1, 1),
+        series=[StandardNames.AIR_TEMPERATURE],
+        every="1h",
+    )
+    assert "avg(\"outTemp\")" in query
+    assert "INTERVAL '3600 seconds'" in query
+    assert "time > '2026-01-01T00:00:00'" in query
+    with pytest.raises(ValueError):
+        weewx_query("archive", series=[StandardNames.WIND_FROM_DIRECTION], every="1h")
+
+
+def test_select_window_matches_pushdown():
+    """
+    Expect cached records to be windowed and binned like the query would
+    """
+    table = Table.from_pandas(DataFrame({
+        "time": date_range("2026-01-01", periods=24, freq="15min"),
+        "outTemp": [float(each) for each in range(24)],
+        "outHumidity": [float(each) for each in range(24)],
+    }))
+    selected = select_window(
+        table, start=datetime(2026, 1, 1, 1), series=[StandardNames.AIR_TEMPERATURE], every="1h"
+    )
+    assert selected.column_names == ["time", "outTemp"]
+    assert selected["outTemp"].to_pylist()[:2] == [6.0, 9.5]
+
+
+def test_find_gaps():
+    """
+    Expect only local rows without a nearby remote record, grouped into intervals
+    """
+    local = date_range("2026-01-01", periods=10, freq="h")
+    remote = date_range("2026-01-01 00:05", periods=10, freq="h").delete([2, 3, 8])
+    missing, gaps = find_gaps(local, remote[::-1], Timedelta(minutes=30))
+    assert missing.sum() == 3
+    assert gaps["rows"].tolist() == [2, 1]
+    assert gaps["start"].tolist() == [local[2], local[8]]
+    assert gaps["end"].tolist() == [local[3], local[8]]
+    missing, gaps = find_gaps(local, remote[:0], Timedelta(minutes=30))
+    assert missing.all() and len(gaps) == 1
+
+
+def test_find_gaps_across_clocks():
+    """
+    Expect WeatherLink times on the station clock to match WeeWX times in
+    UTC once converted, including the hour repeated when clocks fall back
+    """
+    local = DatetimeIndex([Timestamp(f"2026-11-01 {hour}") for hour in ["00:00", "01:00", "01:00", "02:00"]])
+    remote = date_range("2026-11-01 04:00", periods=4, freq="h")
+    missing, _ = find_gaps(local, remote, Timedelta(minutes=5))
+    assert missing.sum() == 4
+    utc = local_to_utc(local, WEATHER_LINK_TIME_ZONE)
+    assert list(utc) == list(remote)
+    missing, gaps = find_gaps(utc, remote.delete(2), Timedelta(minutes=5))
+    assert missing.tolist() == [False, False, True, False]
+    assert gaps["start"].tolist() == [Timestamp("2026-11-01 06:00")]
+
+
+def test_downsample_vector_mean():
+    """
+    Expect scalar statistics per bin, and wind directions averaged as vectors
+    """
+    index = date_range("2026-01-01", periods=4, freq="30min")
+    df = DataFrame({
+        "outTemp": [30.0, 32.0, 34.0, 36.0],
+        "windSpeed": [2.0, 2.0, 1.0, 0.0],
+        "windDir": [350.0, 10.0, 90.0, 180.0],
+    }, index=index)
+    hourly = downsample(df, "1h")
+    assert hourly["outTemp_mean"].tolist() == [31.0, 35.0]
+    assert hourly["outTemp_max"].tolist() == [32.0, 36.0]
+    assert "windDir_mean" not in hourly.columns
+    assert abs(hourly["windDir_vector"].iloc[0] % 360) < 1e-9
+    assert abs(hourly["windDir_vector"].iloc[1] - 90.0) < 1e-9
+
+
+
+def test_downsample_stations():
+    """
+    Expect stations that share a measurement to be aggregated apart, and
+    keep their location tag
+    """
+    index = date_range("2026-01-01", periods=2, freq="30min").repeat(2)
+    df = DataFrame({"outTemp": [30.0, 50.0, 32.0, 52.0], "location": ["Rockland", "Workshop"] * 2}, index=index)
+    hourly = downsample(df, "1h")
+    assert hourly["location"].tolist() == ["Rockland", "Workshop"]
+    assert hourly["outTemp_mean"].tolist() == [31.0, 51.0]
+
+
+def test_cli_weather_db_dashboard(tmp_path):
+    """
+    Expect archive queries in time series and wind rose panels to switch
+    resolution by interval
+    """
+    path = tmp_path / "weather.json"
+    path.write_text(DASHBOARD.read_text(encoding="utf-8"), encoding="utf-8")
+    result = runner.invoke(weather_db_dashboard, ["--path", str(path)])
+    assert result.exit_code == 0
+    panels = json.loads(path.read_text(encoding="utf-8"))["panels"]
+    queries = [
+        target["rawSql"]
+        for panel in panels if panel["type"] == "timeseries"
+        for target in panel["targets"] if "observations_1d" in target.get("rawSql", "")
+    ]
+    assert len(queries) == 4
+    assert all("$__interval_ms >= 86400000" in each for each in queries)
+    # Gusts are the strongest in a bin, and directions vector means
+    assert any('"windGust_max" AS "windGust"' in each for each in queries)
+    assert not any("windGust_mean" in each for each in queries)
+    windrose = [panel for panel in panels if panel["type"] == "operato-windrose-panel"][0]
+    assert '"windDir_vector" AS "windDir"' in windrose["targets"][0]["rawSql"]
+    assert '"windSpeed_vector" AS "windSpeed"' in windrose["targets"][0]["rawSql"]
+
+
+def test_parse_clock_times():
+    """
+    Expect 12 hour WeatherLink times, including midnight and noon
+    """
+    index = parse_clock_times(
+        Series(["05/09/25", "05/09/25", "05/10/25", "05/10/25"]),
+        Series(["7:00 p", "11:30 p", "12:00 a", "12:05 p"]),
+    )
+    assert index.tolist() == [
+        Timestamp("2025-05-09 19:00"),
+        Timestamp("2025-05-09 23:30"),
+        Timestamp("2025-05-10 00:00"),
+        Timestamp("2025-05-10 12:05"),
+    ]
+
+
+def test_derive():
+    """
+    Expect derived variables to match National Weather Service tables,
+    to keep source values where inputs are missing, and to agree with
+    those precomputed in WeatherLink exports
+    """
+    df = DataFrame(
+        {
+            "air_temperature": [293.15, 305.372222, 255.372222, nan],
+            "relative_humidity": [0.5, 0.7, 0.5, 0.5],
+            "wind_speed": [0.0, 0.0, 15 * 0.44704, 1.0],
+            "surface_air_pressure": [100000.0, 100000.0, 100000.0, 100000.0],
+            "dew_point_temperature": [nan, nan, nan, 280.0],
+        },
+        index=date_range("2026-01-01", periods=4, freq="h"),
+    )
+    derived = derive(df, altitude=100.0)
+    fahrenheit = (derived - 273.15) * 9 / 5 + 32
+    assert abs(derived["dew_point_temperature"].iloc[0] - 282.40) < 0.01
+    assert round(fahrenheit["heat_index_of_air_temperature"].iloc[1]) == 106
+    assert round(fahrenheit["wind_chill_of_air_temperature"].iloc[2]) == -19
+    assert derived["dew_point_temperature"].iloc[3] == 280.0
+    assert abs(derived["air_pressure"].iloc[0] - 101171) < 1
+    assert "air_pressure" not in derive(df)
+    archive = WeatherLinkArchive("apprenticeshop").df
+    recomputed = derive(archive)
+    assert (recomputed["dew_point_temperature"] - archive["dew_point_temperature"]).abs().max() < 0.1
+
+
+def weewx_sdb(path):
+    """
+    A WeeWX archive database with a day of 5 minute records in US units
+    """
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE archive (dateTime INTEGER NOT NULL PRIMARY KEY, usUnits INTEGER NOT NULL, "
+            "interval INTEGER NOT NULL, outTemp REAL, windSpeed REAL, windDir REAL)"
+        )
+        start = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+        connection.executemany(
+            "INSERT INTO archive VALUES (?, 1, 5, ?, 10.0, 90.0)",
+            [(start + 300 * each, 32.0 + each % 12) for each in range(288)],
+        )
+    return path
+
+
+def test_weewx_sqlite_archive(tmp_path):
+    """
+    Expect chunked reads, converted to standard units, within the window and
+    columns asked for, and missing columns skipped
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    archive = WeeWxSqliteArchive(path, chunksize=100)
+    # Nothing is read until it is streamed, or asked for whole
+    assert "df" not in vars(archive)
+    assert [len(each) for each in archive.chunks()] == [100, 100, 88]
+    df = archive.df
+    assert len(df) == 288 and df.index.is_monotonic_increasing
+    assert list(df.columns) == ["air_temperature", "wind_speed", "wind_from_direction"]
+    assert df["air_temperature"].iloc[0] == 273.15
+    window = WeeWxSqliteArchive(
+        path,
+        start=datetime(2026, 1, 1, 1),
+        end=datetime(2026, 1, 1, 3),
+        series=[StandardNames.AIR_TEMPERATURE, StandardNames.AIR_PRESSURE],
+        every="1h",
+    ).df
+    assert list(window.columns) == ["air_temperature"]
+    # Records after the start and through the end, binned on the hour
+    assert list(window.index.hour) == [1, 2, 3]
+
+
+def test_weewx_archive_calendar_bins(tmp_path):
+    """
+    Expect calendar frequencies to be averaged locally from raw rows,
+    because the database can only bin by fixed widths
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    weekly = WeeWxSqliteArchive(path, series=[StandardNames.AIR_TEMPERATURE], every="W").df
+    assert list(weekly.index) == [Timestamp("2026-01-04")]
+    assert weekly["air_temperature"].iloc[0] == pytest.approx((37.5 - 32) * 5 / 9 + 273.15)
+    with pytest.raises(ValueError):
+        weewx_query("weewx", series=[StandardNames.AIR_TEMPERATURE], every="ME")
+    with pytest.raises(ValueError):
+        WeeWxSqliteArchive(path, series=[StandardNames.WIND_FROM_DIRECTION], every="W")
+
+
+def test_weewx_archive_station():
+    """
+    Expect records of one station to need its location tag, because every
+    station is stored in the same measurement
+    """
+    with pytest.raises(click.ClickException):
+        weewx_archive("weewx", "token", "http://localhost:8181", station=StationName.DEV)
+
+
+class StubInflux(BaseHTTPRequestHandler):
+    """
+    Answer writes with the next queued status, and keep the lines of
+    accepted ones
+    """
+
+    statuses: list[int] = []
+    lines: list[str] = []
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Decompress and record a write request
+        """
+        body = gzip.decompress(self.rfile.read(int(self.headers["Content-Length"])))
+        status = self.statuses.pop(0) if self.statuses else 204
+        if status == 204:
+            assert self.path.startswith("/api/v2/write?bucket=weather&precision=s")
+            assert self.headers["Authorization"] == "Token secret"
+            self.lines.extend(body.decode("utf-8").splitlines())
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keep test output quiet
+        """
+
+
+def test_archive_tailer(tmp_path):
+    """
+    Expect new archive records to be spooled while the server is down, sent
+    in order once it is back, malformed batches to be moved aside, batches
+    refused for authorization to be kept, and a restarted tailer to pick up after the watermark.
+    Expect progress in a textfile for the node exporter
+    """
+    archive = weewx_sdb(tmp_path / "weewx.sdb")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInflux)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        kwargs = {
+            "archive": archive,
+            "spool": tmp_path / "spool",
+            "server_url": f"http://127.0.0.1:{server.server_port}",
+            "bucket": "weather",
+            "token": "secret",
+            "measurement": "observations",
+            "tags": {"binding": "archive", "location": "Rockland"},
+            "batch_size": 100,
+            "metrics": tmp_path / "metrics" / "tailer.prom",
+        }
+        tailer = ArchiveTailer(**kwargs)
+        StubInflux.statuses[:] = [503]
+        assert tailer.tail() == 288
+        with pytest.raises(OSError):
+            tailer.flush()
+        assert len(tailer.spool.batches()) == 3 and not StubInflux.lines
+        # A wrong token fails every batch, which are kept until it is fixed
+        StubInflux.statuses[:] = [401]
+        with pytest.raises(OSError):
+            tailer.flush()
+        assert len(tailer.spool.batches()) == 3 and not any(tailer.spool.rejected.iterdir())
+        StubInflux.statuses[:] = [400]
+        assert tailer.flush() == 2
+        assert not tailer.spool.batches()
+        assert len(list(tailer.spool.rejected.iterdir())) == 1
+        assert len(StubInflux.lines) == 188
+        tailer.export()
+        lines = (tmp_path / "metrics" / "tailer.prom").read_text(encoding="utf-8").splitlines()
+        assert "# TYPE penbay_tailer_records_spooled_total counter" in lines
+        assert "penbay_tailer_records_spooled_total 288.0" in lines
+        assert "penbay_tailer_batches_written_total 2.0" in lines
+        assert "penbay_tailer_batches_rejected_total 1.0" in lines
+        assert "penbay_tailer_spooled_batches 0.0" in lines
+        watermark = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()) + 300 * 287
+        assert f"penbay_tailer_watermark_seconds {float(watermark)!r}" in lines
+        first = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()) + 300 * 100
+        assert StubInflux.lines[0] == (
+            "observations,binding=archive,location=Rockland "
+            f"usUnits=1.0,interval=5.0,outTemp=36.0,windSpeed=10.0,windDir=90.0 {first}"
+        )
+        with sqlite3.connect(archive) as connection:
+            connection.execute(
+                "INSERT INTO archive VALUES (?, 1, 5, NULL, 12.0, 180.0)", (first + 300 * 188,)
+            )
+        restarted = ArchiveTailer(**kwargs)
+        assert restarted.tail() == 1 and restarted.flush() == 1
+        assert StubInflux.lines[-1].endswith(
+            f" usUnits=1.0,interval=5.0,windSpeed=12.0,windDir=180.0 {first + 300 * 188}"
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_tailer_retry(tmp_path, monkeypatch):
+    """
+    Expect Retry-After to be capped by the longest backoff, and a response
+    cut short to be retried like a dropped connection
+    """
+    for value, delay in (("10", 10.0), ("86400", MAX_BACKOFF)):
+        error = HTTPError("http://localhost", 503, "Unavailable", Message(), None)
+        error.headers["Retry-After"] = value
+        assert retry_delay(error, 0, 5.0) == delay
+    assert retry_delay(OSError(), 100, 5.0) <= MAX_BACKOFF
+    tailer = ArchiveTailer(
+        weewx_sdb(tmp_path / "weewx.sdb"), tmp_path / "spool", "http://localhost", "weather", "secret",
+        "observations", {}, metrics=tmp_path / "tailer.prom",
+    )
+
+    def cut_short(data):
+        raise IncompleteRead(b"", 10)
+
+    def stop(delay):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(tailer, "send", cut_short)
+    monkeypatch.setattr(tailer_module, "sleep", stop)
+    with pytest.raises(KeyboardInterrupt):
+        tailer.run()
+    assert tailer.counts["penbay_tailer_write_failures_total"] == 1
+    assert len(tailer.spool.batches()) == 1
+
+
+def test_cli_weather_db_describe_sqlite(tmp_path):
+    """
+    Expect a summary of a WeeWX archive database without InfluxDB
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    result = runner.invoke(weather_db_describe, ["--sqlite", str(path)])
+    assert result.exit_code == 0
+    assert "air_temperature" in result.output
+
+
+def test_qartod_config_run():
+    """
+    Expect vectorized tests to flag each series with their own thresholds,
+    and the rollup to take the worst evaluated flag
+    """
+    config = QartodConfig({"streams": {
+        "a": {"qartod": {
+            "gross_range_test": {"suspect_span": [0, 10], "fail_span": [-5, 20]},
+            "spike_test": {"suspect_threshold": 3, "fail_threshold": 6},
+            "flat_line_test": {"tolerance": 0.01, "suspect_threshold": 600, "fail_threshold": 1200},
+        }},
+        "b": {"qartod": {"gross_range_test": {"fail_span": [0, 1]}}},
+        "c": {"qartod": {"gross_range_test": {"fail_span": [0, 1]}}},
+    }})
+    df = DataFrame(
+        {"a": [1, 2, 15, 2, 2, 2, 2, 2, nan, -6], "b": [0.5] * 9 + [2]},
+        index=date_range("2026-01-01", periods=10, freq="5min"),
+    )
+    flags = config.run(df)
+    assert all(dtype == uint8 for dtype in flags.dtypes)
+    assert not any(each.startswith("c_") for each in flags.columns)
+    assert list(flags["a_qartod_gross_range"]) == [1, 1, 3, 1, 1, 1, 1, 1, 9, 4]
+    # Neighbors of a spike also differ from the mean around them
+    assert list(flags["a_qartod_spike"]) == [2, 3, 4, 4, 1, 1, 1, 1, 9, 2]
+    assert list(flags["a_qartod_flat_line"]) == [1, 1, 1, 1, 1, 3, 3, 4, 9, 1]
+    assert list(flags["a_qartod_rollup"]) == [1, 3, 4, 4, 1, 3, 3, 4, 9, 4]
+    assert list(flags["b_qartod_rollup"]) == [Flag.GOOD] * 9 + [Flag.FAIL]
+
+
+def test_cli_weather_qc(tmp_path):
+    """
+    Expect flag counts for a WeatherLink export, and values with flags
+    exported from a WeeWX archive database
+    """
+    result = runner.invoke(weather_qc_describe, ["apprenticeshop"])
+    assert result.exit_code == 0
+    assert "air_pressure_qartod_rollup" in result.output
+    output = tmp_path / "flags.parquet"
+    args = ["apprenticeshop", "--source", "weewx", "--sqlite", str(weewx_sdb(tmp_path / "weewx.sdb"))]
+    result = runner.invoke(weather_qc_export, [*args, "--output", str(output)])
+    assert result.exit_code == 0
+    df = read_parquet(output)
+    assert len(df) == 288
+    assert (df["air_temperature_qartod_rollup"] == Flag.GOOD).sum() > 0
+
+
+def test_cli_weather_plot_tail_qartod(tmp_path):
+    """
+    Expect flags to be overlaid on local and remote data
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    result = runner.invoke(
+        weather_plot_tail,
+        ["apprenticeshop", "air_temperature", "--sqlite", str(path), "--qartod", "weather/qartod.yaml", "--days", "400"],
+    )
+    assert result.exit_code == 0, result.output
+
+
+@pytest.mark.parametrize("observed_property", ["wind_from_direction", "rainfall_amount", "air_temperature"])
+def test_cli_weather_plot_tail_resample(tmp_path, observed_property):
+    """
+    Expect series to be resampled with their own aggregator, and
+    directions to be queried with the speeds that weight them
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    result = runner.invoke(
+        weather_plot_tail,
+        ["apprenticeshop", observed_property, "--sqlite", str(path), "--resample", "1h", "--days", "400"],
+    )
+    assert result.exit_code == 0, result.output
+
+
+def test_station_registry():
+    """
+    Expect station names to come from the registry, with WeeWX locations
+    """
+    assert StationName("apprenticeshop") == StationName.APPRENTICESHOP
+    assert STATIONS["rockland"].location == "Rockland"
+    assert STATIONS["dev"].location is None
+
+
+def test_weewx_query_locations():
+    """
+    Expect many stations to be read with one tag filtered query, and
+    binned by station as well as time
+    """
+    query = weewx_query(
+        "archive",
+        series=[StandardNames.AIR_TEMPERATURE],
+        every="1h",
+        locations=["Rockland", "O'Brien"],
+    )
+    assert "\"location\" IN ('Rockland', 'O''Brien')" in query
+    assert query.endswith("GROUP BY 1, 2 ORDER BY time")
+    table = Table.from_pandas(DataFrame({
+        "time": date_range("2026-01-01", periods=8, freq="15min").repeat(2),
+        "location": ["Rockland", "Workshop"] * 8,
+        "outTemp": [float(each) for each in range(16)],
+    }))
+    selected = select_window(
+        table, series=[StandardNames.AIR_TEMPERATURE], every="1h", locations=["Workshop"]
+    )
+    assert selected.column_names == ["time", "location", "outTemp"]
+    assert selected["outTemp"].to_pylist() == [4.0, 12.0]
+
+
+def test_untagged_records(monkeypatch):
+    """
+    Expect records written before stations were tagged to be read as those
+    of the station that owns them, and only by it
+    """
+    query = weewx_query("archive", locations=["Apprenticeshop", None])
+    assert "(\"location\" IN ('Apprenticeshop') OR \"location\" IS NULL)" in query
+    table = Table.from_pandas(DataFrame({
+        "time": date_range("2026-01-01", periods=4, freq="h"),
+        "location": [None, None, "Apprenticeshop", "Workshop"],
+        "outTemp": [32.0, 33.0, 34.0, 35.0],
+    }))
+    series = [StandardNames.AIR_TEMPERATURE]
+    assert select_window(table, series=series, locations=["Workshop"])["outTemp"].to_pylist() == [35.0]
+    untagged = table.drop_columns(["location"]).slice(0, 2)
+    assert select_window(untagged, series=series, locations=["Apprenticeshop", None]).num_rows == 2
+
+    class Client:  # pylint: disable=too-few-public-methods
+        """
+        Answer every query with the records above, like a database that
+        filtered them
+        """
+
+        def __init__(self, **_):
+            pass
+
+        def query(self, sql, mode):  # pylint: disable=unused-argument
+            """
+            Keep the rows that the query's locations select
+            """
+            return select_window(table, locations=["Apprenticeshop", None] if "IS NULL" in sql else ["Workshop"])
+
+    monkeypatch.setattr("influxdb_client_3.InfluxDBClient3", Client)
+    df = weewx_archive("archive", "token", "http://localhost:8181", station=StationName.APPRENTICESHOP)
+    assert len(df) == 3 and STATION not in df.columns
+    stations = [STATIONS["apprenticeshop"], STATIONS["workshop"]]
+    df = WeeWxInfluxArchive("archive", "token", "http://localhost:8181", stations=stations).df
+    assert df["station"].tolist() == ["apprenticeshop"] * 3
+
+
+def test_align_stations():
+    """
+    Expect stations with different sampling times to share one time grid,
+    taking the nearest record within half the grid spacing
+    """
+    first = DataFrame({"x": [0.0, 1.0, 2.0, 3.0]}, index=date_range("2026-01-01 00:02", periods=4, freq="5min"))
+    second = DataFrame({"x": [0.0, 10.0]}, index=date_range("2026-01-01", periods=2, freq="10min").as_unit("us"))
+    df = concat([first.assign(station="b"), second.assign(station="a")])
+    aligned = align_stations(df, "5min")
+    assert list(aligned.columns) == [("a", "x"), ("b", "x")]
+    assert aligned[("a", "x")].iloc[:3].fillna(-1.0).tolist() == [0.0, -1.0, 10.0]
+    assert aligned[("b", "x")].tolist()[:4] == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_cli_weather_compare():
+    """
+    Expect stations without records from the source to be skipped
+    """
+    args = ["air_temperature", "--source", "weather_link", "--days", "4000"]
+    result = runner.invoke(weather_compare, [*args, "--station", "apprenticeshop", "--station", "workshop"])
+    assert result.exit_code == 0, result.output
+    assert "apprenticeshop" in result.output and "workshop" not in result.output
+
+
+def test_gap_index(tmp_path):
+    """
+    Expect gaps of records and of single variables, an open gap up to the
+    present, and late records to close the gaps they fill when the
+    overlapping window is read again
+    """
+    times = date_range("2026-01-01 01:00", periods=48, freq="h")
+    df = DataFrame({"air_temperature": 280.0, "wind_speed": 1.0}, index=times)
+    df.loc[times[20:30], "wind_speed"] = nan
+    late = df.index[10:13]
+    index = GapIndex(tmp_path / "monitor.json", 3600)
+    now = Timestamp("2026-01-03 05:30")
+    start, end = index.window("dev", now, days=2, overlap=12)
+    index.update("dev", df.drop(late), start, end)
+    index.save()
+    payload = GapIndex(tmp_path / "monitor.json", 3600).payload(now)["stations"]["dev"]
+    assert payload["latency"] == 5.5 * 3600
+    records = payload["variables"]["records"]["gaps"]
+    assert [(each["start"], each["missing"], each["open"]) for each in records] == [
+        ("2026-01-01T11:00:00", 3, False),
+        ("2026-01-03T01:00:00", 5, True),
+    ]
+    assert len(payload["variables"]["wind_speed"]["gaps"]) == len(records) + 1
+    now = Timestamp("2026-01-03 06:10")
+    start, end = index.window("dev", now, days=2, overlap=48)
+    index.update("dev", concat([df, df.iloc[-1:].set_axis([now.floor("h")])]), start, end)
+    payload = index.payload(now)["stations"]["dev"]
+    assert payload["latency"] == 600
+    gaps = payload["variables"]["records"]["gaps"]
+    assert [(each["start"], each["open"]) for each in gaps] == [("2026-01-03T01:00:00", False)]
+
+
+def test_monitor_records(tmp_path):
+    """
+    Expect records to be read without changing the index, so that the
+    daemon can query without holding its lock, and the update to apply them
+    """
+    path = weewx_sdb(tmp_path / "weewx.sdb")
+    index = GapIndex(tmp_path / "monitor.json", 3600)
+    now = Timestamp("2026-01-02 06:00")
+    records = monitor_records(index, [STATIONS["dev"]], now, days=2, overlap=12, sqlite=path)
+    assert not index.stations and not index.path.exists()
+    df, start, end = records["dev"]
+    assert (start, end) == (index.window("dev", now, 2, 12)) and len(df) == 288
+    monitor_update(index, records, now, retain=30)
+    assert index.checked("dev") == end and index.path.exists()
+
+
+def test_cli_weather_monitor_sqlite(tmp_path):
+    """
+    Expect the gap index of an archive database, with the hourly intervals
+    after its last record missing
+    """
+    days = (Timestamp.now() - Timestamp("2025-12-31")).days + 1
+    args = [
+        "--station", "dev", "--sqlite", str(weewx_sdb(tmp_path / "weewx.sdb")),
+        "--index", str(tmp_path / "monitor.json"), "--days", str(days),
+    ]
+    result = runner.invoke(weather_monitor, args)
+    assert result.exit_code == 0, result.output
+    payload = json.loads(result.output)["stations"]["dev"]
+    assert payload["variables"]["records"]["latest"] == "2026-01-02T00:00:00"
+    assert payload["variables"]["air_temperature"]["gaps"][-1]["open"]
+    assert set(payload["variables"]) == {"records", "air_temperature", "wind_speed", "wind_from_direction"}
+    result = runner.invoke(weather_monitor, args[2:])
+    assert result.exit_code != 0